@@ -9,6 +9,7 @@ import hmac
 import ipaddress
 import os
 import re
+import sys
 import time
 import uuid
 import logging
@@ -358,7 +359,8 @@ def _restore_handler_from_db(handler, session_id: str, assistant_id: str = None)
                 if msg.role not in ("user", "assistant", "tool"):
                     continue
                 entry = {
-                    "role": msg.role,
+                    # intern: роль из БД — та же строка, что литералы в хендлере
+                    "role": sys.intern(msg.role),
                     "content": msg.content or "",
                 }
                 if msg.tool_calls:
@@ -378,6 +380,12 @@ def _restore_handler_from_db(handler, session_id: str, assistant_id: str = None)
                 return False
 
             handler.full_history = restored_history
+            if hasattr(handler, "_last_assistant_content_lower"):
+                handler._last_assistant_content_lower = next(
+                    (e["content"].lower() for e in reversed(restored_history)
+                     if e.get("role") == "assistant" and e.get("content")),
+                    "",
+                )
             handler.input_list = []
             handler._pending_tour_cards = []
             handler._last_message_usage = None
@@ -685,6 +693,18 @@ def _build_handler(assistant_id: str = None):
     return handler_cls(runtime_config=runtime_config), runtime_config, provider
 
 
+def _close_chat_loop(loop, handler) -> None:
+    """Закрыть event loop хода; перед этим — общий HTTP-клиент TourVisor,
+    чьи keep-alive соединения привязаны к этому loop."""
+    tourvisor = getattr(handler, "tourvisor", None)
+    if tourvisor is not None:
+        try:
+            loop.run_until_complete(tourvisor.close())
+        except Exception as e:
+            logger.debug("tourvisor close failed: %s", e)
+    loop.close()
+
+
 def get_handler(session_id: str, assistant_id: str = None, *, channel: str = "widget"):
     """Получить или создать handler для сессии (thread-safe, assistant-aware).
 
@@ -2415,7 +2435,7 @@ def chat():
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         response = loop.run_until_complete(handler.chat(message))
-        loop.close()
+        _close_chat_loop(loop, handler)
         _new_entries = handler.full_history[_hist_before:]
 
         tour_cards = list(handler._pending_tour_cards)
@@ -2620,7 +2640,7 @@ def chat_v1():
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         reply = loop.run_until_complete(handler.chat(message))
-        loop.close()
+        _close_chat_loop(loop, handler)
         _new_entries = handler.full_history[_hist_before:]
 
         # ── Manager-handoff «поздняя отмена» ──────────────────────────────
@@ -2836,7 +2856,7 @@ def chat_stream():
     _stream_ua = getattr(g, "user_agent", None) or _client_user_agent()
     _stream_start = time.perf_counter()
     log(f"📊 Модель: {handler.model}", "INFO")
-    log(f"📊 История: {len(handler.input_list)} сообщений", "INFO")
+    log(f"📊 История: {len(handler.full_history)} сообщений", "INFO")
     
     def generate():
         with _session_chat_locks_guard:
@@ -2853,23 +2873,43 @@ def chat_stream():
             token_queue = queue.Queue()
             result = {'response': '', 'error': None}
             token_count = [0]
-            accumulated_text = ['']
+            # Куски ответа копим списком (не str +=); повтор первой строки
+            # ищем в скользящем окне — хвост текста длиной с первую строку.
+            head_parts = []
+            stream_len = [0]
+            window = ['', 0]   # [текст окна, абсолютная позиция его начала]
             first_line = [None]
             dedup_active = [False]
 
             def on_token(token):
-                accumulated_text[0] += token
+                stream_len[0] += len(token)
 
                 if first_line[0] is None:
-                    nl_idx = accumulated_text[0].find('\n')
-                    if nl_idx > 10:
-                        first_line[0] = accumulated_text[0][:nl_idx].strip()
-
-                if first_line[0] and len(accumulated_text[0]) > len(first_line[0]) + 50:
-                    second = accumulated_text[0].find(first_line[0], len(first_line[0]) + 1)
-                    if second > 0 and not dedup_active[0]:
+                    head_parts.append(token)
+                    if '\n' in token:
+                        head = "".join(head_parts)
+                        nl_idx = head.find('\n')
+                        if nl_idx > 10:
+                            first_line[0] = head[:nl_idx].strip()
+                            window[0] = head
+                        else:
+                            first_line[0] = ""   # короткая первая строка — dedup не нужен
+                        head_parts.clear()
+                elif first_line[0] and not dedup_active[0]:
+                    window[0] += token
+
+                _fl = first_line[0]
+                if _fl and not dedup_active[0] and stream_len[0] > len(_fl) + 50:
+                    _from = max(0, len(_fl) + 1 - window[1])
+                    _idx = window[0].find(_fl, _from)
+                    if _idx >= 0:
                         dedup_active[0] = True
-                        logger.debug("🧹 STREAM DEDUP: duplicate detected at char %d, stopping token emission", second)
+                        logger.debug("🧹 STREAM DEDUP: duplicate detected at char %d, stopping token emission",
+                                     window[1] + _idx)
+                    elif len(window[0]) >= len(_fl):
+                        _keep = len(_fl) - 1
+                        window[1] += len(window[0]) - _keep
+                        window[0] = window[0][-_keep:] if _keep else ""
 
                 if not dedup_active[0]:
                     token_queue.put(('token', token))
@@ -2884,7 +2924,7 @@ def chat_stream():
                     response = loop.run_until_complete(
                         handler.chat_stream(message, on_token=on_token)
                     )
-                    loop.close()
+                    _close_chat_loop(loop, handler)
                     _new_entries = handler.full_history[_hist_before:]
                     _tour_cards = getattr(handler, '_pending_tour_cards', []) or []
                     handler._pending_tour_cards = []
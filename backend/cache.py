@@ -10,6 +10,11 @@ from typing import Optional, Any
 
 import redis as redis_lib
 
+try:
+    import orjson  # опционально: быстрее разбор закэшированных словарей
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger("mgp_bot")
 
 _client: Optional[redis_lib.Redis] = None
@@ -59,7 +64,7 @@ def cache_get(key: str) -> Optional[Any]:
         raw = _client.get(key)
         if raw is None:
             return None
-        return json.loads(raw)
+        return orjson.loads(raw) if orjson is not None else json.loads(raw)
     except Exception:
         return None
 
@@ -16,11 +16,14 @@ OpenAI GPT Handler — миграция с Yandex GPT на OpenAI (GPT-5 Mini)
 
 import os
 import re
+import sys
 import json
 import asyncio
 import time
 import logging
-from typing import Optional, Dict, List
+from itertools import chain
+from types import SimpleNamespace
+from typing import Optional, Dict, List, Callable, Tuple
 from openai import OpenAI
 from dotenv import load_dotenv
 
@@ -28,24 +31,16 @@ try:
     from yandex_handler import (
         YandexGPTHandler,
         _is_promised_search,
-        _dedup_response,
-        _strip_reasoning_leak,
-        _strip_technical_ids,
-        _dedup_sentences,
-        _fix_merged_questions,
-        _strip_trailing_fragment,
+        _clean_response,
+        _Metrics,
         StreamCallback,
     )
 except ImportError:
     from backend.yandex_handler import (
         YandexGPTHandler,
         _is_promised_search,
-        _dedup_response,
-        _strip_reasoning_leak,
-        _strip_technical_ids,
-        _dedup_sentences,
-        _fix_merged_questions,
-        _strip_trailing_fragment,
+        _clean_response,
+        _Metrics,
         StreamCallback,
     )
 
@@ -57,11 +52,99 @@ logger = logging.getLogger("mgp_bot")
 # конфигурируется через env для нагрузочного/E2E-тестирования из высоколатентной среды.
 _CHAT_WALL_CLOCK_S = int(os.getenv("CHAT_WALL_CLOCK_S", "120"))
 
+# Streaming Chat Completions: tool_call, чьи аргументы уже пришли целиком,
+# запускается ДО конца стрима (перекрываем TourVisor RTT с хвостом ответа LLM).
+# OPENAI_STREAM=0 — прежний нестриминговый запрос.
+_OPENAI_STREAM = os.getenv("OPENAI_STREAM", "1").lower() not in ("0", "false", "no", "off")
+
+# chat_stream(): отдавать текст модели клиенту по мере генерации (on_token
+# на каждый delta). Выключено по умолчанию: safety-net'ы chat() могут отбросить
+# уже показанный текст и переспросить модель — клиент SSE должен заменять
+# пузырь финальным текстом из события 'done'. Требует OPENAI_STREAM=1.
+_OPENAI_STREAM_TOKENS = os.getenv("OPENAI_STREAM_TOKENS", "0").lower() not in ("0", "false", "no", "off")
+
+# Какие функции можно запускать досрочно: только те, что НЕ читают full_history
+# (assistant-сообщение с tool_calls попадает в историю уже после стрима).
+_EARLY_START_FUNCS = frozenset({"get_search_status"})
+
+# Имена функций с вынесенными общими префиксами (get_, get_search_, get_hot):
+# sre не факторизует альтернацию сам и на каждой позиции перебирал бы все
+# 10 веток; так — одна-две проверки до отказа.
 _RE_FUNC_NAMES = re.compile(
-    r'\(?(get_tour_details|search_tours|get_search_results|'
-    r'get_search_status|get_hotel_info|actualize_tour|'
-    r'get_hot_tours|continue_search|get_dictionaries|'
-    r'get_current_date)\)?',
+    r'\(?(get_(?:tour_details|search_(?:results|status)|hot(?:el_info|_tours)'
+    r'|dictionaries|current_date)|search_tours|actualize_tour|continue_search)\)?',
+    re.IGNORECASE
+)
+_RE_MULTISPACE = re.compile(r'\s{2,}')
+
+# Роли сообщений — интернированные строки: все записи full_history держат
+# один и тот же объект (см. _push_history), и сравнение ролей в горячих циклах
+# (_history_blocks, _cleanup_history) выходит на identity-ветку str.__eq__.
+_ROLE_USER = sys.intern("user")
+_ROLE_ASSISTANT = sys.intern("assistant")
+_ROLE_TOOL = sys.intern("tool")
+
+# Поля сообщения, которые принимает Chat Completions API, по роли
+_API_MESSAGE_KEYS = {
+    _ROLE_USER: frozenset({"role", "content"}),
+    _ROLE_ASSISTANT: frozenset({"role", "content", "tool_calls"}),
+    _ROLE_TOOL: frozenset({"role", "tool_call_id", "content"}),
+}
+
+# Длина превью ответа в логе; обрезка — спецификатором %.*s при форматировании
+# записи (срез не строится, если INFO выключен)
+_PREVIEW_CAP = 200
+_RE_TECH_ERROR = re.compile(r'(?:возникла\s+)?техническ\w+\s+ошибк\w+', re.IGNORECASE)
+# 402 от провайдера (в тексте исключения или в JSON-теле ошибки)
+_RE_ERR_402 = re.compile(r"\bError code:\s*402\b|['\"]code['\"]\s*:\s*402\b")
+
+# ── Safety-net паттерны chat(): вопрос бота / ответ клиента ──
+_RE_ALREADY_SHOWN = re.compile(
+    r'(?:горящие\s+)?туры?\s+уже\s+(?:показан|отображ|выведен)', re.IGNORECASE
+)
+_RE_ALREADY_SHOWN_HIST = re.compile(r'туры?\s+уже\s+(?:показан|отображ)', re.IGNORECASE)
+_RE_ASKS_DATE = re.compile(
+    r'(?:как\w+\s*месяц|какие\s*дат|когда\s*план|на\s*как\w+\s*месяц|'
+    r'промежут\w*\s*дат|уточн\w+\s*дат|конкретн\w+\s*дат)',
+    re.IGNORECASE
+)
+_RE_USER_NEAREST = re.compile(
+    r'ближайш|всё?\s*равно.*когда|неважно\s*когда|не\s*важно\s*когда', re.IGNORECASE
+)
+# «после X» — дата, а не длительность («после 3 дней»)
+_RE_USER_AFTER_DATE = re.compile(
+    r'после\s+(\d{1,2})\s*[./ ]\s*(\d{1,2})(?!\s*(?:ноч|дн|дней|день|недел))'
+    r'|после\s+(\d{1,2})\s+(?:январ|феврал|март|апрел|ма[яй]|июн|июл|август|'
+    r'сентябр|октябр|ноябр|декабр)',
+    re.IGNORECASE
+)
+_RE_AFTER_DM = re.compile(r'после\s+(\d{1,2})\s*[./ ]\s*(\d{1,2})', re.IGNORECASE)
+_RE_AFTER_DAY_MONTH = re.compile(
+    r'после\s+(\d{1,2})\s+(январ\w*|феврал\w*|март\w*|апрел\w*|'
+    r'ма[яй]\w*|июн\w*|июл\w*|август\w*|сентябр\w*|октябр\w*|'
+    r'ноябр\w*|декабр\w*)',
+    re.IGNORECASE
+)
+_RE_ASKS_NIGHTS = re.compile(
+    r'(?:сколько\s*ноч|на\s*сколько\s*ноч|длительн|количеств\w*\s*ноч)', re.IGNORECASE
+)
+_RE_USER_DATE_RANGE = re.compile(
+    r'с\s+(\d{1,2})\s*(?:по|до)\s*(\d{1,2})\s*'
+    r'(?:январ|феврал|март|апрел|ма[яй]|июн|июл|август|'
+    r'сентябр|октябр|ноябр|декабр)',
+    re.IGNORECASE
+)
+# Только настоящие ВОПРОСЫ (какой/какую/сколько), не «подберу 4★ всё включено»
+_RE_ASKS_QC = re.compile(
+    r'(?:как\w+\s*(?:категори|звёзд|питани)|какую?\s*(?:категори|звёзд|питани)|'
+    r'сколько\s*звёзд|какую?\s*звёздност\w*|тип\s*питани\w*\s*(?:предпочит|хотите|интерес|рассматр))',
+    re.IGNORECASE
+)
+_RE_USER_COMPOSITION = re.compile(r'(?:взросл|детей|ребён|вдвоём|семь|компани)', re.IGNORECASE)
+_RE_ASKS_STARS = re.compile(
+    r'(?:как\w+\s*(?:категори|звёзд)|какую?\s*(?:категори|звёзд)|'
+    r'сколько\s*звёзд|звёздност\w*\s*(?:отел|предпочит)|'
+    r'категори\w+\s*отел)',
     re.IGNORECASE
 )
 
@@ -88,6 +171,40 @@ _LC_CONSULT_RE = re.compile(
     re.IGNORECASE,
 )
 
+# Канонизация текста для трекера слотов: нижний регистр (кириллица + латиница)
+# и ё→е одним str.translate. Паттерны _SLOT_PATTERNS пишутся уже в канонической
+# форме (без [её] и без re.IGNORECASE) — regex-движку не нужен case-folding.
+_CANON = str.maketrans({
+    "Ё": "е", "ё": "е",
+    **{chr(c): chr(c + 32) for c in range(ord("А"), ord("Я") + 1)},
+    **{chr(c): chr(c + 32) for c in range(ord("A"), ord("Z") + 1)},
+})
+
+# Намерение «без перелёта» (поезд/автобус/только отель) — для pinned search
+# intent. Слот «Город вылета» заполняет только транспорт (_NO_FLIGHT_SLOT_RE):
+# «только отель» — намерение, но не город. «ж/д» — только целым словом:
+# иначе ловит «между», «жду», «дождусь».
+_NO_FLIGHT_RE = re.compile(
+    r'без\s*перелет|только\s*отел[ьяию]|(?:на\s+)?поезд\w*|автобус\w*|\bж[./]?д\b'
+)
+_NO_FLIGHT_SLOT_RE = re.compile(r'без\s*перелет|(?:на\s+)?поезд\w*|автобус\w*|\bж[./]?д\b')
+_NO_FLIGHT_VALUE = "без перелёта"
+
+# Date-range → nights: "с 16 по 28 апреля", "с 1-15 июня", "1-15 июня"
+_SLOT_DATE_RANGE_RE = re.compile(
+    r'(?:с\s+)?(\d{1,2})\s*(?:по|до|-|–)\s*(\d{1,2})\s*'
+    r'(?:январ|феврал|март|апрел|ма[яй]|июн|июл|август|'
+    r'сентябр|октябр|ноябр|декабр)'
+)
+_SLOT_EXPLICIT_DURATION_RE = re.compile(
+    r'(\d+)\s*(?:ноч|ночей|дн|дней|день)|(?:на\s+)?(?:неделю|недельку)|(?:две\s+недели|2\s+недели)'
+)
+_SLOT_ANY_ANSWER_RE = re.compile(
+    r'^(?:любой|любая|любые|без разницы|все равно|неважно|не важно)$'
+)
+_SLOT_BARE_NUMBER_RE = re.compile(r'^\d{1,2}$')
+_SLOT_TOKEN_RE = re.compile(r'[a-zа-я0-9]+')
+
 
 class OpenAIHandler(YandexGPTHandler):
     """
@@ -137,6 +254,16 @@ class OpenAIHandler(YandexGPTHandler):
         # Collected cascade slots — injected as system message to prevent "forgetting"
         self._collected_slots: Dict[str, str] = {}
         self._nights_from_date_range = False
+        # Lowercased text of the last assistant message with content — kept in
+        # sync by _push_history (bare «любой»/«3» answers are read against it)
+        self._last_assistant_content_lower: str = ""
+        # tool_call.id → (name, канонический JSON аргументов): разбор аргументов
+        # один раз на вызов (досрочный старт, дедуп, исполнение)
+        self._tc_canon_cache: Dict[str, Tuple[str, str]] = {}
+        # Кэш группировки full_history в блоки (см. _history_blocks)
+        self._blocks: Optional[List[List[Dict]]] = None
+        # (history, len, last msg) после последней чистки — см. _cleanup_history
+        self._clean_mark: Optional[Tuple] = None
         # Pre-collected client contacts from widget form (set by app.py from lead_info payload)
         self._lead_info: Optional[Dict] = None
 
@@ -170,6 +297,26 @@ class OpenAIHandler(YandexGPTHandler):
             cleaned = cleaned[brace_start:]
         return cleaned
 
+    def _tool_call_key(self, tc) -> Tuple[str, str]:
+        """(name, canonical args JSON) for a tool call, cached by ``tc.id``.
+
+        Canonical form = sanitized JSON re-serialized with sorted keys, so
+        two calls with the same arguments in a different order share a key.
+        Unparseable arguments are kept as sanitized text (``_execute_function``
+        reports the JSON error itself).
+        """
+        hit = self._tc_canon_cache.get(tc.id)
+        if hit is not None:
+            return hit
+        args = self._sanitize_arguments(tc.function.arguments or "{}")
+        try:
+            args = json.dumps(json.loads(args), ensure_ascii=False, sort_keys=True)
+        except ValueError:
+            pass
+        key = (tc.function.name, args)
+        self._tc_canon_cache[tc.id] = key
+        return key
+
     # ─── Tools ────────────────────────────────────────────────────────────
 
     def _build_openai_tools(self) -> List[Dict]:
@@ -281,9 +428,19 @@ class OpenAIHandler(YandexGPTHandler):
                 )
             })
 
-        # Full history
+        # Full history. Записи, где уже нет ничего, кроме полей API, уходят в
+        # запрос как есть (без копии); остальные (assistant с tokens_* и т.п.)
+        # проецируются в новый dict.
         for item in self.full_history:
             role = item.get("role")
+            api_keys = _API_MESSAGE_KEYS.get(role)
+            if api_keys is None:
+                continue
+            if item.keys() <= api_keys and "content" in item and (
+                role != "tool" or "tool_call_id" in item
+            ):
+                messages.append(item)
+                continue
 
             if role == "user":
                 messages.append({
@@ -307,23 +464,8 @@ class OpenAIHandler(YandexGPTHandler):
     # ─── Slot Tracker ──────────────────────────────────────────────────────
 
     _SLOT_PATTERNS = {
-        "Направление": [
-            (r'\b(?:турци[яюи]|египе?т|оаэ|эмират|таиланд|мальдив|греци|кипр|'
-             r'вьетнам|шри.?ланк|куб[аеу]|доминикан|индонези|бали|тунис|'
-             r'черногори|болгари|хорвати|абхази|росси|сочи|крым|анап|'
-             r'геленджик|калининград|кмв|марокк|израил|иордани|'
-             r'индия|китай|япони|южная корея|мексик|бразили|'
-             r'казан[ьи]|карели|байкал|алтай|дагестан|домбай|шерегеш|'
-             r'архыз|приэльбрусь|урал|подмосковь|золот\w+ кольц|'
-             r'мурманск|псков|воронеж|татарстан)\w*', None),
-        ],
-        "Город вылета": [
-            (r'\b(?:екатеринбург|екб|'
-             r'новосибирск|нск|краснодар|красноярск|ростов|уф[аеы]|пермь?|'
-             r'челябинск|самар[аеу]|нижн\w+ новгород)\w*', None),
-            (r'(?:из|с)\s+(?:москв|казан|питер|спб|санкт.?петербург|сочи)\w*', None),
-            (r'без\s*перел[её]т|(?:на\s+)?поезд\w*|автобус\w*|ж[./]?д', "без перелёта"),
-        ],
+        # Направление и город вылета — по словарю основ (_DESTINATION_STEMS и
+        # др.), «без перелёта» — _NO_FLIGHT_RE в _update_collected_slots.
         "Даты": [
             (r'(\d{1,2}[./]\d{1,2}(?:[./]\d{2,4})?)', None),
             (r'(\d{1,2})\s*[-–]\s*(\d{1,2})\s+(?:января|февраля|марта|апреля|мая|июня|июля|августа|'
@@ -334,7 +476,7 @@ class OpenAIHandler(YandexGPTHandler):
             (r'после\s+(\d{1,2})\s+(?:январ|феврал|март|апрел|ма[яй]|июн|июл|август|'
              r'сентябр|октябр|ноябр|декабр)', None),
             (r'ближайш\w*\s*(?:вылет|дат|рейс)?', "ближайший вылет"),
-            (r'(?:всё?\s*равно|не\s*важно|неважно)\s*когда', "ближайший вылет"),
+            (r'(?:все?\s*равно|не\s*важно|неважно)\s*когда', "ближайший вылет"),
             (r'какой\s+есть\s+(?:вылет|рейс)', "ближайший вылет"),
         ],
         "Длительность": [
@@ -345,10 +487,10 @@ class OpenAIHandler(YandexGPTHandler):
         ],
         "Состав": [
             (r'(?:(\d+)\s*(?:взрослы|взр))', None),
-            (r'(?:вдво[её]м|с (?:мужем|женой|парнем|девушкой))', "2 взрослых"),
+            (r'(?:вдвоем|с (?:мужем|женой|парнем|девушкой))', "2 взрослых"),
         ],
         "Дети": [
-            (r'(\d+)\s*(?:ребён|ребен|дет)', None),
+            (r'(\d+)\s*(?:ребен|дет)', None),
             (r'(?:без\s*детей)', "без детей"),
         ],
         "Возраст ребёнка": [
@@ -359,14 +501,14 @@ class OpenAIHandler(YandexGPTHandler):
             (r'(\d{1,2})\s*(?:лет|год|годик)', None),
         ],
         "Питание": [
-            (r'(?:вс[её]\s*включен|all\s*inclusive|олл\s*инклюзив)', "всё включено"),
+            (r'(?:все\s*включен|all\s*inclusive|олл\s*инклюзив)', "всё включено"),
             (r'(?:завтрак)', "завтраки"),
             (r'(?:полупансион)', "полупансион"),
             (r'(?:полный\s*пансион)', "полный пансион"),
         ],
         "Звёздность": [
-            (r'(\d)\s*(?:звёзд|звезд|★|\*)', None),
-            (r'\b(люб\w+)\b.*(?:звёзд|звезд|★|\*|категори|вариант)', "любая"),
+            (r'(\d)\s*(?:звезд|★|\*)', None),
+            (r'\b(люб\w+)\b.*(?:звезд|★|\*|категори|вариант)', "любая"),
         ],
         "Отель": [
             # Латинские бренды (международные сети и турецкие/мировые цепочки)
@@ -395,10 +537,88 @@ class OpenAIHandler(YandexGPTHandler):
              r'гранд\s*каньон)\b', None),
             # Контекстный паттерн: "отель X" / "hotel X" / "в отеле X"
             # Negative lookahead excludes common non-hotel words
-            (r'(?:(?:в\s+)?отел[ьеи]|hotel)\s+(?!без\b|для\b|с\b|на\b|в\b|у\b|по\b|от\b|до\b|не\b|или\b|и\b|всё\b|все\b|только\b|где\b|как\b|что\b|там\b|тут\b|это\b|рядом\b|около\b|возле\b|недалеко\b|который\b|которая\b|которое\b|которые\b|какой\b|какая\b|какое\b|какие\b|такой\b|такая\b|такое\b|другой\b|другая\b|другое\b|этот\b|любой\b|каждый\b|свой\b|один\b|нужен\b|нужна\b|хороший\b|хорошая\b|лучший\b|лучшая\b)([а-яёa-z]{3,})', None),
+            (r'(?:(?:в\s+)?отел[ьеи]|hotel)\s+(?!без\b|для\b|с\b|на\b|в\b|у\b|по\b|от\b|до\b|не\b|или\b|и\b|все\b|только\b|где\b|как\b|что\b|там\b|тут\b|это\b|рядом\b|около\b|возле\b|недалеко\b|который\b|которая\b|которое\b|которые\b|какой\b|какая\b|какое\b|какие\b|такой\b|такая\b|такое\b|другой\b|другая\b|другое\b|этот\b|любой\b|каждый\b|свой\b|один\b|нужен\b|нужна\b|хороший\b|хорошая\b|лучший\b|лучшая\b)([а-яa-z]{3,})', None),
         ],
     }
 
+    # Скомпилированы один раз; применяются к тексту, канонизированному _CANON.
+    _SLOT_RXS = {
+        slot: [(re.compile(p), v) for p, v in pats]
+        for slot, pats in _SLOT_PATTERNS.items()
+    }
+
+    # ── Словари основ: токен сообщения → каноническое имя ──
+    # Ключ — начало слова («турци» ловит «турция/турцию/турцией»). Фразы из
+    # двух слов — кортеж основ соседних токенов («шри-ланка», «южная корея»).
+    _DESTINATION_STEMS = {
+        "турци": "Турция", "египет": "Египет", "египт": "Египет",
+        "оаэ": "ОАЭ", "эмират": "ОАЭ", "таиланд": "Таиланд",
+        "мальдив": "Мальдивы", "греци": "Греция", "кипр": "Кипр",
+        "вьетнам": "Вьетнам", "шриланк": "Шри-Ланка",
+        "куба": "Куба", "кубе": "Куба", "кубу": "Куба",
+        "доминикан": "Доминикана", "индонези": "Индонезия", "бали": "Бали",
+        "тунис": "Тунис", "черногори": "Черногория", "болгари": "Болгария",
+        "хорвати": "Хорватия", "абхази": "Абхазия", "росси": "Россия",
+        "сочи": "Сочи", "крым": "Крым", "анап": "Анапа",
+        "геленджик": "Геленджик", "калининград": "Калининград", "кмв": "КМВ",
+        "марокк": "Марокко", "израил": "Израиль", "иордани": "Иордания",
+        "индия": "Индия", "китай": "Китай", "япони": "Япония",
+        "мексик": "Мексика", "бразили": "Бразилия",
+        "казань": "Казань", "казани": "Казань", "карели": "Карелия",
+        "байкал": "Байкал", "алтай": "Алтай", "дагестан": "Дагестан",
+        "домбай": "Домбай", "шерегеш": "Шерегеш", "архыз": "Архыз",
+        "приэльбрусь": "Приэльбрусье", "урал": "Урал",
+        "подмосковь": "Подмосковье", "мурманск": "Мурманск", "псков": "Псков",
+        "воронеж": "Воронеж", "татарстан": "Татарстан",
+    }
+    _DESTINATION_PHRASES = {
+        ("шри", "ланк"): "Шри-Ланка",
+        ("южная", "корея"): "Южная Корея",
+        ("золот", "кольц"): "Золотое кольцо",
+    }
+    # Город вылета без предлога («вылет екатеринбург», «из уфы»)
+    _DEPARTURE_STEMS = {
+        "екатеринбург": "Екатеринбург", "екб": "Екатеринбург",
+        "новосибирск": "Новосибирск", "нск": "Новосибирск",
+        "краснодар": "Краснодар", "красноярск": "Красноярск",
+        "ростов": "Ростов-на-Дону", "уфа": "Уфа", "уфе": "Уфа", "уфы": "Уфа",
+        "перм": "Пермь", "челябинск": "Челябинск",
+        "самара": "Самара", "самаре": "Самара", "самару": "Самара",
+    }
+    _DEPARTURE_PHRASES = {
+        ("нижн", "новгород"): "Нижний Новгород",
+    }
+    # Город вылета только после «из»/«с» (иначе это направление: «в Сочи»)
+    _DEPARTURE_FROM_STEMS = {
+        "москв": "Москва", "казан": "Казань", "питер": "Санкт-Петербург",
+        "спб": "Санкт-Петербург", "санкт": "Санкт-Петербург", "сочи": "Сочи",
+    }
+    _DEPARTURE_FROM_PREPS = frozenset({"из", "с"})
+
+    @staticmethod
+    def _stem_lookup(token: str, stems: Dict[str, str]) -> Optional[str]:
+        """Каноническое имя по самой длинной основе-префиксу токена."""
+        for n in range(len(token), 0, -1):
+            hit = stems.get(token[:n])
+            if hit:
+                return hit
+        return None
+
+    @classmethod
+    def _scan_stems(cls, tokens: List[str], stems: Dict[str, str],
+                    phrases: Dict[tuple, str]) -> Optional[str]:
+        """Первое (слева) совпадение основы или двухсловной фразы."""
+        for i, tok in enumerate(tokens):
+            hit = cls._stem_lookup(tok, stems)
+            if hit:
+                return hit
+            if i + 1 < len(tokens):
+                nxt = tokens[i + 1]
+                for (a, b), name in phrases.items():
+                    if tok.startswith(a) and nxt.startswith(b):
+                        return name
+        return None
+
     _DESTINATION_REGION_CODES = {
         'сочи': '426', 'крым': '423', 'анап': '597', 'геленджик': '598',
         'калининград': '425', 'казан': '517', 'дагестан': '662',
@@ -410,33 +630,55 @@ class OpenAIHandler(YandexGPTHandler):
         'приэльбрусь': '524', 'золот': '527',
     }
 
-    def _update_collected_slots(self, user_message: str):
-        """Extract and pin cascade parameters from user messages."""
-        text = user_message.lower().strip()
-        for slot_name, patterns in self._SLOT_PATTERNS.items():
-            for pattern, fixed_value in patterns:
-                m = re.search(pattern, text, re.IGNORECASE)
+    def _update_collected_slots(self, user_message: str) -> Dict[str, str]:
+        """Extract and pin cascade parameters from user messages.
+
+        Returns slots matched in THIS message (subset of ``_collected_slots``),
+        so chat() can react to them without re-scanning the text.
+        """
+        text = user_message.translate(_CANON).strip()
+        new_slots: Dict[str, str] = {}
+
+        # Направление / город вылета — O(токенов) поиск по словарям основ
+        tokens = _SLOT_TOKEN_RE.findall(text)
+        destination = self._scan_stems(tokens, self._DESTINATION_STEMS, self._DESTINATION_PHRASES)
+        if destination:
+            _dest_lc = destination.lower()
+            for prefix, region_id in self._DESTINATION_REGION_CODES.items():
+                if prefix in _dest_lc:
+                    destination = f"{destination} (regions={region_id})"
+                    break
+            new_slots["Направление"] = destination
+        departure = self._scan_stems(tokens, self._DEPARTURE_STEMS, self._DEPARTURE_PHRASES)
+        if not departure:
+            for i in range(1, len(tokens)):
+                if tokens[i - 1] in self._DEPARTURE_FROM_PREPS:
+                    departure = self._stem_lookup(tokens[i], self._DEPARTURE_FROM_STEMS)
+                    if departure:
+                        break
+        if departure:
+            new_slots["Город вылета"] = departure
+
+        # «Без перелёта» не перетирает названный город («из Москвы на поезде» —
+        # слот остаётся «Москва»), но намерение пинуем в любом случае, чтобы
+        # оно пережило обрезку истории.
+        if _NO_FLIGHT_RE.search(text):
+            if "Город вылета" not in new_slots and _NO_FLIGHT_SLOT_RE.search(text):
+                new_slots["Город вылета"] = _NO_FLIGHT_VALUE
+            self._pinned_search_intent = "[ПАРАМЕТР КЛИЕНТА: тур БЕЗ ПЕРЕЛЁТА (departure=99). НЕ спрашивай город вылета.]"
+            logger.info("📌 Pinned search intent: без перелёта")
+
+        for slot_name, patterns in self._SLOT_RXS.items():
+            for rx, fixed_value in patterns:
+                m = rx.search(text)
                 if m:
-                    value = fixed_value or m.group(0)
-                    if slot_name == "Направление":
-                        for prefix, region_id in self._DESTINATION_REGION_CODES.items():
-                            if prefix in value:
-                                value = f"{value} (regions={region_id})"
-                                break
-                    self._collected_slots[slot_name] = value
+                    new_slots[slot_name] = fixed_value or m.group(0)
                     break
+        self._collected_slots.update(new_slots)
 
         # Date-range → nights: "с 16 по 28 апреля", "с 1-15 июня", "1-15 июня" = N ночей
-        _range_m = re.search(
-            r'(?:с\s+)?(\d{1,2})\s*(?:по|до|-|–)\s*(\d{1,2})\s*'
-            r'(?:январ|феврал|март|апрел|ма[яй]|июн|июл|август|'
-            r'сентябр|октябр|ноябр|декабр)',
-            text, re.IGNORECASE
-        )
-        _has_explicit_duration = bool(re.search(
-            r'(\d+)\s*(?:ноч|ночей|дн|дней|день)|(?:на\s+)?(?:неделю|недельку)|(?:две\s+недели|2\s+недели)',
-            text, re.IGNORECASE
-        ))
+        _range_m = _SLOT_DATE_RANGE_RE.search(text)
+        _has_explicit_duration = bool(_SLOT_EXPLICIT_DURATION_RE.search(text))
         if _range_m:
             _day_from = int(_range_m.group(1))
             _day_to = int(_range_m.group(2))
@@ -451,12 +693,8 @@ class OpenAIHandler(YandexGPTHandler):
                     logger.debug("📌 DATE-RANGE + EXPLICIT-DURATION: range '%s', не перезаписываем длительность", _range_m.group(0))
 
         # Context-aware: bare "любой/любая/без разницы" → check what model asked
-        if re.match(r'^(?:любой|любая|любые|без разницы|все равно|всё равно|неважно|не важно)$', text):
-            last_assistant = ""
-            for msg in reversed(self.full_history):
-                if msg.get("role") == "assistant" and msg.get("content"):
-                    last_assistant = msg["content"].lower()
-                    break
+        if _SLOT_ANY_ANSWER_RE.match(text):
+            last_assistant = self._last_assistant_content_lower
             if any(w in last_assistant for w in ("звёзд", "звезд", "категори", "★")):
                 self._collected_slots["Звёздность"] = "любая"
             elif any(w in last_assistant for w in ("питани", "meal")):
@@ -465,12 +703,8 @@ class OpenAIHandler(YandexGPTHandler):
         # Голое число → возраст ребёнка ТОЛЬКО если ассистент только что спросил
         # про возраст (иначе «3» = 3 ночи / выбор карточки / состав — НЕ возраст).
         # Защита от бага «клиент ответил "3" на вопрос о ночах → Возраст ребёнка: 3».
-        if re.match(r'^\d{1,2}$', text) and "Возраст ребёнка" not in self._collected_slots:
-            _last_a = ""
-            for msg in reversed(self.full_history):
-                if msg.get("role") == "assistant" and msg.get("content"):
-                    _last_a = msg["content"].lower()
-                    break
+        if _SLOT_BARE_NUMBER_RE.match(text) and "Возраст ребёнка" not in self._collected_slots:
+            _last_a = self._last_assistant_content_lower
             if any(w in _last_a for w in ("возраст", "сколько лет", "лет ребён", "ребёнку лет", "возраста ребён")):
                 self._collected_slots["Возраст ребёнка"] = f"{text} лет"
 
@@ -479,8 +713,20 @@ class OpenAIHandler(YandexGPTHandler):
             self._collected_slots["Звёздность"] = "авто (из каталога отеля, НЕ спрашивать)"
             logger.debug("📌 HOTEL-AUTO-STARS: %s -> stars auto", self._collected_slots["Отель"])
 
-        if self._collected_slots:
+        if self._collected_slots and logger.isEnabledFor(logging.DEBUG):
             logger.debug("📌 SLOTS: %s", self._collected_slots)
+        return new_slots
+
+    # ─── History ──────────────────────────────────────────────────────────
+
+    def _push_history(self, msg: Dict) -> None:
+        """Append a message to full_history, keeping derived state in sync."""
+        role = msg.get("role")
+        if role is not None:
+            msg["role"] = role = sys.intern(role)
+        self.full_history.append(msg)
+        if role == _ROLE_ASSISTANT and msg.get("content"):
+            self._last_assistant_content_lower = msg["content"].lower()
 
     # ─── Context Summary (for limit warning) ───────────────────────────────
 
@@ -498,26 +744,57 @@ class OpenAIHandler(YandexGPTHandler):
 
     # ─── History Trimming (tool_call-aware) ───────────────────────────────
 
-    @staticmethod
-    def _group_into_blocks(messages):
-        """Group messages into atomic blocks: tool_call assistant + its tool results stay together."""
-        blocks = []
-        i = 0
-        while i < len(messages):
-            msg = messages[i]
-            if msg.get("role") == "assistant" and msg.get("tool_calls"):
-                block = [msg]
-                j = i + 1
-                while j < len(messages) and messages[j].get("role") == "tool":
-                    block.append(messages[j])
-                    j += 1
-                blocks.append(block)
-                i = j
+    def _history_blocks(self) -> List[List[Dict]]:
+        """Group full_history into atomic blocks: a tool_call assistant message
+        and its tool results stay together.
+
+        Maintained incrementally: history mostly grows by appends, so only
+        messages added since the last call are grouped. Any other change
+        (reassignment, pop, insert) is detected by identity checks and
+        triggers a full regroup. The returned list is shared — callers must
+        not mutate it.
+        """
+        history = self.full_history
+        blocks = getattr(self, "_blocks", None)
+        n = getattr(self, "_blocks_n", 0)
+        if (
+            blocks is None
+            or self._blocks_src is not history
+            or len(history) < n
+            or (n and history[n - 1] is not self._blocks_last)
+        ):
+            blocks, n = [], 0
+        for msg in (history[n:] if n else history):
+            if (
+                msg.get("role") == _ROLE_TOOL and blocks
+                and blocks[-1][0].get("role") == _ROLE_ASSISTANT
+                and blocks[-1][0].get("tool_calls")
+            ):
+                blocks[-1].append(msg)
             else:
                 blocks.append([msg])
-                i += 1
+        self._set_blocks_cache(history, blocks)
         return blocks
 
+    def _set_blocks_cache(self, history: List[Dict], blocks: List[List[Dict]]) -> None:
+        self._blocks = blocks
+        self._blocks_src = history
+        self._blocks_n = len(history)
+        self._blocks_last = history[-1] if history else None
+
+    def _set_history_from_blocks(self, blocks: List[List[Dict]]) -> None:
+        """Refill full_history in place from the blocks (cache stays warm).
+
+        clear() + a single extend() over chain.from_iterable(): no second
+        history-sized list is materialized, and the flatten runs in C rather
+        than a Python loop per block. ``blocks`` must hold references to the
+        messages, not slices of full_history itself.
+        """
+        history = self.full_history
+        history.clear()
+        history.extend(chain.from_iterable(blocks))
+        self._set_blocks_cache(history, blocks)
+
     def _trim_history(self):
         """
         Trim history while preserving tool_call/tool_result pairs as atomic blocks.
@@ -527,14 +804,14 @@ class OpenAIHandler(YandexGPTHandler):
             return
 
         old_len = len(self.full_history)
-        blocks = self._group_into_blocks(self.full_history)
+        blocks = list(self._history_blocks())
 
-        total = sum(len(b) for b in blocks)
+        total = old_len
         while total > self._max_history_len and len(blocks) > 3:
             removed = blocks.pop(1)
             total -= len(removed)
 
-        self.full_history = [msg for block in blocks for msg in block]
+        self._set_history_from_blocks(blocks)
         logger.info(
             "✂️ TRIM full_history: %d → %d messages",
             old_len, len(self.full_history)
@@ -582,7 +859,88 @@ class OpenAIHandler(YandexGPTHandler):
         except Exception:
             return False
 
-    def _call_openai_sync(self, messages: List[Dict], force_search: bool = False):
+    @staticmethod
+    def _consume_openai_stream(stream, on_tool_call: Optional[Callable] = None,
+                               on_text: Optional[StreamCallback] = None):
+        """Собрать streaming-ответ в объект той же формы, что non-stream.
+
+        chat() читает ``choices[0].message.{content,tool_calls}``,
+        ``choices[0].finish_reason`` и ``usage`` — их и воспроизводим.
+        ``on_tool_call(tc)`` вызывается (в потоке стрима) как только аргументы
+        tool_call стали валидным JSON — не дожидаясь конца ответа.
+        ``on_text(delta)`` — на каждый текстовый фрагмент (тоже в потоке стрима).
+        """
+        text_parts: List[str] = []
+        calls: Dict[int, Dict] = {}
+        finish_reason = None
+        usage = None
+
+        def _emit_if_complete(entry):
+            if entry["emitted"] or not entry["id"] or not entry["name"]:
+                return
+            raw = "".join(entry["args"]).rstrip()
+            if not raw.endswith("}"):
+                return
+            try:
+                json.loads(raw)
+            except ValueError:
+                return
+            entry["emitted"] = True
+            if on_tool_call:
+                on_tool_call(SimpleNamespace(
+                    id=entry["id"],
+                    function=SimpleNamespace(name=entry["name"], arguments=raw),
+                ))
+
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            delta = choice.delta
+            if delta is not None:
+                if delta.content:
+                    text_parts.append(delta.content)
+                    if on_text:
+                        on_text(delta.content)
+                for d in delta.tool_calls or ():
+                    entry = calls.setdefault(
+                        d.index, {"id": "", "name": "", "args": [], "emitted": False}
+                    )
+                    if d.id:
+                        entry["id"] = d.id
+                    if d.function is not None:
+                        if d.function.name:
+                            entry["name"] += d.function.name
+                        if d.function.arguments:
+                            entry["args"].append(d.function.arguments)
+                            if "}" in d.function.arguments:
+                                _emit_if_complete(entry)
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+
+        tool_calls = [
+            SimpleNamespace(
+                id=e["id"],
+                type="function",
+                function=SimpleNamespace(name=e["name"], arguments="".join(e["args"])),
+            )
+            for _, e in sorted(calls.items())
+        ] or None
+        message = SimpleNamespace(
+            content="".join(text_parts) or None,
+            tool_calls=tool_calls,
+        )
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=message, finish_reason=finish_reason)],
+            usage=usage,
+        )
+
+    def _call_openai_sync(self, messages: List[Dict], force_search: bool = False,
+                          send_tools: bool = True,
+                          on_tool_call: Optional[Callable] = None,
+                          on_text: Optional[StreamCallback] = None):
         """
         Synchronous OpenAI API call.
         Run in thread via asyncio.to_thread() to avoid blocking the event loop.
@@ -597,6 +955,13 @@ class OpenAIHandler(YandexGPTHandler):
         вызов search_tours (tool_choice), чтобы она не спрашивала бюджет/звёзды
         до первого подбора. Для остальных тенантов всегда False → запрос
         байт-в-байт прежний.
+
+        ``send_tools=False`` — не отправляем схемы инструментов (~10 KB JSON):
+        только для повтора-подталкивания к ТЕКСТОВОМУ ответу (после пустого
+        ответа / content_filter), когда инструменты модели не нужны.
+
+        ``on_tool_call`` / ``on_text`` — см. _consume_openai_stream (только
+        при OPENAI_STREAM).
         """
         extra = {
             "reasoning_effort": "low",
@@ -608,25 +973,38 @@ class OpenAIHandler(YandexGPTHandler):
         kwargs = dict(
             model=self.model,
             messages=messages,
-            tools=self.openai_tools,
             temperature=0.2,
             max_tokens=4096,
             extra_body=extra,
             timeout=60.0,
         )
+        if send_tools or force_search:
+            kwargs["tools"] = self.openai_tools
         if force_search:
             kwargs["tool_choice"] = {
                 "type": "function",
                 "function": {"name": "search_tours"},
             }
-        return self.openai_client.chat.completions.create(**kwargs)
+        if not _OPENAI_STREAM:
+            return self.openai_client.chat.completions.create(**kwargs)
+        stream = self.openai_client.chat.completions.create(
+            stream=True, stream_options={"include_usage": True}, **kwargs
+        )
+        try:
+            return self._consume_openai_stream(stream, on_tool_call, on_text)
+        finally:
+            stream.close()
 
     # ─── Main Chat Loop ──────────────────────────────────────────────────
 
-    async def chat(self, user_message: str) -> str:
+    async def chat(self, user_message: str,
+                   on_token: Optional[StreamCallback] = None) -> str:
         """
         Send message and get response using OpenAI GPT with native tool calling.
 
+        ``on_token`` — live-текст модели по мере генерации (см. chat_stream);
+        возвращаемое значение остаётся финальным, очищенным текстом.
+
         Key differences from YandexGPTHandler.chat():
         - No plaintext function call parsing (tool_calls are native JSON)
         - No content filter bypass (OpenAI doesn't have Yandex's content filter)
@@ -641,23 +1019,20 @@ class OpenAIHandler(YandexGPTHandler):
         # Новое сообщение клиента — снимаем блокировку показа карточек после
         # smart-alt (теперь клиент мог выбрать вариант → get_search_results разрешён).
         self._smart_alt_awaiting_pick = False
-        self._metrics["total_messages"] += 1
+        self._metrics.total_messages += 1
 
         # Add user message to history
-        self.full_history.append({"role": "user", "content": user_message})
+        self._push_history({"role": "user", "content": user_message})
         self._trim_history()
+        # tool_call id уникальны в пределах хода — ключи прошлых ходов не нужны
+        self._tc_canon_cache.clear()
 
-        # Track collected cascade slots from user message
+        # Track collected cascade slots (and the «без перелёта» intent) from user message
         self._update_collected_slots(user_message)
 
-        # Detect and pin "без перелёта" intent so it survives trimming
-        if re.search(r'без\s*перел[её]т|только\s*отел[ьяию]|(?:на\s+)?поезд|автобус\w*|ж[./]?д', user_message, re.IGNORECASE):
-            self._pinned_search_intent = "[ПАРАМЕТР КЛИЕНТА: тур БЕЗ ПЕРЕЛЁТА (departure=99). НЕ спрашивай город вылета.]"
-            logger.info("📌 Pinned search intent: без перелёта")
-
         logger.info(
-            "👤 USER >> \"%s\"  full_history=%d  model=%s",
-            user_message[:150], len(self.full_history), self.model
+            "👤 USER >> \"%.150s\"  full_history=%d  model=%s",
+            user_message, len(self.full_history), self.model
         )
 
         max_iterations = 20
@@ -667,10 +1042,14 @@ class OpenAIHandler(YandexGPTHandler):
         empty_retries = 0
         timeout_retries = 0
         geo_retries = 0
+        # False → следующая итерация — повтор за текстовым ответом, tools не шлём
+        next_send_tools = True
         self._last_message_usage = None
+        loop = asyncio.get_running_loop()
 
         while iteration < max_iterations:
             iteration += 1
+            send_tools, next_send_tools = next_send_tools, True
 
             elapsed = time.perf_counter() - chat_start
             if elapsed > _CHAT_WALL_CLOCK_S:
@@ -693,14 +1072,45 @@ class OpenAIHandler(YandexGPTHandler):
                 logger.info("🎯 LC FORCE-SEARCH: 4 слота собраны → tool_choice=search_tours")
 
             logger.info(
-                "🔄 ITERATION %d/%d  messages=%d  model=%s",
-                iteration, max_iterations, len(messages), self.model
+                "🔄 ITERATION %d/%d  messages=%d  model=%s%s",
+                iteration, max_iterations, len(messages), self.model,
+                "" if send_tools else "  tools=off"
             )
 
+            # tool_call id → concurrent Future досрочно запущенного _execute_function
+            early_calls = {}
+            early_keys = set()
+
+            def _start_early(tc):
+                if tc.function.name not in _EARLY_START_FUNCS:
+                    return
+                key = self._tool_call_key(tc)
+                if key in early_keys:
+                    return  # дубликат — исполнится один раз через дедуп
+                early_keys.add(key)
+                name, args = key
+                early_calls[tc.id] = asyncio.run_coroutine_threadsafe(
+                    self._execute_function(name, args, tc.id),
+                    loop,
+                )
+                logger.info("⚡ EARLY TOOL START: %s (stream still open)", tc.function.name)
+
+            _poll_count_before = getattr(self, "_requestid_poll_count", 0)
+
+            def _discard_early_calls():
+                # Ответ модели отброшен — досрочные вызовы отменяем, а счётчик
+                # опросов requestid (get_search_status поднимает его сразу при
+                # старте) откатываем: вызова нет в истории, он не должен считаться.
+                for _fut in early_calls.values():
+                    _fut.cancel()
+                if early_calls:
+                    self._requestid_poll_count = _poll_count_before
+
             t0 = time.perf_counter()
             try:
                 response = await asyncio.to_thread(
-                    self._call_openai_sync, messages, _force_search
+                    self._call_openai_sync, messages, _force_search, send_tools, _start_early,
+                    on_token
                 )
                 api_ms = int((time.perf_counter() - t0) * 1000)
 
@@ -743,9 +1153,10 @@ class OpenAIHandler(YandexGPTHandler):
             except Exception as e:
                 api_ms = int((time.perf_counter() - t0) * 1000)
                 error_str = str(e)
+                _discard_early_calls()
                 logger.error(
-                    "🤖 OPENAI API !! ERROR  %dms  %s",
-                    api_ms, error_str[:300], exc_info=True
+                    "🤖 OPENAI API !! ERROR  %dms  %.300s",
+                    api_ms, error_str, exc_info=True
                 )
 
                 # Rate limit
@@ -765,13 +1176,12 @@ class OpenAIHandler(YandexGPTHandler):
                 if (
                     "Prompt tokens limit exceeded" in error_str
                     or "context_length_exceeded" in error_str
-                    or re.search(r"\bError code:\s*402\b", error_str)
-                    or re.search(r"['\"]code['\"]\s*:\s*402\b", error_str)
+                    or _RE_ERR_402.search(error_str)
                 ):
                     logger.critical(
                         "🚨 CONTEXT-OVERFLOW (402): history=%d msgs — "
-                        "contact-capture fallback. Error: %s",
-                        len(self.full_history), error_str[:300]
+                        "contact-capture fallback. Error: %.300s",
+                        len(self.full_history), error_str
                     )
                     _phone = getattr(self, "_get_manager_phone", lambda: "+7 (499) 685-25-57")()
                     return (
@@ -791,12 +1201,10 @@ class OpenAIHandler(YandexGPTHandler):
                         len(self.full_history)
                     )
                     if len(self.full_history) > 8:
-                        blocks = self._group_into_blocks(self.full_history)
+                        blocks = self._history_blocks()
                         head_blocks = blocks[:1]
                         tail_blocks = blocks[-3:] if len(blocks) > 3 else blocks[1:]
-                        self.full_history = [
-                            m for b in (head_blocks + tail_blocks) for m in b
-                        ]
+                        self._set_history_from_blocks(head_blocks + tail_blocks)
                         logger.info(
                             "✅ History trimmed to %d messages",
                             len(self.full_history)
@@ -881,13 +1289,14 @@ class OpenAIHandler(YandexGPTHandler):
                 }
                 if _usage_payload:
                     assistant_msg.update(_usage_payload)
-                self.full_history.append(assistant_msg)
+                self._push_history(assistant_msg)
 
                 # Log
-                func_names = [tc.function.name for tc in message.tool_calls]
-                logger.info(
-                    "🔧 TOOL CALLS: %s", ", ".join(func_names)
-                )
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info(
+                        "🔧 TOOL CALLS: %s",
+                        ", ".join(tc.function.name for tc in message.tool_calls)
+                    )
 
                 # Guard: truncated tool-call arguments (model hit max_tokens)
                 _completion_tokens = usage.completion_tokens if usage else 0
@@ -897,8 +1306,9 @@ class OpenAIHandler(YandexGPTHandler):
                         "skipping execution, injecting hint",
                         finish_reason, _completion_tokens or "?"
                     )
+                    _discard_early_calls()
                     for tc in message.tool_calls:
-                        self.full_history.append({
+                        self._push_history({
                             "role": "tool",
                             "tool_call_id": tc.id,
                             "content": json.dumps({
@@ -919,6 +1329,7 @@ class OpenAIHandler(YandexGPTHandler):
                         _keep_start = self.full_history[:2]
                         _keep_end = self.full_history[-12:]
                         self.full_history = _keep_start + _keep_end
+                        self._tc_canon_cache.clear()
                         logger.info(
                             "✂️ TRUNCATION-TRIM: history trimmed to %d messages before retry",
                             len(self.full_history)
@@ -946,12 +1357,16 @@ class OpenAIHandler(YandexGPTHandler):
 
                 _had_json_error = False
 
+                async def _run_tool_call(tool_call):
+                    early = early_calls.pop(tool_call.id, None)
+                    if early is not None:
+                        return await asyncio.wrap_future(early)
+                    name, args = self._tool_call_key(tool_call)
+                    return await self._execute_function(name, args, tool_call.id)
+
                 if len(message.tool_calls) == 1:
                     tc = message.tool_calls[0]
-                    arguments = self._sanitize_arguments(tc.function.arguments or "{}")
-                    result = await self._execute_function(
-                        tc.function.name, arguments, tc.id
-                    )
+                    result = await _run_tool_call(tc)
                     output_str = result.get("output", "")
                     if "невалидный JSON" in output_str:
                         _had_json_error = True
@@ -968,7 +1383,7 @@ class OpenAIHandler(YandexGPTHandler):
                                     f"Никаких массивов, списков или дополнительных полей."
                                 )
                             }, ensure_ascii=False)
-                    self.full_history.append({
+                    self._push_history({
                         "role": "tool",
                         "tool_call_id": tc.id,
                         "content": _truncate_tool_output(
@@ -977,18 +1392,33 @@ class OpenAIHandler(YandexGPTHandler):
                     })
                 else:
                     async def _exec_tool_call(tool_call):
-                        args = self._sanitize_arguments(tool_call.function.arguments or "{}")
                         return (
                             tool_call.id,
                             tool_call.function.name,
-                            await self._execute_function(
-                                tool_call.function.name, args, tool_call.id
-                            )
+                            await _run_tool_call(tool_call)
                         )
 
-                    results = await asyncio.gather(*[
-                        _exec_tool_call(tc) for tc in message.tool_calls
+                    # Одинаковые вызовы (имя + аргументы) в одном ответе
+                    # исполняем один раз, результат раздаём всем tool_call_id.
+                    _unique: Dict[Tuple[str, str], object] = {}
+                    for tc in message.tool_calls:
+                        _unique.setdefault(self._tool_call_key(tc), tc)
+                    if len(_unique) < len(message.tool_calls):
+                        logger.info(
+                            "🔁 TOOL CALLS DEDUP: %d → %d",
+                            len(message.tool_calls), len(_unique)
+                        )
+                    _unique_results = await asyncio.gather(*[
+                        _exec_tool_call(tc) for tc in _unique.values()
                     ])
+                    _by_key = {
+                        self._tool_call_key(_unique_tc): res
+                        for _unique_tc, (_, _, res) in zip(_unique.values(), _unique_results)
+                    }
+                    results = [
+                        (tc.id, tc.function.name, dict(_by_key[self._tool_call_key(tc)]))
+                        for tc in message.tool_calls
+                    ]
 
                     for tc_id, tc_name, result in results:
                         output_str = result.get("output", "")
@@ -1004,7 +1434,7 @@ class OpenAIHandler(YandexGPTHandler):
                                         f"Никаких массивов, списков или дополнительных полей."
                                     )
                                 }, ensure_ascii=False)
-                        self.full_history.append({
+                        self._push_history({
                             "role": "tool",
                             "tool_call_id": tc_id,
                             "content": _truncate_tool_output(
@@ -1048,18 +1478,19 @@ class OpenAIHandler(YandexGPTHandler):
             if finish_reason == "content_filter":
                 empty_retries += 1
                 logger.warning(
-                    "⚠️ CONTENT_FILTER detected (#%d): \"%s\"",
-                    empty_retries, final_text[:100]
+                    "⚠️ CONTENT_FILTER detected (#%d): \"%.100s\"",
+                    empty_retries, final_text
                 )
                 if empty_retries >= 3:
                     return self._user_facing_error("content_filter")
-                self.full_history.append({
+                self._push_history({
                     "role": "user",
                     "content": (
                         "Пожалуйста, продолжи помогать "
                         "с подбором тура."
                     )
                 })
+                next_send_tools = self._search_awaiting_results
                 continue
 
             # Truncated response (max_tokens) — trim to last complete sentence
@@ -1088,20 +1519,18 @@ class OpenAIHandler(YandexGPTHandler):
                             "какой заинтересовал — расскажу подробнее."
                         )
                     return self._user_facing_error("generic")
-                self.full_history.append({
+                self._push_history({
                     "role": "user",
                     "content": (
                         "Продолжи обработку моего запроса "
                         "на основе полученных данных."
                     )
                 })
+                next_send_tools = self._search_awaiting_results
                 continue
 
             # Safety-net: deadlock cycle "уже показаны" / "горящие туры уже показаны"
-            _already_shown_match = re.search(
-                r'(?:горящие\s+)?туры?\s+уже\s+(?:показан|отображ|выведен)',
-                final_text, re.IGNORECASE
-            )
+            _already_shown_match = _RE_ALREADY_SHOWN.search(final_text)
             if _already_shown_match:
                 _recent_assistant = [
                     m.get("content", "") for m in self.full_history[-10:]
@@ -1109,7 +1538,7 @@ class OpenAIHandler(YandexGPTHandler):
                 ]
                 _already_shown_count = sum(
                     1 for txt in _recent_assistant
-                    if re.search(r'туры?\s+уже\s+(?:показан|отображ)', txt, re.IGNORECASE)
+                    if _RE_ALREADY_SHOWN_HIST.search(txt)
                 )
                 if _already_shown_count >= 1:
                     empty_retries += 1
@@ -1118,8 +1547,8 @@ class OpenAIHandler(YandexGPTHandler):
                         empty_retries, _already_shown_count
                     )
                     if empty_retries < 2:
-                        self.full_history.append({"role": "assistant", "content": final_text})
-                        self.full_history.append({"role": "user", "content":
+                        self._push_history({"role": "assistant", "content": final_text})
+                        self._push_history({"role": "user", "content":
                             "СИСТЕМНАЯ ОШИБКА: Ты уже говорил 'туры показаны', но клиент "
                             "их не видит — это проблема интерфейса. ЗАПРЕЩЕНО повторять "
                             "'уже показаны'! Вместо этого: 1) Предложи обновить страницу; "
@@ -1130,25 +1559,15 @@ class OpenAIHandler(YandexGPTHandler):
                         continue
 
             # Safety-net: bot asks about dates but user said "ближайший" or "после X"
-            _asks_date = re.search(
-                r'(?:как\w+\s*месяц|какие\s*дат|когда\s*план|на\s*как\w+\s*месяц|'
-                r'промежут\w*\s*дат|уточн\w+\s*дат|конкретн\w+\s*дат)',
-                final_text, re.IGNORECASE
-            )
+            _asks_date = _RE_ASKS_DATE.search(final_text)
             if _asks_date:
                 _user_said_nearest = any(
-                    re.search(r'ближайш|всё?\s*равно.*когда|неважно\s*когда|не\s*важно\s*когда',
-                              m.get("content", ""), re.IGNORECASE)
+                    _RE_USER_NEAREST.search(m.get("content", ""))
                     for m in self.full_history[-8:] if m.get("role") == "user"
                 )
                 # Check for "после X" pattern (date, not duration like "после 3 дней")
-                _after_date_re = (
-                    r'после\s+(\d{1,2})\s*[./ ]\s*(\d{1,2})(?!\s*(?:ноч|дн|дней|день|недел))'
-                    r'|после\s+(\d{1,2})\s+(?:январ|феврал|март|апрел|ма[яй]|июн|июл|август|'
-                    r'сентябр|октябр|ноябр|декабр)'
-                )
                 _user_said_after = any(
-                    re.search(_after_date_re, m.get("content", ""), re.IGNORECASE)
+                    _RE_USER_AFTER_DATE.search(m.get("content", ""))
                     for m in self.full_history[-8:] if m.get("role") == "user"
                 )
                 if _user_said_after:
@@ -1172,17 +1591,13 @@ class OpenAIHandler(YandexGPTHandler):
                                 continue
                             _txt = m.get("content", "")
                             # Try "после DD.MM" or "после DD MM"
-                            _dm = re.search(r'после\s+(\d{1,2})\s*[./ ]\s*(\d{1,2})', _txt, re.IGNORECASE)
+                            _dm = _RE_AFTER_DM.search(_txt)
                             if _dm:
                                 _after_day = _dm.group(1)
                                 _after_month = _dm.group(2).zfill(2)
                                 break
                             # Try "после DD месяц_название"
-                            _dn = re.search(
-                                r'после\s+(\d{1,2})\s+(январ\w*|феврал\w*|март\w*|апрел\w*|'
-                                r'ма[яй]\w*|июн\w*|июл\w*|август\w*|сентябр\w*|октябр\w*|'
-                                r'ноябр\w*|декабр\w*)', _txt, re.IGNORECASE
-                            )
+                            _dn = _RE_AFTER_DAY_MONTH.search(_txt)
                             if _dn:
                                 _after_day = _dn.group(1)
                                 _mname = _dn.group(2).lower()
@@ -1191,8 +1606,8 @@ class OpenAIHandler(YandexGPTHandler):
                                         _after_month = num
                                         break
                                 break
-                        self.full_history.append({"role": "assistant", "content": final_text})
-                        self.full_history.append({"role": "user", "content":
+                        self._push_history({"role": "assistant", "content": final_text})
+                        self._push_history({"role": "user", "content":
                             f"СИСТЕМНАЯ ОШИБКА: Клиент сказал 'после {_after_day}.{_after_month}'. "
                             f"Это означает datefrom={_after_day}.{_after_month}! "
                             f"НЕ спрашивай конкретную дату! Слот Даты ЗАПОЛНЕН. "
@@ -1207,8 +1622,8 @@ class OpenAIHandler(YandexGPTHandler):
                         empty_retries
                     )
                     if empty_retries < 2:
-                        self.full_history.append({"role": "assistant", "content": final_text})
-                        self.full_history.append({"role": "user", "content":
+                        self._push_history({"role": "assistant", "content": final_text})
+                        self._push_history({"role": "user", "content":
                             "СИСТЕМНАЯ ОШИБКА: Клиент сказал 'ближайший вылет'. "
                             "НЕ спрашивай дату! НЕМЕДЛЕННО вызови search_tours "
                             "с datefrom=завтра, dateto=+14 дней. "
@@ -1217,21 +1632,13 @@ class OpenAIHandler(YandexGPTHandler):
                         continue
 
             # Safety-net: bot asks about nights but user gave "с X по Y"
-            _asks_nights = re.search(
-                r'(?:сколько\s*ноч|на\s*сколько\s*ноч|длительн|количеств\w*\s*ноч)',
-                final_text, re.IGNORECASE
-            )
+            _asks_nights = _RE_ASKS_NIGHTS.search(final_text)
             if _asks_nights:
                 _all_user = " ".join(
                     m.get("content", "") for m in self.full_history[-8:]
                     if m.get("role") == "user"
                 ).lower()
-                _range_match = re.search(
-                    r'с\s+(\d{1,2})\s*(?:по|до)\s*(\d{1,2})\s*'
-                    r'(?:январ|феврал|март|апрел|ма[яй]|июн|июл|август|'
-                    r'сентябр|октябр|ноябр|декабр)',
-                    _all_user, re.IGNORECASE
-                )
+                _range_match = _RE_USER_DATE_RANGE.search(_all_user)
                 if _range_match:
                     _n = int(_range_match.group(2)) - int(_range_match.group(1))
                     if 1 <= _n <= 30:
@@ -1241,8 +1648,8 @@ class OpenAIHandler(YandexGPTHandler):
                             _n, empty_retries
                         )
                         if empty_retries < 2:
-                            self.full_history.append({"role": "assistant", "content": final_text})
-                            self.full_history.append({"role": "user", "content":
+                            self._push_history({"role": "assistant", "content": final_text})
+                            self._push_history({"role": "user", "content":
                                 f"СИСТЕМНАЯ ОШИБКА: Клиент указал 'с {_range_match.group(1)} "
                                 f"по {_range_match.group(2)}' = {_n} ночей. НЕ спрашивай ночи! "
                                 f"nightsfrom={_n}, nightsto={_n}. "
@@ -1251,16 +1658,11 @@ class OpenAIHandler(YandexGPTHandler):
                             continue
 
             # Safety-net: bot asks about QC (stars/meal) before Состав slot
-            # Only match actual QUESTIONS (какой/какую/сколько), not statements like "подберу 4★ всё включено"
-            _asks_qc = re.search(
-                r'(?:как\w+\s*(?:категори|звёзд|питани)|какую?\s*(?:категори|звёзд|питани)|'
-                r'сколько\s*звёзд|какую?\s*звёздност\w*|тип\s*питани\w*\s*(?:предпочит|хотите|интерес|рассматр))',
-                final_text, re.IGNORECASE
-            )
+            _asks_qc = _RE_ASKS_QC.search(final_text)
             _has_composition = (
                 "Состав" in self._collected_slots or
                 "Дети" in self._collected_slots or
-                any(re.search(r'(?:взросл|детей|ребён|вдвоём|семь|компани)', m.get("content", ""), re.IGNORECASE)
+                any(_RE_USER_COMPOSITION.search(m.get("content", ""))
                     for m in self.full_history[-10:] if m.get("role") == "user")
             )
             if _asks_qc and not _has_composition:
@@ -1270,8 +1672,8 @@ class OpenAIHandler(YandexGPTHandler):
                     empty_retries
                 )
                 if empty_retries < 2:
-                    self.full_history.append({"role": "assistant", "content": final_text})
-                    self.full_history.append({"role": "user", "content":
+                    self._push_history({"role": "assistant", "content": final_text})
+                    self._push_history({"role": "user", "content":
                         "СИСТЕМНАЯ ОШИБКА: Ты спросил о звёздности/питании (слот 5), "
                         "но ещё не знаешь СОСТАВ группы (слот 4)! "
                         "СТРОГИЙ ПОРЯДОК: Направление → Город → Даты → **Состав** → QC. "
@@ -1281,12 +1683,7 @@ class OpenAIHandler(YandexGPTHandler):
                     continue
 
             # Safety-net: bot asks about stars but user named a specific hotel/brand
-            _asks_stars = re.search(
-                r'(?:как\w+\s*(?:категори|звёзд)|какую?\s*(?:категори|звёзд)|'
-                r'сколько\s*звёзд|звёздност\w*\s*(?:отел|предпочит)|'
-                r'категори\w+\s*отел)',
-                final_text, re.IGNORECASE
-            )
+            _asks_stars = _RE_ASKS_STARS.search(final_text)
             if _asks_stars and "Отель" in self._collected_slots:
                 empty_retries += 1
                 logger.warning(
@@ -1294,8 +1691,8 @@ class OpenAIHandler(YandexGPTHandler):
                     self._collected_slots["Отель"], empty_retries
                 )
                 if empty_retries < 2:
-                    self.full_history.append({"role": "assistant", "content": final_text})
-                    self.full_history.append({"role": "user", "content":
+                    self._push_history({"role": "assistant", "content": final_text})
+                    self._push_history({"role": "user", "content":
                         f"СИСТЕМНАЯ ОШИБКА: Клиент назвал конкретный отель "
                         f"'{self._collected_slots['Отель']}'. НЕ спрашивай звёздность! "
                         f"Звёздность определяется автоматически из каталога. "
@@ -1306,17 +1703,16 @@ class OpenAIHandler(YandexGPTHandler):
             # Promised search detection (safety-net) — skip if tour cards already found this turn
             if not self._pending_tour_cards and _is_promised_search(final_text):
                 empty_retries += 1
-                self._metrics["promised_search_detections"] = \
-                    self._metrics.get("promised_search_detections", 0) + 1
+                self._metrics.promised_search_detections += 1
                 logger.warning(
-                    "⚠️ PROMISED-SEARCH detected (#%d): \"%s\"",
-                    empty_retries, final_text[:150]
+                    "⚠️ PROMISED-SEARCH detected (#%d): \"%.150s\"",
+                    empty_retries, final_text
                 )
                 if empty_retries < 2:
-                    self.full_history.append({
+                    self._push_history({
                         "role": "assistant", "content": final_text
                     })
-                    self.full_history.append({
+                    self._push_history({
                         "role": "user",
                         "content": (
                             "СИСТЕМНАЯ ОШИБКА: Ты ОПИСАЛ намерение "
@@ -1336,10 +1732,10 @@ class OpenAIHandler(YandexGPTHandler):
                 )
                 empty_retries += 1
                 if empty_retries < 3:
-                    self.full_history.append({
+                    self._push_history({
                         "role": "assistant", "content": final_text
                     })
-                    self.full_history.append({
+                    self._push_history({
                         "role": "user",
                         "content": (
                             f"СИСТЕМНАЯ ОШИБКА: search_tours вернул requestid, "
@@ -1356,8 +1752,7 @@ class OpenAIHandler(YandexGPTHandler):
             # Result leak detection (safety-net)
             if final_text.lstrip().startswith("Результаты запросов"):
                 logger.warning("⚠️ RESULT-LEAK detected")
-                self._metrics.setdefault("result_leak_filtered", 0)
-                self._metrics["result_leak_filtered"] += 1
+                self._metrics.result_leak_filtered += 1
                 if self._pending_tour_cards:
                     final_text = (
                         "Вот что нашёл по вашему запросу! "
@@ -1367,10 +1762,10 @@ class OpenAIHandler(YandexGPTHandler):
                 else:
                     empty_retries += 1
                     if empty_retries < 3:
-                        self.full_history.append({
+                        self._push_history({
                             "role": "assistant", "content": final_text
                         })
-                        self.full_history.append({
+                        self._push_history({
                             "role": "user",
                             "content": (
                                 "Ответь клиенту нормальным текстом — "
@@ -1381,34 +1776,19 @@ class OpenAIHandler(YandexGPTHandler):
                         continue
                     final_text = "Я обработал ваш запрос. Чем могу помочь?"
 
-            # Dedup (safety-net, unlikely with OpenAI but harmless)
-            final_text = _dedup_response(final_text)
-
-            # Strip leaked LLM reasoning / JSON fragments from end of response
-            final_text = _strip_reasoning_leak(final_text)
-
-            # Strip leaked internal IDs (tourid, hotelcode, requestid)
-            final_text = _strip_technical_ids(final_text)
+            # Dedup, reasoning/JSON leaks, internal IDs, repeated/merged
+            # questions, orphaned fragment after the last '?'
+            final_text = _clean_response(final_text)
 
-            # Sentence-level dedup (catches intra-paragraph question repeats)
-            final_text = _dedup_sentences(final_text)
-
-            # Truncate duplicate merged questions ("Какой тип питания? Какой тип питания вам подходит?")
-            final_text = _fix_merged_questions(final_text)
-
-            # Strip orphaned dialogue-continuation fragments after last '?'
-            final_text = _strip_trailing_fragment(final_text)
-
-            # Strip leaked function names (e.g. "get_tour_details")
-            final_text = _RE_FUNC_NAMES.sub('', final_text)
-            final_text = re.sub(r'\s{2,}', ' ', final_text).strip()
+            # Strip leaked function names (e.g. "get_tour_details") — у всех имён есть '_'
+            if '_' in final_text:
+                final_text = _RE_FUNC_NAMES.sub('', final_text)
+            # strip() до sub(): оба возвращают исходную строку, если менять
+            # нечего, — на чистом ответе ни одной новой аллокации
+            final_text = _RE_MULTISPACE.sub(' ', final_text.strip())
 
             # Hide technical error messages from user
-            final_text = re.sub(
-                r'(?:возникла\s+)?техническ\w+\s+ошибк\w+',
-                'не удалось выполнить поиск',
-                final_text, flags=re.IGNORECASE
-            )
+            final_text = _RE_TECH_ERROR.sub('не удалось выполнить поиск', final_text)
 
             # ── Lead-catcher (П.2): ценовой ориентир под ПЕРВОЙ выдачей ──
             # Детерминированная строка (точные числа из пула). Добавляем только
@@ -1441,7 +1821,7 @@ class OpenAIHandler(YandexGPTHandler):
             assistant_entry = {"role": "assistant", "content": final_text}
             if _usage_payload:
                 assistant_entry.update(_usage_payload)
-            self.full_history.append(assistant_entry)
+            self._push_history(assistant_entry)
 
             # ── Context limit warning ──
             _hist_len = len(self.full_history)
@@ -1484,12 +1864,13 @@ class OpenAIHandler(YandexGPTHandler):
                         _hist_len
                     )
 
-            total_ms = int((time.perf_counter() - chat_start) * 1000)
-            logger.info(
-                "🤖 ASSISTANT << %d chars  %d iterations  %dms total  \"%s\"",
-                len(final_text), iteration, total_ms,
-                final_text[:200] + ("…" if len(final_text) > 200 else "")
-            )
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(
+                    "🤖 ASSISTANT << %d chars  %d iterations  %.0fms total  \"%.*s%s\"",
+                    len(final_text), iteration,
+                    (time.perf_counter() - chat_start) * 1000,
+                    _PREVIEW_CAP, final_text, "…" if len(final_text) > _PREVIEW_CAP else ""
+                )
             return final_text
 
         logger.error("🤖 MAX ITERATIONS REACHED (%d)", max_iterations)
@@ -1497,46 +1878,82 @@ class OpenAIHandler(YandexGPTHandler):
 
     # ─── History Cleanup ──────────────────────────────────────────────────
 
+    @staticmethod
+    def _tool_block_complete(block: List[Dict]) -> bool:
+        """True if block[1:] answers exactly the block's tool_call ids.
+
+        Same result as comparing the two id sets, but single-call blocks (the
+        common case) allocate no set at all, and an unknown id bails out
+        before the rest of the block is read.
+        """
+        tool_calls = block[0]["tool_calls"]
+        if len(tool_calls) == 1:
+            only_id = tool_calls[0]["id"]
+            return len(block) > 1 and all(
+                m.get("tool_call_id") == only_id for m in block[1:]
+            )
+        expected = frozenset(tc["id"] for tc in tool_calls)
+        pending = set(expected)
+        for m in block[1:]:
+            call_id = m.get("tool_call_id")
+            if call_id not in expected:
+                return False
+            pending.discard(call_id)
+        return not pending
+
     def _cleanup_history(self):
         """
         Remove invalid message sequences from full_history.
         Uses block grouping to keep tool_call/tool_result pairs atomic.
+
+        Lazy: if history has not changed since the last pass (same identity
+        checks as _history_blocks), it is already clean and the walk is
+        skipped — repeated 400 retries within one turn cost nothing.
         """
-        blocks = self._group_into_blocks(self.full_history)
+        history = self.full_history
+        mark = getattr(self, "_clean_mark", None)
+        if (
+            mark is not None
+            and mark[0] is history
+            and mark[1] == len(history)
+            and mark[2] is (history[-1] if history else None)
+        ):
+            return
+        blocks = self._history_blocks()
         cleaned_blocks = []
+        # Диагностика (множества id) строится только при включённом DEBUG
+        _debug = logger.isEnabledFor(logging.DEBUG)
         for block in blocks:
             msg = block[0]
-            if msg.get("role") == "tool":
-                logger.debug(
-                    "🧹 CLEANUP: skipping orphaned tool message "
-                    "tool_call_id=%s",
-                    msg.get("tool_call_id", "?")
-                )
-                continue
-            if msg.get("role") == "assistant" and msg.get("tool_calls"):
-                tc_ids = {tc["id"] for tc in msg["tool_calls"]}
-                found_ids = {
-                    m.get("tool_call_id")
-                    for m in block[1:]
-                    if m.get("role") == "tool"
-                }
-                if tc_ids != found_ids:
+            role = msg.get("role")
+            if role == _ROLE_TOOL:
+                if _debug:
                     logger.debug(
-                        "🧹 CLEANUP: removing incomplete tool_call block "
-                        "expected=%s found=%s",
-                        tc_ids, found_ids
+                        "🧹 CLEANUP: skipping orphaned tool message "
+                        "tool_call_id=%s",
+                        msg.get("tool_call_id", "?")
                     )
+                continue
+            if role == _ROLE_ASSISTANT and msg.get("tool_calls"):
+                if not self._tool_block_complete(block):
+                    if _debug:
+                        logger.debug(
+                            "🧹 CLEANUP: removing incomplete tool_call block "
+                            "expected=%s found=%s",
+                            {tc["id"] for tc in msg["tool_calls"]},
+                            {m.get("tool_call_id") for m in block[1:]}
+                        )
                     continue
             cleaned_blocks.append(block)
 
-        cleaned = [msg for block in cleaned_blocks for msg in block]
-        if len(cleaned) != len(self.full_history):
+        if len(cleaned_blocks) != len(blocks):
+            old_len = len(history)
+            self._set_history_from_blocks(cleaned_blocks)
             logger.info(
                 "🧹 CLEANUP: %d → %d messages (removed %d invalid)",
-                len(self.full_history), len(cleaned),
-                len(self.full_history) - len(cleaned)
+                old_len, len(history), old_len - len(history)
             )
-        self.full_history = cleaned
+        self._clean_mark = (history, len(history), history[-1] if history else None)
 
     # ─── Streaming (fallback to non-streaming) ────────────────────────────
 
@@ -1546,15 +1963,29 @@ class OpenAIHandler(YandexGPTHandler):
         on_token: Optional[StreamCallback] = None
     ) -> str:
         """
-        Streaming not yet implemented for OpenAI.
-        Falls back to regular chat().
+        chat() с потоковой отдачей текста.
+
+        При OPENAI_STREAM + OPENAI_STREAM_TOKENS каждый текстовый delta модели
+        уходит в ``on_token`` сразу из стрима (первый токен — через RTT, а не
+        после всего ответа). Текст промежуточных итераций тоже виден, поэтому
+        клиент обязан показать финальный ответ (возвращаемое значение) поверх
+        накопленных токенов. Иначе — прежнее поведение: один on_token(результат).
         """
-        logger.warning(
-            "⚠️ chat_stream() fallback to chat() — "
-            "streaming не реализован для OpenAI"
-        )
-        result = await self.chat(user_message)
-        if on_token:
+        if not (on_token and _OPENAI_STREAM and _OPENAI_STREAM_TOKENS):
+            result = await self.chat(user_message)
+            if on_token:
+                on_token(result)
+            return result
+
+        streamed = [False]
+
+        def _forward(delta: str) -> None:
+            streamed[0] = True
+            on_token(delta)
+
+        result = await self.chat(user_message, on_token=_forward)
+        if not streamed[0]:
+            # Ответ без генерации текста (ошибка/заглушка) — отдаём целиком
             on_token(result)
         return result
 
@@ -1570,36 +2001,23 @@ class OpenAIHandler(YandexGPTHandler):
     def reset(self):
         """Reset dialogue history and all caches."""
         old_len = len(self.full_history)
-        self.full_history = []
-        self.input_list = []
-        self._pending_tour_cards = []
+        self._reset_dialogue_state()
         self._pinned_context = None
         self._pinned_search_intent = None
         self._collected_slots = {}
         self._nights_from_date_range = False
-        self._last_departure_city = "Москва"
+        self._last_assistant_content_lower = ""
+        self._tc_canon_cache = {}
+        self._blocks = None
+        self._clean_mark = None
         self._last_requestid = None
         self._tourid_map = {}
-        self._tour_details_cache = {}
-        self._tour_actualized_id = None
-        self._crm_submitted = None
-        self._shown_flight_signatures = {}
         self._last_search_params = {}
         self._user_stated_budget = None
         self._upsell_budget = None
-        self._empty_iterations = 0
-        self.previous_response_id = None
-        self._pending_api_calls = []
-        self._last_message_usage = None
         self._json_error_streak = 0
         self._context_warning_stage = 0
-        self._metrics = {
-            "promised_search_detections": 0,
-            "cascade_incomplete_detections": 0,
-            "dateto_corrections": 0,
-            "total_searches": 0,
-            "total_messages": 0,
-        }
+        self._metrics = _Metrics()
         logger.info(
             "🔄 HANDLER RESET  cleared %d messages from full_history",
             old_len
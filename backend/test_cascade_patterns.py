@@ -0,0 +1,174 @@
+"""Юнит-тесты паттернов гейта каскада (_check_cascade_slots).
+
+Запуск:
+    pytest backend/test_cascade_patterns.py
+    # либо как обычный скрипт (без pytest):
+    python3 backend/test_cascade_patterns.py
+"""
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import yandex_handler as yh  # noqa: E402
+from yandex_handler import _check_cascade_slots  # noqa: E402
+
+_TEXTS = [
+    "",
+    "хотим в турцию из москвы в начале июня на 7 ночей, двое взрослых",
+    "вылетаем с питера 15 марта, неделю, мы с мужем и ребенок 5 лет",
+    "2-1(4) всё включено 5*",
+    "в марте, без разницы какой отель",
+    "летим из екб с 10 по 17, любой",
+    "отель rixos premium, завтраки",
+    "хочу в отель Кемер, ультра всё включено, пятёрка",
+    "только отель в сочи на выходные",
+    "что посоветуете? весь октябрь, втроём",
+    "каир, аи, 4 звезды",
+    "в последнюю неделю августа, 3 года",
+]
+
+_PAIRS = [
+    ("_DEPARTURE_PATTERNS", "_DEPARTURE_RX"),
+    ("_CHILDAGE_TEXT_PATTERNS_BASE", "_CHILDAGE_TEXT_BASE_RX"),
+    ("_CHILDAGE_TEXT_PATTERNS_LC", "_CHILDAGE_TEXT_LC_RX"),
+    ("_SPECIFIC_DATE_PATTERNS", "_SPECIFIC_DATE_RX"),
+    ("_MONTH_QUALIFIER_LOOSE_PATTERNS", "_MONTH_QUALIFIER_LOOSE_RX"),
+    ("_NIGHTS_PATTERNS", "_NIGHTS_RX"),
+    ("_TRAVELERS_PATTERNS", "_TRAVELERS_RX"),
+    ("_STARS_PATTERNS", "_STARS_RX"),
+    ("_MEAL_PATTERNS", "_MEAL_RX"),
+    ("_SKIP_QUALITY_PATTERNS", "_SKIP_QUALITY_RX"),
+    ("_HOTEL_BRAND_PATTERNS", "_HOTEL_BRAND_RX"),
+]
+
+
+def test_compiled_sets_equal_any_of_patterns():
+    for list_name, rx_name in _PAIRS:
+        patterns, rx = getattr(yh, list_name), getattr(yh, rx_name)
+        for text in _TEXTS:
+            want = any(re.search(p, text) for p in patterns)
+            assert (rx.search(text) is not None) == want, (rx_name, text)
+
+
+def test_cascade_complete_dialogue():
+    history = [{"role": "user", "content":
+                "Турция из Москвы 15 июня на 7 ночей, двое взрослых, 5 звёзд всё включено"}]
+    assert _check_cascade_slots(history, {}) == (True, [])
+
+
+def test_cascade_reports_missing_slots():
+    history = [{"role": "user", "content": "Хочу в Турцию в марте"}]
+    ok, missing = _check_cascade_slots(history, {})
+    assert not ok
+    assert "город вылета" in missing
+    assert "промежуток в месяце (начало/середина/конец)" in missing
+    assert "состав путешественников" in missing
+
+
+def test_cascade_qc_skip_checks_last_message_only():
+    base = [{"role": "user", "content": "Турция из Москвы 15 июня на 7 ночей, двое взрослых"}]
+    ok, _ = _check_cascade_slots(base + [{"role": "user", "content": "НЕ ВАЖНО"}], {})
+    assert ok
+    ok, missing = _check_cascade_slots(
+        [{"role": "user", "content": "не важно"}] + base, {})
+    assert not ok and missing == ["категорию отеля и тип питания"]
+
+
+def test_cascade_early_pass_requires_dmy_date():
+    args = {"departure": 1, "datefrom": "15.06.2026", "nightsfrom": 7, "adults": 2, "stars": 4}
+    assert _check_cascade_slots([], args, is_follow_up=True) == (True, [])
+    args["datefrom"] = "15.6.2026"
+    assert _check_cascade_slots([], args, is_follow_up=True)[0] is False
+
+
+def test_cascade_trusts_full_args_after_five_user_turns():
+    args = {"departure": 1, "datefrom": "15.06.2026", "nightsfrom": 7, "adults": 2, "stars": 4}
+    turns = [{"role": "user", "content": "да"}] * 4
+    noise = [{"role": "user", "content": "Результаты вызванных функций: ..."},
+             {"role": "assistant", "content": "Уточню детали"}]
+    assert _check_cascade_slots(turns + noise, args)[0] is False
+    history = turns + noise + [{"role": "user", "content": "давай"}]
+    assert _check_cascade_slots(history, args) == (True, [])
+
+
+def test_cascade_brand_dropped_after_empty_hotel_lookup():
+    base = [{"role": "user", "content":
+             "Турция из Москвы 15 июня на 7 ночей, двое взрослых, отель rixos, всё включено"}]
+    assert _check_cascade_slots(base, {}) == (True, [])
+    lookup = [{"role": "assistant", "content": 'get_dictionaries(type="hotel", name="rixos")'},
+              {"role": "user", "content": "[get_dictionaries]: []"},
+              {"role": "assistant", "content": "Уточню детали"}]
+    ok, missing = _check_cascade_slots(base + lookup, {})
+    assert not ok and missing == ["категорию отеля (звёздность)"]
+
+
+def test_cascade_qc_question_needs_user_answer():
+    base = [{"role": "user", "content": "Турция из Москвы 15 июня на 7 ночей, двое взрослых"},
+            {"role": "assistant", "content": "Какой тип питания и категорию отеля рассматриваете?"}]
+    assert _check_cascade_slots(base, {})[0] is False
+    answer = [{"role": "user", "content": "Результаты вызванных функций: ..."},
+              {"role": "user", "content": "ну посмотрим"}]
+    assert _check_cascade_slots(base + answer, {}) == (True, [])
+
+
+def test_departure_validation_first_listed_pattern_wins():
+    def resolve(text):
+        return next((dep_id for rx, dep_id in yh._DEPARTURE_VALIDATION if rx.search(text)), None)
+    assert resolve("на поезде в сочи из москвы") == 1
+    assert resolve("в турцию в июне, вылет из казани") == 10
+    assert resolve("хотим в турцию в июне") is None
+    assert yh._DEPARTURE_VERIFY[5].search("летим с питера")
+
+
+def test_resort_first_listed_pattern_wins():
+    # Сочи в списке раньше Крыма — выигрывает, хотя в тексте правее
+    assert yh._find_mentioned_resort("в крым или в сочи")[2] == "426"
+    # «из сочи» — контекст вылета, берём следующий курорт
+    assert yh._find_mentioned_resort("летим из сочи в кемер")[2] == "22"
+    assert yh._find_mentioned_resort("хотим на море в июне") is None
+
+
+def test_recent_user_text_tracks_history():
+    h = yh.YandexGPTHandler.__new__(yh.YandexGPTHandler)
+    h._user_text_memo = {}
+    h.full_history = [
+        {"role": "user", "content": "В Турцию"},
+        {"role": "assistant", "content": "Откуда вылет?"},
+        {"role": "user", "content": "Результаты вызванных функций: ..."},
+        {"role": "user", "content": "Из Москвы"},
+    ]
+    excl = ("Результаты",)
+    assert h._recent_user_text(20, excl) == "в турцию из москвы"
+    assert h._recent_user_text(2) == "результаты вызванных функций: ... из москвы"
+    h.full_history.append({"role": "user", "content": "В июне"})
+    assert h._recent_user_text(20, excl) == "в турцию из москвы в июне"
+    # ресет истории новым списком той же длины — кэш не должен его спутать
+    h.full_history = [{"role": "user", "content": "Египет"}] * 5
+    assert h._recent_user_text(20, excl) == " ".join(["египет"] * 5)
+
+
+# ─────────────────────────── Standalone runner ───────────────────────
+
+def _run():
+    fns = [v for k, v in sorted(globals().items())
+           if k.startswith("test_") and callable(v)]
+    passed, failed = 0, 0
+    for fn in fns:
+        try:
+            fn()
+            print(f"  ✓ {fn.__name__}")
+            passed += 1
+        except AssertionError as e:
+            print(f"  ✗ {fn.__name__}: {e}")
+            failed += 1
+        except Exception as e:   # pragma: no cover
+            print(f"  ✗ {fn.__name__}: ERROR {e!r}")
+            failed += 1
+    print(f"\n== {passed}/{passed + failed} OK ==")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(_run())
@@ -0,0 +1,131 @@
+"""Юнит-тесты поиска отеля по названию (_fuzzy_hotel_match, _match_hotels_by_name).
+
+Запуск:
+    pytest backend/test_hotel_match.py
+    # либо как обычный скрипт (без pytest):
+    python3 backend/test_hotel_match.py
+"""
+import os
+import sys
+from difflib import SequenceMatcher
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from yandex_handler import (  # noqa: E402
+    _CYR_TO_LAT_ALT,
+    _fuzzy_hotel_match,
+    _match_hotels_by_name,
+    _transliterate,
+)
+
+
+def _reference_fuzzy(queries, hotels, threshold=0.65):
+    """Исходный алгоритм: полный перебор SequenceMatcher без оценок сверху."""
+    if isinstance(queries, str):
+        queries = [queries]
+    scored = []
+    for h in hotels:
+        hotel_name = h.get("name", "").lower()
+        hotel_words = hotel_name.split()
+        if not hotel_words:
+            continue
+        best = 0.0
+        for query in queries:
+            qws = query.lower().split()
+            if not qws:
+                continue
+            per = [max(SequenceMatcher(None, qw, hw).ratio() for hw in hotel_words) for qw in qws]
+            full = SequenceMatcher(None, query.lower(), hotel_name).ratio()
+            best = max(best, sum(per) / len(per), full)
+        if best >= threshold:
+            scored.append((best, h))
+    scored.sort(key=lambda x: -x[0])
+    return [h for _, h in scored]
+
+
+_HOTELS = [
+    {"id": 1, "name": "Rixos Premium Belek"},
+    {"id": 2, "name": "Rixos Sungate"},
+    {"id": 3, "name": "Titanic Deluxe Golf Belek"},
+    {"id": 4, "name": "Calista Luxury Resort"},
+    {"id": 5, "name": "Delphin Imperial Lara"},
+    {"id": 6, "name": "Кемер Резорт"},
+    {"id": 7, "name": ""},
+    {"id": 8, "name": "Maxx Royal Kemer Resort"},
+    {"id": 9, "name": "Limak Lara De Luxe Hotel & Resort"},
+]
+
+_QUERIES = [
+    "rixos",
+    "riksos premium",
+    ["delfin imperial", "delphin imperial"],
+    "titanik deluks",
+    "maks royal",
+    "kalista",
+    "limak lara",
+    "xyz",
+    "   ",
+    "Calista Luxury Resort",
+    "rixos sungate",
+    ["lara resort", "kemer"],
+]
+
+
+def test_fuzzy_matches_reference():
+    for q in _QUERIES:
+        for threshold in (0.5, 0.6, 0.65, 0.8):
+            got = [h["id"] for h in _fuzzy_hotel_match(q, _HOTELS, threshold)]
+            want = [h["id"] for h in _reference_fuzzy(q, _HOTELS, threshold)]
+            assert got == want, (q, threshold, got, want)
+
+
+def test_match_by_name_cyrillic_query():
+    found = _match_hotels_by_name("риксос", _HOTELS)
+    assert {h["id"] for h in found} == {1, 2}
+
+
+def test_match_by_name_latin_query_cyrillic_hotel():
+    found = _match_hotels_by_name("kemer rezort", _HOTELS)
+    assert [h["id"] for h in found][:1] == [6]
+
+
+def test_match_by_name_fuzzy_returns_original_dicts():
+    hotels = [dict(h) for h in _HOTELS]
+    found = _match_hotels_by_name("риксус премиум", hotels)
+    assert found and found[0] is hotels[0]
+    assert hotels == _HOTELS   # исходные dict'ы не тронуты
+
+
+def test_match_by_name_short_query_no_fuzzy():
+    assert _match_hotels_by_name("zz", _HOTELS) == []
+
+
+def test_transliterate_tables():
+    assert _transliterate("Щука ЁЖ Хаят") == "schuka ezh hayat"
+    assert _transliterate("Хаят Феникс", _CYR_TO_LAT_ALT) == "khayat pheniks"
+    assert _transliterate("Объект", {"о": "0"}) == "0бъект"
+
+
+# ─────────────────────────── Standalone runner ───────────────────────
+
+def _run():
+    fns = [v for k, v in sorted(globals().items())
+           if k.startswith("test_") and callable(v)]
+    passed, failed = 0, 0
+    for fn in fns:
+        try:
+            fn()
+            print(f"  ✓ {fn.__name__}")
+            passed += 1
+        except AssertionError as e:
+            print(f"  ✗ {fn.__name__}: {e}")
+            failed += 1
+        except Exception as e:   # pragma: no cover
+            print(f"  ✗ {fn.__name__}: ERROR {e!r}")
+            failed += 1
+    print(f"\n== {passed}/{passed + failed} OK ==")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(_run())
@@ -0,0 +1,149 @@
+"""Юнит-тесты группировки/очистки истории OpenAIHandler (_history_blocks,
+_cleanup_history, _trim_history).
+
+Запуск:
+    pytest backend/test_openai_history.py
+    # либо как обычный скрипт (без pytest):
+    python3 backend/test_openai_history.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from openai_handler import OpenAIHandler  # noqa: E402
+
+
+def _handler(history=None):
+    h = OpenAIHandler.__new__(OpenAIHandler)
+    h.full_history = list(history or [])
+    h._last_assistant_content_lower = ""
+    return h
+
+
+def _user(text):
+    return {"role": "user", "content": text}
+
+
+def _calls(*ids):
+    return {"role": "assistant", "content": None,
+            "tool_calls": [{"id": i, "type": "function",
+                            "function": {"name": "f", "arguments": "{}"}} for i in ids]}
+
+
+def _tool(call_id):
+    return {"role": "tool", "tool_call_id": call_id, "content": "{}"}
+
+
+def _shape(blocks):
+    return [[m.get("tool_call_id") or m["role"] for m in b] for b in blocks]
+
+
+def test_blocks_group_tool_results_with_call():
+    h = _handler([_user("a"), _calls("c1", "c2"), _tool("c1"), _tool("c2"),
+                  {"role": "assistant", "content": "ok"}, _tool("x")])
+    assert _shape(h._history_blocks()) == [
+        ["user"], ["assistant", "c1", "c2"], ["assistant"], ["x"]]
+
+
+def test_blocks_extend_incrementally_after_append():
+    h = _handler([_user("a"), _calls("c1")])
+    first = h._history_blocks()
+    h._push_history(_tool("c1"))
+    h._push_history(_user("b"))
+    blocks = h._history_blocks()
+    assert blocks is first
+    assert _shape(blocks) == [["user"], ["assistant", "c1"], ["user"]]
+
+
+def test_blocks_regroup_after_pop_and_reassign():
+    h = _handler([_user("a"), _calls("c1"), _tool("c1")])
+    h._history_blocks()
+    h.full_history.pop()
+    h.full_history.append(_user("b"))
+    assert _shape(h._history_blocks()) == [["user"], ["assistant"], ["user"]]
+    h.full_history = [_user("z")]
+    assert _shape(h._history_blocks()) == [["user"]]
+
+
+def test_cleanup_drops_incomplete_and_orphaned():
+    h = _handler([_user("a"), _calls("c1", "c2"), _tool("c1"),
+                  _user("b"), _tool("zz"), _calls("c3"), _tool("c3")])
+    h._history_blocks()
+    history = h.full_history
+    h._cleanup_history()
+    assert h.full_history is history   # очистка на месте, без нового списка
+    assert [m.get("tool_call_id") or m["role"] for m in h.full_history] == [
+        "user", "user", "assistant", "c3"]
+    # кэш остаётся согласованным с новой историей
+    h._push_history(_user("c"))
+    assert _shape(h._history_blocks()) == [["user"], ["user"], ["assistant", "c3"], ["user"]]
+
+
+def test_cleanup_skips_unchanged_history():
+    h = _handler([_user("a"), _calls("c1"), _tool("c1")])
+    h._cleanup_history()
+    calls = []
+    h._history_blocks = lambda: calls.append(1) or []
+    h._cleanup_history()
+    assert calls == []   # история не менялась — проход пропущен
+    h._push_history(_calls("c2"))
+    del h._history_blocks
+    h._cleanup_history()
+    assert [m.get("tool_call_id") or m["role"] for m in h.full_history] == [
+        "user", "assistant", "c1"]
+
+
+def test_tool_block_complete():
+    ok = OpenAIHandler._tool_block_complete
+    assert ok([_calls("c1"), _tool("c1")])
+    assert not ok([_calls("c1")])
+    assert not ok([_calls("c1"), _tool("c9")])
+    assert ok([_calls("c1", "c2"), _tool("c2"), _tool("c1")])
+    assert not ok([_calls("c1", "c2"), _tool("c1"), _tool("c1")])
+    assert not ok([_calls("c1", "c2"), _tool("c1"), _tool("c2"), _tool("c3")])
+
+
+def test_api_messages_reuse_clean_history_entries():
+    user, tool = _user("a"), _tool("c1")
+    usage_msg = {"role": "assistant", "content": "b", "tokens_prompt": 5}
+    h = _handler([user, _calls("c1"), tool, usage_msg])
+    h._pinned_context = h._pinned_search_intent = h._lead_info = None
+    h._collected_slots = {}
+    h.instructions = ""
+    tail = h._build_openai_messages()[-4:]
+    assert tail[0] is user and tail[2] is tool
+    assert tail[3] == {"role": "assistant", "content": "b"}
+
+
+def test_trim_keeps_blocks_atomic():
+    h = _handler([_user("sys")] + [_calls("c1"), _tool("c1")] + [_user(str(i)) for i in range(6)])
+    h._max_history_len = 5
+    h._trim_history()
+    assert len(h.full_history) <= 5
+    assert not any(m["role"] == "tool" for m in h.full_history)
+
+
+# ─────────────────────────── Standalone runner ───────────────────────
+
+def _run():
+    fns = [v for k, v in sorted(globals().items())
+           if k.startswith("test_") and callable(v)]
+    passed, failed = 0, 0
+    for fn in fns:
+        try:
+            fn()
+            print(f"  ✓ {fn.__name__}")
+            passed += 1
+        except AssertionError as e:
+            print(f"  ✗ {fn.__name__}: {e}")
+            failed += 1
+        except Exception as e:   # pragma: no cover
+            print(f"  ✗ {fn.__name__}: ERROR {e!r}")
+            failed += 1
+    print(f"\n== {passed}/{passed + failed} OK ==")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(_run())
@@ -0,0 +1,171 @@
+"""Юнит-тесты трекера слотов OpenAIHandler (_update_collected_slots).
+
+Запуск:
+    pytest backend/test_openai_slots.py
+    # либо как обычный скрипт (без pytest):
+    python3 backend/test_openai_slots.py
+
+Хендлер создаём через __new__ — без сети/ключей, только состояние, которое
+читает трекер слотов.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from openai_handler import OpenAIHandler  # noqa: E402
+
+
+def _handler(history=None):
+    h = OpenAIHandler.__new__(OpenAIHandler)
+    h.full_history = []
+    h._collected_slots = {}
+    h._nights_from_date_range = False
+    h._last_assistant_content_lower = ""
+    for msg in history or []:
+        h._push_history(msg)
+    return h
+
+
+# ─────────────────────────── «Без перелёта» ───────────────────────────
+
+def test_no_flight_returned_as_new_slot():
+    h = _handler()
+    new = h._update_collected_slots("Хочу в Сочи без перелёта")
+    assert new.get("Город вылета") == "без перелёта"
+    assert h._collected_slots["Город вылета"] == "без перелёта"
+
+
+def test_no_flight_keeps_departure_city_but_pins_intent():
+    h = _handler()
+    h._pinned_search_intent = None
+    new = h._update_collected_slots("из Москвы на поезде в Анапу")
+    assert new.get("Город вылета") == "Москва"
+    assert "БЕЗ ПЕРЕЛЁТА" in h._pinned_search_intent
+
+
+def test_only_hotel_pins_intent_without_departure_slot():
+    h = _handler()
+    h._pinned_search_intent = None
+    new = h._update_collected_slots("нужен только отель в Сочи")
+    assert "Город вылета" not in new
+    assert "БЕЗ ПЕРЕЛЁТА" in h._pinned_search_intent
+
+
+def test_departure_city_not_no_flight():
+    h = _handler()
+    new = h._update_collected_slots("Турция из Москвы")
+    assert new.get("Город вылета") == "Москва"
+    assert new["Направление"] == "Турция"
+
+
+def test_zhd_only_as_whole_word():
+    # «ж/д» внутри слов («между», «жду», «дождусь») — не поезд
+    for msg, city in (
+        ("Турция из Москвы, между 10 и 20 июня", "Москва"),
+        ("из Екатеринбурга, жду варианты", "Екатеринбург"),
+        ("из Казани, дождусь подборки", "Казань"),
+    ):
+        h = _handler()
+        h._pinned_search_intent = None
+        assert h._update_collected_slots(msg).get("Город вылета") == city, msg
+        assert h._pinned_search_intent is None, msg
+    h = _handler()
+    assert h._update_collected_slots("поедем по ж/д").get("Город вылета") == "без перелёта"
+
+
+def test_new_slots_only_this_message():
+    h = _handler()
+    h._update_collected_slots("Турция из Москвы")
+    new = h._update_collected_slots("на 7 ночей")
+    assert set(new) == {"Длительность"}
+    assert h._collected_slots["Направление"] == "Турция"
+
+
+# ─────────────────────────── Словари основ ───────────────────────────
+
+def test_destination_stem_and_region_code():
+    h = _handler()
+    new = h._update_collected_slots("Хотим в Казань из Екатеринбурга")
+    assert new["Направление"] == "Казань (regions=517)"
+    assert new["Город вылета"] == "Екатеринбург"
+
+
+def test_destination_phrases():
+    h = _handler()
+    assert h._update_collected_slots("Шри-Ланка в марте")["Направление"] == "Шри-Ланка"
+    assert h._update_collected_slots("южная корея")["Направление"] == "Южная Корея"
+    assert h._update_collected_slots("из нижнего новгорода")["Город вылета"] == "Нижний Новгород"
+
+
+def test_destination_requires_word_start():
+    h = _handler()
+    new = h._update_collected_slots("поставьте в очередь, кубок мира")
+    assert "Направление" not in new
+
+
+def test_departure_from_prep_only():
+    h = _handler()
+    new = h._update_collected_slots("хочу в москву")
+    assert "Город вылета" not in new
+    assert h._update_collected_slots("вылет с питера")["Город вылета"] == "Санкт-Петербург"
+
+
+# ─────────────────────────── Канонизация (регистр, ё→е) ───────────────────────────
+
+def test_canon_uppercase_and_yo():
+    h = _handler()
+    new = h._update_collected_slots("ВДВОЁМ, ВСЁ ВКЛЮЧЕНО, 5 ЗВЁЗД, 1 РЕБЁНОК")
+    assert new["Состав"] == "2 взрослых"
+    assert new["Питание"] == "всё включено"
+    assert new["Звёздность"] == "5 звезд"
+    assert new["Дети"] == "1 ребен"
+
+
+def test_canon_any_answer_uses_last_assistant():
+    h = _handler([{"role": "assistant", "content": "Какую звёздность отеля рассматриваете?"}])
+    h._update_collected_slots("Всё равно")
+    assert h._collected_slots["Звёздность"] == "любая"
+
+
+def test_date_range_sets_nights():
+    h = _handler()
+    h._update_collected_slots("С 16 по 28 АПРЕЛЯ")
+    assert h._collected_slots["Длительность"] == "12 ночей"
+    assert h._nights_from_date_range is True
+
+
+def test_bare_number_is_child_age_only_after_age_question():
+    h = _handler([{"role": "assistant", "content": "Сколько лет ребёнку?"}])
+    h._update_collected_slots("7")
+    assert h._collected_slots["Возраст ребёнка"] == "7 лет"
+
+    h = _handler([{"role": "assistant", "content": "На сколько ночей?"},
+                  {"role": "assistant", "tool_calls": [], "content": None}])
+    h._update_collected_slots("7")
+    assert "Возраст ребёнка" not in h._collected_slots
+
+
+# ─────────────────────────── Standalone runner ───────────────────────
+
+def _run():
+    fns = [v for k, v in sorted(globals().items())
+           if k.startswith("test_") and callable(v)]
+    passed, failed = 0, 0
+    for fn in fns:
+        try:
+            fn()
+            print(f"  ✓ {fn.__name__}")
+            passed += 1
+        except AssertionError as e:
+            print(f"  ✗ {fn.__name__}: {e}")
+            failed += 1
+        except Exception as e:   # pragma: no cover
+            print(f"  ✗ {fn.__name__}: ERROR {e!r}")
+            failed += 1
+    print(f"\n== {passed}/{passed + failed} OK ==")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(_run())
@@ -0,0 +1,118 @@
+"""Юнит-тесты сборки streaming-ответа OpenAI (_consume_openai_stream).
+
+Запуск:
+    pytest backend/test_openai_stream.py
+    # либо как обычный скрипт (без pytest):
+    python3 backend/test_openai_stream.py
+
+Чанки имитируем SimpleNamespace — той же формы, что отдаёт OpenAI SDK.
+"""
+import os
+import sys
+from types import SimpleNamespace as NS
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from openai_handler import OpenAIHandler  # noqa: E402
+
+
+def _chunk(content=None, tool_calls=None, finish=None, usage=None, choices=True):
+    if not choices:
+        return NS(choices=[], usage=usage)
+    delta = NS(content=content, tool_calls=tool_calls)
+    return NS(choices=[NS(delta=delta, finish_reason=finish)], usage=usage)
+
+
+def _tc(index, id=None, name=None, args=None):
+    return NS(index=index, id=id, function=NS(name=name, arguments=args))
+
+
+def test_text_only_stream():
+    chunks = [_chunk("Привет"), _chunk(", мир"), _chunk(finish="stop"),
+              _chunk(choices=False, usage=NS(prompt_tokens=1, completion_tokens=2, total_tokens=3))]
+    resp = OpenAIHandler._consume_openai_stream(iter(chunks))
+    choice = resp.choices[0]
+    assert choice.message.content == "Привет, мир"
+    assert choice.message.tool_calls is None
+    assert choice.finish_reason == "stop"
+    assert resp.usage.total_tokens == 3
+
+
+def test_tool_calls_assembled_and_emitted_early():
+    emitted = []
+    chunks = [
+        _chunk(tool_calls=[_tc(0, id="call_a", name="get_search_status", args='{"reque')]),
+        _chunk(tool_calls=[_tc(0, args='stid": "123"}')]),
+        _chunk(tool_calls=[_tc(1, id="call_b", name="get_current_date", args="{}")]),
+        _chunk(finish="tool_calls"),
+    ]
+
+    def on_tool_call(tc):
+        # к моменту вызова второй tool_call ещё не пришёл
+        emitted.append((tc.id, tc.function.name, tc.function.arguments))
+
+    resp = OpenAIHandler._consume_openai_stream(iter(chunks), on_tool_call)
+    tcs = resp.choices[0].message.tool_calls
+    assert [t.id for t in tcs] == ["call_a", "call_b"]
+    assert tcs[0].function.arguments == '{"requestid": "123"}'
+    assert resp.choices[0].message.content is None
+    assert emitted[0] == ("call_a", "get_search_status", '{"requestid": "123"}')
+    assert len(emitted) == 2
+
+
+def test_incomplete_arguments_not_emitted():
+    emitted = []
+    chunks = [
+        _chunk(tool_calls=[_tc(0, id="call_a", name="search_tours", args='{"a": "}')]),
+        _chunk(finish="length"),
+    ]
+    resp = OpenAIHandler._consume_openai_stream(iter(chunks), emitted.append)
+    assert emitted == []
+    assert resp.choices[0].finish_reason == "length"
+
+
+def test_tool_call_key_canonical_and_cached():
+    h = OpenAIHandler.__new__(OpenAIHandler)
+    h._tc_canon_cache = {}
+    a = _tc(0, "c1", "get_search_status", '{"b": 2, "a": "Турция"}\r\n')
+    b = _tc(1, "c2", "get_search_status", '{ "a":"Турция","b":2 }')
+    assert h._tool_call_key(a) == h._tool_call_key(b)
+    assert h._tool_call_key(a)[1] == '{"a": "Турция", "b": 2}'
+    a.function.arguments = "{}"   # повторный запрос — из кэша, без разбора
+    assert h._tool_call_key(a)[1] == '{"a": "Турция", "b": 2}'
+    bad = _tc(2, "c3", "search_tours", '{"a": 1,}')
+    assert h._tool_call_key(bad) == ("search_tours", '{"a": 1,}')
+
+
+def test_text_deltas_forwarded_live():
+    seen = []
+    chunks = [_chunk("Под"), _chunk("бираю"), _chunk(tool_calls=[_tc(0, "c1", "f", "{}")]),
+              _chunk(finish="tool_calls")]
+    resp = OpenAIHandler._consume_openai_stream(iter(chunks), on_text=seen.append)
+    assert seen == ["Под", "бираю"]
+    assert resp.choices[0].message.content == "Подбираю"
+
+
+# ─────────────────────────── Standalone runner ───────────────────────
+
+def _run():
+    fns = [v for k, v in sorted(globals().items())
+           if k.startswith("test_") and callable(v)]
+    passed, failed = 0, 0
+    for fn in fns:
+        try:
+            fn()
+            print(f"  ✓ {fn.__name__}")
+            passed += 1
+        except AssertionError as e:
+            print(f"  ✗ {fn.__name__}: {e}")
+            failed += 1
+        except Exception as e:   # pragma: no cover
+            print(f"  ✗ {fn.__name__}: ERROR {e!r}")
+            failed += 1
+    print(f"\n== {passed}/{passed + failed} OK ==")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(_run())
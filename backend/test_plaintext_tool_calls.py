@@ -0,0 +1,93 @@
+"""Юнит-тесты safety-net разбора текстовых вызовов функций (yandexgpt/rc).
+
+Запуск:
+    pytest backend/test_plaintext_tool_calls.py
+    # либо как обычный скрипт (без pytest):
+    python3 backend/test_plaintext_tool_calls.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from yandex_handler import _extract_plaintext_tool_calls, _parse_python_kwargs  # noqa: E402
+
+
+def test_kwargs_types():
+    assert _parse_python_kwargs("country=4, stars=4.5, hot=true, x=None, meal=AI") == {
+        "country": 4, "stars": 4.5, "hot": True, "x": None, "meal": "AI"}
+
+
+def test_kwargs_quoted_commas_and_equals():
+    raw = 'name="Rixos, Belek", q=\'a=b\', datefrom="01.06.2026"'
+    assert _parse_python_kwargs(raw) == {
+        "name": "Rixos, Belek", "q": "a=b", "datefrom": "01.06.2026"}
+
+
+def test_kwargs_unterminated_quote_runs_to_end():
+    assert _parse_python_kwargs('a=1, name="Rixos, b=2') == {"a": 1, "name": '"Rixos, b=2'}
+
+
+def test_kwargs_json_and_garbage():
+    assert _parse_python_kwargs(' {"country": 4} ') == {"country": 4}
+    assert _parse_python_kwargs("") == {}
+    assert _parse_python_kwargs(",, =1, foo") == {}
+
+
+def test_extract_python_like_call():
+    calls = _extract_plaintext_tool_calls('Ищу: search_tours(country=4, departure=1)')
+    assert calls == [("search_tours", '{"country": 4, "departure": 1}')]
+
+
+def test_extract_python_like_call_in_code_fence():
+    text = 'Сейчас поищу\n```python\nsearch_tours(country=4)\n```\nи get_current_date()'
+    assert _extract_plaintext_tool_calls(text) == [
+        ("search_tours", '{"country": 4}'), ("get_current_date", "{}")]
+
+
+def test_extract_name_newline_json():
+    calls = _extract_plaintext_tool_calls('get_hotel_info\n{"hotelcode": 123}')
+    assert calls == [("get_hotel_info", '{"hotelcode": 123}')]
+
+
+def test_extract_tool_call_start_marker():
+    text = '[TOOL_CALL_START]get_search_status\n{"requestid": "9"}'
+    assert _extract_plaintext_tool_calls(text) == [("get_search_status", '{"requestid": "9"}')]
+    assert _extract_plaintext_tool_calls("[TOOL_CALL_START]search_tours") == []
+
+
+def test_extract_json_wrapper():
+    text = '{"version": "1.0", "calls": [{"function": "get_current_date", "arguments": {}}]}'
+    assert _extract_plaintext_tool_calls(text) == [("get_current_date", "{}")]
+
+
+def test_extract_plain_prose_has_no_calls():
+    assert _extract_plaintext_tool_calls("Подобрал варианты в Турции. Какой нравится?") == []
+    assert _extract_plaintext_tool_calls("Цена (за двоих) — 150 000 ₽") == []
+    # регистр имени не тот — вызов всё равно отклонялся бы проверкой имени
+    assert _extract_plaintext_tool_calls("SEARCH_TOURS(country=4)") == []
+
+
+# ─────────────────────────── Standalone runner ───────────────────────
+
+def _run():
+    fns = [v for k, v in sorted(globals().items())
+           if k.startswith("test_") and callable(v)]
+    passed, failed = 0, 0
+    for fn in fns:
+        try:
+            fn()
+            print(f"  ✓ {fn.__name__}")
+            passed += 1
+        except AssertionError as e:
+            print(f"  ✗ {fn.__name__}: {e}")
+            failed += 1
+        except Exception as e:   # pragma: no cover
+            print(f"  ✗ {fn.__name__}: ERROR {e!r}")
+            failed += 1
+    print(f"\n== {passed}/{passed + failed} OK ==")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(_run())
@@ -0,0 +1,173 @@
+"""Юнит-тесты пост-обработки финального ответа (_clean_response и проходы).
+
+Запуск:
+    pytest backend/test_response_cleanup.py
+    # либо как обычный скрипт (без pytest):
+    python3 backend/test_response_cleanup.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from yandex_handler import (  # noqa: E402
+    _clean_response,
+    _dedup_response,
+    _dedup_sentences,
+    _fix_merged_questions,
+    _is_promised_search,
+    _is_self_moderation,
+    _strip_reasoning_leak,
+    _strip_technical_ids,
+    _strip_trailing_fragment,
+)
+
+
+def _sequential(text):
+    text = _dedup_response(text)
+    text = _strip_reasoning_leak(text)
+    text = _strip_technical_ids(text)
+    text = _dedup_sentences(text)
+    text = _fix_merged_questions(text)
+    return _strip_trailing_fragment(text)
+
+
+_SAMPLES = [
+    "",
+    "Привет!",
+    "Какие даты? Какие даты вас интересуют?",
+    "Подобрал варианты в Турции на 7 ночей для двоих взрослых. "
+    "Какой вариант вам больше нравится? Отлично, тогда",
+    "Вот туры. Вот туры. Вот туры. Выберите, пожалуйста, понравившийся "
+    "вариант из списка ниже.\n\nСпасибо!\n\nСпасибо!",
+    "Уточню детали. tourid=12345 Возникла ошибка при поиске.",
+    "Отличный выбор, отель хороший и пляж рядом. "
+    "We need to answer the user about the beach and hotel.",
+    "Сколько взрослых поедет в путешествие?Сколько взрослых поедет в путешествие с вами?",
+    "Первая строка ответа длинная\nещё текст\n"
+    "Первая строка ответа длинная\nещё текст и много чего другого и вообще",
+]
+
+
+def test_clean_response_matches_sequential_passes():
+    for sample in _SAMPLES:
+        assert _clean_response(sample) == _sequential(sample), sample
+
+
+def test_clean_response_strips_trailing_fragment():
+    text = _SAMPLES[3]
+    assert _clean_response(text).endswith("больше нравится?")
+
+
+def test_trailing_fragment_needs_whole_word():
+    head = "Подобрал варианты в Турции на 7 ночей. Какой вариант вам больше нравится?"
+    assert _strip_trailing_fragment(head + " Итак, тогда") == head
+    assert _strip_trailing_fragment(head + " Итоговая цена") == head + " Итоговая цена"
+
+
+def test_clean_response_short_text_unchanged():
+    assert _clean_response("Хорошо, ищу.") == "Хорошо, ищу."
+
+
+def test_clean_response_short_russian_skips_all_passes():
+    text = "  Отлично, подберу варианты на море.  "
+    assert _clean_response(text) is text
+    # латиница → проходы работают как обычно
+    text = "Уточню по отелю. requestid=123"
+    assert _clean_response(text) == _sequential(text)
+
+
+def test_dedup_response_paragraphs():
+    assert _clean_response(_SAMPLES[4]).count("Спасибо!") == 1
+
+
+def test_dedup_sentences_cuts_after_earliest_repeated_question():
+    q1 = "Какой бюджет на поездку вы рассматриваете?"
+    q2 = "Сколько ночей планируете отдыхать у моря?"
+    text = f"{q1} {q2} {q2} {q1}"
+    assert _dedup_sentences(text) == q1
+
+
+def test_dedup_sentences_ignores_short_questions():
+    text = "Куда летим? Куда летим? Подскажите, пожалуйста, даты поездки."
+    assert _dedup_sentences(text) == text
+
+
+def test_dedup_sentences_repeat_inside_longer_question():
+    # Повтор с другим вступлением — вопрос входит в соседний как подстрока
+    assert _dedup_sentences(
+        "Отлично, записал. Какой бюджет вы рассматриваете на поездку? "
+        "Уточните, пожалуйста: Какой бюджет вы рассматриваете на поездку?"
+    ) == "Отлично, записал. Какой бюджет вы рассматриваете на поездку?"
+    assert _dedup_sentences(
+        "Подскажите, какие даты вам удобны для поездки?\n"
+        "какие даты вам удобны для поездки?"
+    ) == "Подскажите, какие даты вам удобны для поездки?"
+
+
+def test_reasoning_leak_prefilter():
+    ru = "Подобрал для вас несколько отличных вариантов отдыха на море. " * 3
+    assert _strip_reasoning_leak(ru) == ru
+    leak = ru + "We need to answer the user."
+    assert _strip_reasoning_leak(leak) == ru.rstrip()
+    leak = ru + '{"role": "assistant", "content": "..."}'
+    assert _strip_reasoning_leak(leak) == ru.rstrip()
+    latin = ru + "Отель Rixos Premium, питание All Inclusive."
+    assert _strip_reasoning_leak(latin) == latin
+
+
+def test_reasoning_leak_early_marker_keeps_text():
+    # первое вхождение («The last») в пределах префикса → ответ не трогаем,
+    # даже если дальше есть ещё маркер
+    text = ("The last minute тур в Турцию — отличный выбор у моря. "
+            "The user reviews хвалят пляж и питание в этом отеле.")
+    assert _strip_reasoning_leak(text) == text
+
+
+def test_reasoning_marker_literals_cover_every_marker():
+    markers = [
+        "We need to", "we have to", "WE MUST", "We should", "Now I'm", "Now I ",
+        "I should", "I need to", "I must", "Let me ", "The conversation",
+        "The user", "The assistant", "The last", "ChatGPT", "GPT-4",
+        "as an AI", "Мы have", "Кажется the", "Похоже the", "system  require",
+        "one final", "final question", "I  will now", "I am going",
+        "based on the", "system prompt", "internal instruction",
+        "according to my", "per the instruction",
+    ]
+    ru = "Подобрал для вас несколько отличных вариантов отдыха на море. "
+    for marker in markers:
+        assert _strip_reasoning_leak(ru + marker + " ...") == ru.rstrip(), marker
+
+
+def test_self_moderation_and_promise_detection():
+    assert _is_self_moderation("## Я не могу обсуждать эту тему.")
+    assert not _is_self_moderation("Подобрал варианты в Турции.")
+    assert _is_promised_search("Отлично! Сейчас ПОДБЕРУ варианты.")
+    assert _is_promised_search("Один момент…")
+    assert not _is_promised_search("Какой бюджет рассматриваете?")
+    assert not _is_promised_search("") and not _is_self_moderation(None)
+
+
+# ─────────────────────────── Standalone runner ───────────────────────
+
+def _run():
+    fns = [v for k, v in sorted(globals().items())
+           if k.startswith("test_") and callable(v)]
+    passed, failed = 0, 0
+    for fn in fns:
+        try:
+            fn()
+            print(f"  ✓ {fn.__name__}")
+            passed += 1
+        except AssertionError as e:
+            print(f"  ✗ {fn.__name__}: {e}")
+            failed += 1
+        except Exception as e:   # pragma: no cover
+            print(f"  ✗ {fn.__name__}: ERROR {e!r}")
+            failed += 1
+    print(f"\n== {passed}/{passed + failed} OK ==")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(_run())
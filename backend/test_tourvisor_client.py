@@ -0,0 +1,522 @@
+"""Юнит-тесты TourVisorClient (_request, словари, поллинг поиска).
+
+Запуск:
+    pytest backend/test_tourvisor_client.py
+    # либо как обычный скрипт (без pytest):
+    python3 backend/test_tourvisor_client.py
+
+Сеть не нужна: общий httpx.AsyncClient клиента подменяется клиентом на
+httpx.MockTransport, который отвечает из словаря по endpoint.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tourvisor_client  # noqa: E402
+from tourvisor_client import (  # noqa: E402
+    TourVisorClient,
+    _adaptive_poll_delay,
+    _dict_cache_key,
+    calculate_total_price,
+)
+
+
+def _client(responder, calls=None):
+    """TourVisorClient, чьи запросы обслуживает ``responder(request) -> dict``."""
+    tourvisor_client._LOCAL_DICT.clear()   # процессный кэш словарей — между тестами пуст
+    tv = TourVisorClient()
+    tv.auth_login, tv.auth_pass = "login", "pass"
+
+    def handle(request):
+        if calls is not None:
+            calls.append(request)
+        return httpx.Response(200, json=responder(request))
+
+    def get_client():
+        loop = asyncio.get_running_loop()
+        if loop not in tv._clients:
+            tv._clients[loop] = httpx.AsyncClient(
+                transport=httpx.MockTransport(handle), params=tv._auth_params())
+        return tv._clients[loop]
+
+    tv._get_client = get_client
+    return tv
+
+
+def _run_async(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+# ─────────────────────────── Общий клиент ───────────────────────────
+
+def test_shared_client_reused_within_loop():
+    seen = []
+    tv = _client(lambda r: {"data": {"hotel": {"name": "X"}}})
+    real_get_client = tv._get_client
+
+    def tracking_get_client():
+        c = real_get_client()
+        seen.append(c)
+        return c
+
+    tv._get_client = tracking_get_client
+
+    async def go():
+        await tv.get_hotel_info(1)
+        await tv.get_hotel_info(2)
+        await tv.close()
+
+    _run_async(go())
+    assert len(seen) == 2 and seen[0] is seen[1]
+    assert not tv._clients
+
+
+def test_get_client_rebuilt_for_new_loop():
+    tv = TourVisorClient()
+
+    async def grab():
+        return tv._get_client()
+
+    first = _run_async(grab())
+    again = _run_async(grab())
+    assert first is not again
+
+
+def test_client_per_loop_closed_on_its_loop():
+    # ход чата и поток prefetch actdetail — два живых loop одновременно
+    tv = TourVisorClient()
+    turn, prefetch = asyncio.new_event_loop(), asyncio.new_event_loop()
+
+    async def grab():
+        return tv._get_client()
+
+    turn_client = turn.run_until_complete(grab())
+    prefetch_client = prefetch.run_until_complete(grab())
+    assert turn_client is not prefetch_client
+    assert turn.run_until_complete(grab()) is turn_client   # переключение loop не плодит клиентов
+    prefetch.run_until_complete(tv.close())
+    turn.run_until_complete(tv.close())
+    assert turn_client.is_closed and prefetch_client.is_closed
+    assert not tv._clients
+    turn.close()
+    prefetch.close()
+
+
+def test_request_sends_auth_and_format():
+    calls = []
+    tv = _client(lambda r: {"lists": {"stars": {"star": {"id": 4}}}}, calls)
+    stars = _run_async(tv.get_stars())
+    assert stars == [{"id": 4}]
+    q = calls[0].url.params
+    assert q["authlogin"] == "login" and q["format"] == "json" and q["type"] == "stars"
+
+
+def test_request_records_api_call():
+    tv = _client(lambda r: {"data": {"hotel": {"name": "X"}}})
+    _run_async(tv._request("hotel.php", {"hotelcode": 5}))
+    (entry,) = tv.api_call_log
+    assert entry["endpoint"] == "hotel.php" and entry["response_code"] == 200
+    assert entry["response_bytes"] == len(b'{"data":{"hotel":{"name":"X"}}}')
+
+
+def test_request_does_not_mutate_caller_params():
+    tv = _client(lambda r: {"data": {"hotel": {"name": "X"}}})
+    params = {"hotelcode": 5}
+    _run_async(tv._request("hotel.php", params))
+    assert params == {"hotelcode": 5}
+
+
+def test_body_preview_skipped_unless_debug():
+    tv = _client(lambda r: {"data": {"hotel": {"name": "X"}}})
+    real_preview = tourvisor_client._json_preview
+    previews = []
+    tourvisor_client._json_preview = lambda data, limit=500: previews.append(data) or ""
+    logger = tourvisor_client.logger
+    level = logger.level
+    try:
+        logger.setLevel(logging.INFO)
+        _run_async(tv.get_hotel_info(1))
+        assert previews == []
+        logger.setLevel(logging.DEBUG)
+        _run_async(tv.get_hotel_info(2))
+        assert len(previews) == 1
+    finally:
+        logger.setLevel(level)
+        tourvisor_client._json_preview = real_preview
+
+
+def test_check_api_error_cases():
+    tv = TourVisorClient()
+    check = tv._check_api_error
+    check({"lists": {"meals": {}}}, "list.php")
+    check({"data": [1, 2]}, "result.php")
+    check({"data": {"status": {"state": "no search results"}}}, "hotel.php")
+    cases = [
+        ({"error": {"errormessage": "Wrong auth"}}, "list.php", tourvisor_client.TourVisorAPIError),
+        ({"data": {"errormessage": "Wrong (obsolete) TourID."}}, "actdetail.php",
+         tourvisor_client.TourIdExpiredError),
+        ({"data": {"success": 0}}, "actualize.php", tourvisor_client.TourVisorAPIError),
+        ({"data": {"status": {"state": "no search results"}}}, "result.php",
+         tourvisor_client.SearchNotFoundError),
+    ]
+    for data, endpoint, exc in cases:
+        try:
+            check(data, endpoint)
+        except exc:
+            continue
+        raise AssertionError(f"{endpoint}: {data} не вызвал {exc.__name__}")
+
+
+# ─────────────────────────── Кэш словарей ───────────────────────────
+
+def test_dict_cache_key_stable_and_ignores_auth():
+    a = _dict_cache_key({"type": "country", "cndep": 1})
+    b = _dict_cache_key({"cndep": 1, "type": "country", "authlogin": "x", "authpass": "y"})
+    assert a == b == "tv:v2:dict:country:" + a.rsplit(":", 1)[1]
+    assert a != _dict_cache_key({"type": "country", "cndep": 2})
+    # не зависит от PYTHONHASHSEED — фиксированное значение
+    assert _dict_cache_key({"type": "meal"}) == (
+        "tv:v2:dict:meal:" + hashlib.blake2b(b"type=meal", digest_size=16).hexdigest())
+
+
+def _with_fake_redis(fn):
+    store = {}
+    saved = (tourvisor_client.cache_get, tourvisor_client.cache_set,
+             tourvisor_client.is_cache_available)
+    tourvisor_client.cache_set = lambda k, v, ttl_seconds=0: store.__setitem__(k, (v, ttl_seconds))
+    tourvisor_client.cache_get = lambda k: store.get(k, (None,))[0]
+    tourvisor_client.is_cache_available = lambda: True
+    try:
+        return fn(store)
+    finally:
+        (tourvisor_client.cache_get, tourvisor_client.cache_set,
+         tourvisor_client.is_cache_available) = saved
+
+
+def test_list_php_served_from_cache_on_second_call():
+    def go(store):
+        calls = []
+        tv = _client(lambda r: {"lists": {"meals": {"meal": [{"id": 1}]}}}, calls)
+        first = _run_async(tv.get_meals())
+        second = _run_async(tv.get_meals())
+        assert first == second == [{"id": 1}]
+        assert len(calls) == 1
+        assert list(store) == [_dict_cache_key({"type": "meal"})]
+    _with_fake_redis(go)
+
+
+def test_dict_ttl_by_type():
+    def go(store):
+        tv = _client(lambda r: {"lists": {}})
+        _run_async(tv.get_flydates(1, 4))
+        _run_async(tv.get_stars())
+        _run_async(tv.get_currencies())
+        ttl = {k.split(":")[3]: v[1] for k, v in store.items()}
+        assert ttl == {"flydate": 3600, "stars": 30 * 86400, "currency": 3600}
+    _with_fake_redis(go)
+
+
+def test_stale_fallback_when_tourvisor_down():
+    def go(store):
+        state = {"down": False}
+
+        def handle(request):
+            if state["down"]:
+                return httpx.Response(503)
+            return httpx.Response(200, json={"lists": {"meals": {"meal": [{"id": 2}]}}})
+
+        tv = _client(None)
+        tv._get_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(handle))
+        saved = tourvisor_client._TV_STALE_FALLBACK
+        tourvisor_client._TV_STALE_FALLBACK = True
+        try:
+            assert _run_async(tv.get_meals()) == [{"id": 2}]
+            # свежий ключ истёк, TourVisor лежит → отдаём stale-копию
+            del store[_dict_cache_key({"type": "meal"})]
+            tourvisor_client._LOCAL_DICT.clear()
+            state["down"] = True
+            assert _run_async(tv.get_meals()) == [{"id": 2}]
+            tourvisor_client._LOCAL_DICT.clear()
+            tourvisor_client._TV_STALE_FALLBACK = False
+            try:
+                _run_async(tv.get_meals())
+                assert False, "expected HTTPStatusError"
+            except httpx.HTTPStatusError:
+                pass
+        finally:
+            tourvisor_client._TV_STALE_FALLBACK = saved
+    _with_fake_redis(go)
+
+
+def test_concurrent_identical_list_requests_coalesced():
+    calls = []
+
+    async def handle(request):
+        calls.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"lists": {"meals": {"meal": [{"id": 3}]}}})
+
+    tv = _client(None)
+    tv._get_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(handle))
+
+    async def go():
+        return await asyncio.gather(tv.get_meals(), tv.get_meals(), tv.get_stars())
+
+    meals_a, meals_b, _ = _run_async(go())
+    assert meals_a == meals_b == [{"id": 3}]
+    assert meals_a is not meals_b
+    assert sorted(c.url.params["type"] for c in calls) == ["meal", "stars"]
+    assert not tourvisor_client._INFLIGHT
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    calls = []
+
+    async def handle(request):
+        calls.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"lists": {"meals": {"meal": [{"id": 3}]}}})
+
+    tv = _client(None)
+    tv._get_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(handle))
+
+    async def go():
+        leader = asyncio.ensure_future(tv.get_meals())
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(tv.get_meals())
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        try:
+            await leader
+            assert False, "expected CancelledError"
+        except asyncio.CancelledError:
+            pass
+        return await follower
+
+    assert _run_async(go()) == [{"id": 3}]
+    assert len(calls) == 2   # ведомый повторил запрос сам
+    assert not tourvisor_client._INFLIGHT
+
+
+def test_local_dict_cache_returns_copies():
+    calls = []
+    tv = _client(lambda r: {"lists": {"meals": {"meal": [{"id": 1}]}}}, calls)
+    first = _run_async(tv.get_meals())
+    first[0]["id"] = 99          # вызывающий мутирует свой результат
+    second = _run_async(tv.get_meals())
+    assert second == [{"id": 1}]
+    assert len(calls) == 1
+
+
+def test_local_dict_cache_expires_and_evicts():
+    tourvisor_client._LOCAL_DICT.clear()
+    tourvisor_client._local_dict_put("k0", {"a": 1}, 0)
+    assert tourvisor_client._local_dict_get("k0") is None
+    saved = tourvisor_client._LOCAL_DICT_MAX
+    tourvisor_client._LOCAL_DICT_MAX = 2
+    try:
+        for k in ("k1", "k2", "k3"):
+            tourvisor_client._local_dict_put(k, {"k": k}, 60)
+        assert list(tourvisor_client._LOCAL_DICT) == ["k2", "k3"]
+    finally:
+        tourvisor_client._LOCAL_DICT_MAX = saved
+        tourvisor_client._LOCAL_DICT.clear()
+
+
+def test_request_list_coerces_single_item_and_null_node():
+    payloads = {
+        "meal": {"lists": {"meals": {"meal": {"id": 1, "name": "AI"}}}},
+        "flydate": {"lists": {"flydates": None}},
+        "stars": {"lists": {"stars": {"star": [{"id": 3}, {"id": 4}]}}},
+    }
+    tv = _client(lambda r: payloads[r.url.params["type"]])
+
+    async def go():
+        return await tv.get_meals(), await tv.get_flydates(1, 4), await tv.get_stars()
+
+    meals, flydates, stars = _run_async(go())
+    assert meals == [{"id": 1, "name": "AI"}]
+    assert flydates == []
+    assert [s["id"] for s in stars] == [3, 4]
+
+
+# ─────────────────────────── Поллинг поиска ───────────────────────────
+
+def test_adaptive_poll_delay_bounds():
+    assert _adaptive_poll_delay(10, None, 1.0) == 1.0
+    assert _adaptive_poll_delay(10, 0, 1.0) == 1.0
+    # медленный прогресс → потолок, быстрый → пол (с jitter ±10%)
+    assert 1.8 <= _adaptive_poll_delay(10, 1, 1.0) <= 2.2
+    assert 0.27 <= _adaptive_poll_delay(95, 50, 1.0) <= 0.33
+
+
+def _status_responder(states):
+    """result.php отдаёт states по очереди: type=status — только статус,
+    type=result — статус вместе с выдачей."""
+    it = iter(states)
+
+    def respond(request):
+        status = next(it)
+        if request.url.params["type"] == "status":
+            return {"data": {"status": status}}
+        return {"data": {"status": status, "result": {"hotel": [{"hotelcode": 1}]}}}
+    return respond
+
+
+def _no_sleep(fn):
+    sleeps = []
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+
+    saved = asyncio.sleep
+    asyncio.sleep = fake_sleep
+    try:
+        fn()
+    finally:
+        asyncio.sleep = saved
+    return sleeps
+
+
+def test_wait_for_search_polls_until_finished():
+    calls = []
+    tv = _client(_status_responder([
+        {"state": "searching", "progress": 10, "hotelsfound": 0, "toursfound": 0},
+        {"state": "searching", "progress": 40, "hotelsfound": 2, "toursfound": 3},
+        {"state": "finished", "progress": 100, "hotelsfound": 3, "toursfound": 9},
+    ]), calls)
+    out = {}
+    sleeps = _no_sleep(lambda: out.update(r=_run_async(tv.wait_for_search("rid"))))
+    assert out["r"]["result"]["hotel"] == [{"hotelcode": 1}]
+    assert out["r"]["status"]["state"] == "finished"
+    # пауза отсчитывается от старта опроса — время ответа из неё вычтено
+    assert len(sleeps) == 2 and 0.9 < sleeps[0] < 1.0
+    assert 0 <= sleeps[1] <= 2.0 * 1.1
+    # после первого отеля — опрос сразу выдачей, без отдельного запроса результатов
+    assert [c.url.params["type"] for c in calls] == ["status", "status", "result"]
+
+
+def test_wait_for_search_early_return_uses_polled_results():
+    calls = []
+    tv = _client(_status_responder([
+        {"state": "searching", "progress": 20, "hotelsfound": 1, "toursfound": 1},
+        {"state": "searching", "progress": 60, "hotelsfound": 7, "toursfound": 20},
+    ]), calls)
+    out = {}
+    _no_sleep(lambda: out.update(r=_run_async(tv.wait_for_search("rid"))))
+    assert out["r"]["status"]["progress"] == 60
+    assert [c.url.params["type"] for c in calls] == ["status", "result"]
+
+
+def test_wait_for_search_deadline_bounds_inflight_poll():
+    async def handle(request):
+        await asyncio.sleep(5)   # TourVisor «висит» дольше max_wait
+        return httpx.Response(200, json={"data": {"status": {"state": "searching"}}})
+
+    tv = _client(None)
+    tv._get_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(handle))
+    t0 = time.monotonic()
+    try:
+        _run_async(tv.wait_for_search("rid", max_wait=0.1))
+        assert False, "expected NoResultsError"
+    except tourvisor_client.NoResultsError:
+        pass
+    assert time.monotonic() - t0 < 1
+
+
+def test_wait_for_search_poll_latency_counts_toward_interval():
+    real_sleep = asyncio.sleep
+
+    async def handle(request):
+        await real_sleep(0.05)
+        return httpx.Response(200, json={"data": {"status": {
+            "state": "searching", "progress": 10, "hotelsfound": 0, "toursfound": 0}}})
+
+    tv = _client(None)
+    tv._get_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(handle))
+    sleeps = []
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+        await real_sleep(0)
+
+    asyncio.sleep = fake_sleep
+    try:
+        async def go():
+            try:
+                await tv.wait_for_search("rid", max_wait=0.5)
+            except tourvisor_client.NoResultsError:
+                pass
+        _run_async(go())
+    finally:
+        asyncio.sleep = real_sleep
+    assert sleeps and all(d <= 1.0 - 0.04 for d in sleeps)
+
+
+def test_wait_for_search_timeout_returns_last_polled_results():
+    real_sleep = asyncio.sleep
+    started = []
+
+    async def handle(request):
+        started.append(time.monotonic())
+        await real_sleep(0.05)
+        status = {"state": "searching", "progress": 10, "hotelsfound": 2, "toursfound": 3}
+        if request.url.params["type"] == "status":
+            return httpx.Response(200, json={"data": {"status": status}})
+        return httpx.Response(200, json={"data": {"status": status, "result": {"hotel": [{"hotelcode": 1}]}}})
+
+    tv = _client(None)
+    tv._get_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(handle))
+
+    async def fake_sleep(delay):
+        await real_sleep(0)
+
+    asyncio.sleep = fake_sleep
+    try:
+        t0 = time.monotonic()
+        out = _run_async(tv.wait_for_search("rid", max_wait=0.3))
+    finally:
+        asyncio.sleep = real_sleep
+    assert out["result"]["hotel"] == [{"hotelcode": 1}]
+    # после дедлайна — ни одного запроса: отдаём выдачу последнего опроса
+    assert all(t < t0 + 0.3 for t in started)
+
+
+# ─────────────────────────── Утилиты ───────────────────────────
+
+def test_calculate_total_price():
+    assert calculate_total_price(100000, 0, 2, 0) == 100000
+    payments = [{"amount": "500"}, {"amount": 1000}, {}]
+    assert calculate_total_price(100000, 3000, 2, 1, payments) == 100000 + (3000 + 1500) * 3
+
+
+# ─────────────────────────── Standalone runner ───────────────────────
+
+def _run():
+    fns = [v for k, v in sorted(globals().items())
+           if k.startswith("test_") and callable(v)]
+    passed, failed = 0, 0
+    for fn in fns:
+        try:
+            fn()
+            print(f"  ✓ {fn.__name__}")
+            passed += 1
+        except AssertionError as e:
+            print(f"  ✗ {fn.__name__}: {e}")
+            failed += 1
+        except Exception as e:   # pragma: no cover
+            print(f"  ✗ {fn.__name__}: ERROR {e!r}")
+            failed += 1
+    print(f"\n== {passed}/{passed + failed} OK ==")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(_run())
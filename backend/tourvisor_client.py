@@ -6,17 +6,203 @@ TourVisor API Client
 import os
 import json
 import asyncio
+import concurrent.futures
+import copy
+import hashlib
+import importlib.util
+import random
+import threading
 import logging
 import time
-from typing import Optional, Dict, Any, List
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime, timedelta
 import httpx
 from dotenv import load_dotenv
 
+try:
+    from cache import cache_get, cache_set, is_cache_available
+except ImportError:  # redis не установлен — словари без кэша
+    cache_get = cache_set = is_cache_available = None
+
+try:
+    import orjson  # опционально: разбор ответов в 3-10 раз быстрее stdlib json
+except ImportError:
+    orjson = None
+
 load_dotenv()
 
 logger = logging.getLogger("mgp_bot")
 
+# Пул соединений общего httpx.AsyncClient (keep-alive между запросами одного хода)
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=100)
+_HTTP_TIMEOUT = 30.0
+# HTTP/2 (мультиплексирование поверх одного соединения) — только если
+# установлен h2 (httpx[http2]); иначе HTTP/1.1 keep-alive. Сжатие ответа
+# httpx согласует сам: Accept-Encoding gzip/deflate (+br/zstd при наличии
+# brotli/zstandard) и прозрачно распаковывает.
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+_AUTH_PARAMS = ("authlogin", "authpass")
+
+
+@dataclass(frozen=True, slots=True)
+class _EndpointCfg:
+    """Политика запроса к endpoint'у — одна запись вместо проверок имени."""
+    timeout: float = _HTTP_TIMEOUT
+    timeout_attempts: int = 1       # ReadTimeout-ретраи (Fix P14)
+    network_attempts: int = 1       # DNS/network-ретраи
+    cacheable: bool = False         # Redis-кэш + single-flight (словари)
+    check_no_results: bool = False  # status.state == "no search results"
+
+
+# Fix M6+F8: таймаут actdetail/actualize — 30с (если оператор не ответил за
+# 30с, ждать дольше бессмысленно; при ReadTimeout сработает retry P14 + F2).
+# Fix P14: ReadTimeout retry ТОЛЬКО для actdetail/actualize.
+_ENDPOINT_CFG: Dict[str, _EndpointCfg] = {
+    "actdetail.php": _EndpointCfg(timeout_attempts=2, network_attempts=3),
+    "actualize.php": _EndpointCfg(timeout_attempts=2, network_attempts=3),
+    "search.php": _EndpointCfg(network_attempts=3),
+    "result.php": _EndpointCfg(network_attempts=3, check_no_results=True),
+    "list.php": _EndpointCfg(network_attempts=3, cacheable=True),
+}
+_DEFAULT_ENDPOINT_CFG = _EndpointCfg()
+
+# Redis-кэш словарей list.php. Версия в префиксе — смена формата/семантики
+# ключей инвалидирует весь кэш разом при деплое.
+_DICT_CACHE_PREFIX = "tv:v2:dict"
+_DICT_TTL_DEFAULT = 86400
+# TTL по type: справочники (города, страны, звёзды) почти не меняются,
+# даты вылетов/операторы/курсы — в течение дня, списки отелей с фильтрами — чаще.
+_DICT_TTL = {
+    "departure": 7 * 86400,
+    "country": 7 * 86400,
+    "stars": 30 * 86400,
+    "meal": 7 * 86400,
+    "services": 7 * 86400,
+    "currency": 3600,
+    "flydate": 3600,
+    "operator": 6 * 3600,
+    "region": 86400,
+    "subregion": 86400,
+    "hotel": 1800,
+}
+# Stale-копия словаря (tv:v2:stale:dict:...) — отдаётся, если TourVisor
+# недоступен (5xx / таймаут / сеть), даже когда свежий ключ уже истёк.
+_TV_STALE_FALLBACK = os.getenv("TV_STALE_FALLBACK", "0").lower() not in ("0", "false", "no", "off")
+_DICT_STALE_TTL = 30 * 86400
+
+# Single-flight для list.php: один HTTP-запрос на ключ, остальные ждут его
+# результат. Процессный (не per-client): у каждой сессии свой клиент и свой
+# event loop в своём потоке — поэтому concurrent.futures.Future + Lock.
+_INFLIGHT_LOCK = threading.Lock()
+_INFLIGHT: Dict[str, concurrent.futures.Future] = {}
+
+
+class _LeaderCancelled(Exception):
+    """Задачу-лидера single-flight отменили — ведомые повторяют запрос сами."""
+
+
+def _inflight_release(key: str, fut: concurrent.futures.Future) -> None:
+    """Снять fut с ключа (если на ключе уже новый лидер — не трогаем его)."""
+    with _INFLIGHT_LOCK:
+        if _INFLIGHT.get(key) is fut:
+            del _INFLIGHT[key]
+
+# Локальный (в процессе) слой перед Redis для словарей: повторные
+# get_countries/get_stars не ходят в Redis вовсе. Хранится сериализованный
+# JSON — каждый вызывающий получает свою копию, как и при чтении из Redis.
+_LOCAL_DICT_MAX = 512
+_LOCAL_DICT_TTL_MAX = 300
+_LOCAL_DICT_LOCK = threading.Lock()
+_LOCAL_DICT: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+
+def _local_dict_get(key: str) -> Optional[Any]:
+    with _LOCAL_DICT_LOCK:
+        entry = _LOCAL_DICT.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del _LOCAL_DICT[key]
+            return None
+        _LOCAL_DICT.move_to_end(key)
+    return _json_loads(entry[1])
+
+
+def _local_dict_put(key: str, data: Any, ttl: float) -> None:
+    raw = orjson.dumps(data) if orjson is not None else json.dumps(data, ensure_ascii=False)
+    with _LOCAL_DICT_LOCK:
+        _LOCAL_DICT[key] = (time.monotonic() + min(ttl, _LOCAL_DICT_TTL_MAX), raw)
+        _LOCAL_DICT.move_to_end(key)
+        while len(_LOCAL_DICT) > _LOCAL_DICT_MAX:
+            _LOCAL_DICT.popitem(last=False)
+
+
+# Адаптивный интервал поллинга wait_for_search (сек)
+_POLL_MIN_S = 0.3
+_POLL_MAX_S = 2.0
+
+
+def _adaptive_poll_delay(progress: float, rate: Optional[float], default: float) -> float:
+    """Пауза до следующего status-запроса по скорости роста progress.
+
+    rate — %/сек между двумя последними опросами (None/≤0 — скорость
+    неизвестна, ждём ``default``). Иначе четверть оценки ETA в пределах
+    [_POLL_MIN_S, _POLL_MAX_S] с jitter ±10%, чтобы параллельные поиски
+    не опрашивали TourVisor синхронно.
+    """
+    if not rate or rate <= 0:
+        return default
+    eta = (100 - progress) / rate
+    return min(max(_POLL_MIN_S, eta / 4), _POLL_MAX_S) * random.uniform(0.9, 1.1)
+
+
+def _dict_cache_key(params: Dict[str, Any]) -> str:
+    """Ключ Redis для ответа list.php.
+
+    blake2b по отсортированным параметрам (без авторизации) — одинаков во
+    всех воркерах; встроенный hash() строк рандомизирован per-process
+    (PYTHONHASHSEED), и кэш словарей между воркерами не совпадал.
+    """
+    raw = "&".join(
+        f"{k}={v}" for k, v in sorted(params.items()) if k not in _AUTH_PARAMS
+    ).encode()
+    digest = hashlib.blake2b(raw, digest_size=16).hexdigest()
+    return f"{_DICT_CACHE_PREFIX}:{params.get('type', 'unknown')}:{digest}"
+
+
+def _json_loads(raw: bytes) -> Any:
+    """Разбор тела ответа; ошибки — json.JSONDecodeError (orjson — подкласс)."""
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def _json_preview(data: Any, limit: int = 500) -> str:
+    """Начало JSON-представления ответа для debug-лога."""
+    if orjson is not None:
+        raw = orjson.dumps(data, default=str)
+        if len(raw) <= limit:
+            return raw.decode("utf-8")
+        return raw[:limit].decode("utf-8", "ignore") + "…"
+    preview = json.dumps(data, ensure_ascii=False, default=str)
+    return preview if len(preview) <= limit else preview[:limit] + "…"
+
+
+def _stale_cache_key(cache_key: str) -> str:
+    return cache_key.replace(":dict:", ":stale:dict:", 1)
+
+
+def _stale_fallback(endpoint: str, cache_key: Optional[str], error: str) -> Optional[Dict]:
+    """Последний известный ответ словаря при недоступности TourVisor (или None)."""
+    if cache_key is None or not _TV_STALE_FALLBACK:
+        return None
+    stale = cache_get(_stale_cache_key(cache_key))
+    if stale is not None:
+        logger.warning("⚠️ STALE FALLBACK %s  key=%s  error=%s", endpoint, cache_key, error)
+    return stale
+
 
 # ==================== ИСКЛЮЧЕНИЯ ====================
 
@@ -67,6 +253,37 @@ class TourVisorClient:
             or os.getenv("TOURVISOR_AUTH_PASS")
         )
         self.api_call_log: List[Dict] = []
+        # Общий клиент: TCP/TLS-соединение переиспользуется между запросами
+        # (поллинг result.php, actdetail и т.д.). Пул привязан к event loop,
+        # а loop'ов одновременно может быть несколько (ход в app.py и поток
+        # prefetch actdetail) — поэтому свой клиент на каждый loop, под локом.
+        # Закрывает его close() на том же loop.
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._clients_lock = threading.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _auth_params(self) -> Dict[str, Any]:
+        """Параметры, которые httpx добавляет к каждому запросу клиента."""
+        return {"authlogin": self.auth_login, "authpass": self.auth_pass, "format": "json"}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Общий AsyncClient для текущего event loop (создаётся лениво)."""
+        loop = asyncio.get_running_loop()
+        with self._clients_lock:
+            client = self._clients.get(loop)
+            if client is None or client.is_closed:
+                client = self._clients[loop] = httpx.AsyncClient(
+                    timeout=_HTTP_TIMEOUT, limits=_HTTP_LIMITS, params=self._auth_params(),
+                    http2=_HTTP2,
+                )
+        return client
     
     async def _request(self, endpoint: str, params: Dict[str, Any] = None, timeout: Optional[float] = None) -> Dict:
         """
@@ -76,60 +293,97 @@ class TourVisorClient:
         Ошибки определяются по полям в JSON:
         - errormessage — текст ошибки
         - success: 0 — флаг неуспеха
+
+        Одинаковые параллельные запросы list.php (холодный кэш, истёкший TTL)
+        схлопываются: в TourVisor уходит один, остальные получают копию ответа.
         """
         if params is None:
             params = {}
-        
+        cfg = _ENDPOINT_CFG.get(endpoint, _DEFAULT_ENDPOINT_CFG)
+        if not cfg.cacheable:
+            return await self._do_request(endpoint, params, cfg, timeout)
+
+        dict_key = _dict_cache_key(params)
+        local = _local_dict_get(dict_key)
+        if local is not None:
+            logger.info("🌐 TOURVISOR << %s  LOCAL HIT  key=%s", endpoint, dict_key)
+            return local
+        with _INFLIGHT_LOCK:
+            fut = _INFLIGHT.get(dict_key)
+            leader = fut is None
+            if leader:
+                fut = _INFLIGHT[dict_key] = concurrent.futures.Future()
+        if not leader:
+            logger.info("🌐 TOURVISOR << %s  COALESCED  key=%s", endpoint, dict_key)
+            try:
+                # shield: отмена ведомого не должна отменять общий future
+                data = await asyncio.shield(asyncio.wrap_future(fut))
+            except _LeaderCancelled:
+                logger.info("🌐 TOURVISOR << %s  LEADER CANCELLED — retrying  key=%s", endpoint, dict_key)
+                return await self._request(endpoint, params, timeout)
+            # копия: ответ лидера уже отдан его вызывающему
+            return copy.deepcopy(data)
+        try:
+            data = await self._do_request(endpoint, params, cfg, timeout, dict_key)
+            fut.set_result(data)
+            _local_dict_put(dict_key, data, _DICT_TTL.get(params.get("type"), _DICT_TTL_DEFAULT))
+            return data
+        except asyncio.CancelledError:
+            # Отмена — только лидера: ведомые (из других сессий/loop) её не
+            # просили. Снимаем ключ до set_exception, чтобы их повтор стал
+            # новым запросом, а не ждал этот же future.
+            _inflight_release(dict_key, fut)
+            fut.set_exception(_LeaderCancelled())
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            _inflight_release(dict_key, fut)
+
+    async def _do_request(self, endpoint: str, params: Dict[str, Any], cfg: _EndpointCfg,
+                          timeout: Optional[float] = None, dict_key: Optional[str] = None) -> Dict:
+        """HTTP-запрос с ретраями; для list.php (dict_key) — через Redis-кэш."""
         # --- Redis cache для словарей (list.php) ---
         _cache_key = None
-        if endpoint == "list.php":
-            try:
-                from cache import cache_get, cache_set, is_cache_available
-                if is_cache_available():
-                    _safe = {k: v for k, v in params.items() if k not in ("authlogin", "authpass")}
-                    _cache_key = f"tv:dict:{_safe.get('type', 'unknown')}:{hash(json.dumps(_safe, sort_keys=True))}"
-                    cached = cache_get(_cache_key)
-                    if cached is not None:
-                        logger.info("🌐 TOURVISOR << %s  CACHE HIT  key=%s", endpoint, _cache_key[:60])
-                        return cached
-            except ImportError:
-                pass
-        
-        # Добавляем авторизацию
-        params["authlogin"] = self.auth_login
-        params["authpass"] = self.auth_pass
-        params["format"] = "json"
+        _cache_ttl = _DICT_TTL_DEFAULT
+        if dict_key is not None and is_cache_available is not None and is_cache_available():
+            _cache_key = dict_key
+            _cache_ttl = _DICT_TTL.get(params.get("type"), _DICT_TTL_DEFAULT)
+            cached = cache_get(_cache_key)
+            if cached is not None:
+                logger.info("🌐 TOURVISOR << %s  CACHE HIT  key=%s", endpoint, _cache_key)
+                return cached
         
+        # Авторизация и format=json — параметры по умолчанию общего клиента
+        # (см. _get_client): params вызывающего не трогаем и логируем как есть
         url = f"{self.base_url}/{endpoint}"
-        
-        # Логируем запрос (без авторизационных данных)
-        safe_params = {k: v for k, v in params.items() if k not in ("authlogin", "authpass")}
-        logger.info("🌐 TOURVISOR >> %s  params=%s", endpoint, safe_params)
+        logger.info("🌐 TOURVISOR >> %s  params=%s", endpoint, params)
         t0 = time.perf_counter()
         
-        # Создаём новый клиент для каждого запроса (избегаем Event loop is closed)
-        # Fix M6+F8: Таймаут для actdetail/actualize — 30с (если оператор не ответил за 30с,
-        # ждать дольше бессмысленно; при ReadTimeout сработает retry P14 + fallback F2)
-        _default_timeout = 30.0 if endpoint in ("actdetail.php", "actualize.php") else 30.0
-        _timeout = timeout if timeout is not None else _default_timeout
-        # Fix P14: ReadTimeout retry ТОЛЬКО для actdetail/actualize
-        _max_timeout_attempts = 2 if endpoint in ("actdetail.php", "actualize.php") else 1
-        # DNS/network retry для расширенного набора endpoint'ов
-        _network_retry_endpoints = {"actdetail.php", "actualize.php", "search.php", "result.php", "list.php"}
-        _max_network_attempts = 3 if endpoint in _network_retry_endpoints else 1
+        _timeout = timeout if timeout is not None else cfg.timeout
+        _max_timeout_attempts = cfg.timeout_attempts
+        _max_network_attempts = cfg.network_attempts
 
         _timeout_attempts_done = 0
         _network_attempts_done = 0
         _total_max = max(_max_timeout_attempts, _max_network_attempts) * 2
         for _loop in range(_total_max):
             try:
-                async with httpx.AsyncClient(timeout=_timeout) as client:
-                    response = await client.get(url, params=params)
-                    elapsed_ms = int((time.perf_counter() - t0) * 1000)
-                    logger.info("🌐 TOURVISOR << %s  HTTP %s  %dms  size=%d bytes",
-                                endpoint, response.status_code, elapsed_ms, len(response.content))
-                    response.raise_for_status()
-                    data = response.json()
+                response = await self._get_client().get(url, params=params, timeout=_timeout)
+                elapsed_ms = int((time.perf_counter() - t0) * 1000)
+                status_code = response.status_code
+                response_bytes = len(response.content)
+                # wire — размер на проводе (после gzip), size — распакованный
+                logger.info("🌐 TOURVISOR << %s  HTTP %s  %dms  size=%d bytes  wire=%s  %s",
+                            endpoint, status_code, elapsed_ms, response_bytes,
+                            response.headers.get("content-length", "?"),
+                            response.headers.get("content-encoding", "identity"))
+                response.raise_for_status()
+                data = _json_loads(response.content)
+                # Сырое тело (на выдаче result.php — сотни КБ) дальше не нужно:
+                # не держим его рядом с разобранным dict до конца обработки
+                del response
                 break
             except httpx.ReadTimeout:
                 _timeout_attempts_done += 1
@@ -142,6 +396,9 @@ class TourVisorClient:
                 logger.error("🌐 TOURVISOR !! %s  TIMEOUT  %dms  (all %d attempts failed)",
                              endpoint, elapsed_ms, _max_timeout_attempts)
                 self._log_api_call(endpoint, 0, 0, elapsed_ms, error="ReadTimeout")
+                stale = _stale_fallback(endpoint, _cache_key, "ReadTimeout")
+                if stale is not None:
+                    return stale
                 raise
             except httpx.HTTPStatusError as e:
                 elapsed_ms = int((time.perf_counter() - t0) * 1000)
@@ -149,6 +406,10 @@ class TourVisorClient:
                              endpoint, e.response.status_code, elapsed_ms, str(e)[:200])
                 self._log_api_call(endpoint, e.response.status_code, 0, elapsed_ms,
                                    error=str(e)[:500])
+                if e.response.status_code >= 500:
+                    stale = _stale_fallback(endpoint, _cache_key, f"HTTP {e.response.status_code}")
+                    if stale is not None:
+                        return stale
                 raise
             except httpx.RequestError as e:
                 _network_attempts_done += 1
@@ -162,37 +423,35 @@ class TourVisorClient:
                 logger.error("🌐 TOURVISOR !! %s  NETWORK ERROR  %dms  (all %d attempts failed): %s",
                              endpoint, elapsed_ms, _max_network_attempts, str(e)[:200])
                 self._log_api_call(endpoint, 0, 0, elapsed_ms, error=str(e)[:500])
+                stale = _stale_fallback(endpoint, _cache_key, type(e).__name__)
+                if stale is not None:
+                    return stale
                 raise
         
-        # Логируем ключевые поля ответа
-        _final_elapsed = int((time.perf_counter() - t0) * 1000) if 'elapsed_ms' not in dir() else elapsed_ms
-        preview = json.dumps(data, ensure_ascii=False, default=str)
-        if len(preview) > 500:
-            preview = preview[:500] + "…"
-        logger.debug("🌐 TOURVISOR << %s  body=%s", endpoint, preview)
+        # Логируем ключевые поля ответа (сериализация — только при включённом DEBUG)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🌐 TOURVISOR << %s  body=%s", endpoint, _json_preview(data))
 
         self.api_call_log.append({
             "service": "tourvisor",
             "endpoint": endpoint,
-            "response_code": response.status_code if 'response' in dir() else None,
-            "response_bytes": len(response.content) if 'response' in dir() else None,
-            "latency_ms": _final_elapsed,
+            "response_code": status_code,
+            "response_bytes": response_bytes,
+            "latency_ms": elapsed_ms,
         })
         
         # --- Запись в api_calls (PostgreSQL) ---
-        self._log_api_call(endpoint, response.status_code, len(response.content), elapsed_ms)
+        self._log_api_call(endpoint, status_code, response_bytes, elapsed_ms)
         
         # Проверяем на ошибки API (HTTP 200, но есть errormessage)
-        self._check_api_error(data, endpoint)
+        self._check_api_error(data, endpoint, cfg)
         
         # --- Сохраняем в Redis cache (словари) ---
         if _cache_key is not None:
-            try:
-                from cache import cache_set
-                cache_set(_cache_key, data, ttl_seconds=86400)
-                logger.debug("🌐 TOURVISOR CACHE SET  key=%s", _cache_key[:60])
-            except ImportError:
-                pass
+            cache_set(_cache_key, data, ttl_seconds=_cache_ttl)
+            if _TV_STALE_FALLBACK:
+                cache_set(_stale_cache_key(_cache_key), data, ttl_seconds=_DICT_STALE_TTL)
+            logger.debug("🌐 TOURVISOR CACHE SET  key=%s  ttl=%ds", _cache_key, _cache_ttl)
         
         return data
     
@@ -219,7 +478,7 @@ class TourVisorClient:
         except Exception:
             pass
 
-    def _check_api_error(self, data: Dict, endpoint: str):
+    def _check_api_error(self, data: Dict, endpoint: str, cfg: Optional[_EndpointCfg] = None):
         """
         Проверить ответ на ошибки API
         
@@ -235,77 +494,83 @@ class TourVisorClient:
                            endpoint, data.get("errormessage", "unknown"))
         
         # Top-level {"error": {"errormessage": "..."}} — auth/validation errors
-        if "error" in data and isinstance(data["error"], dict):
-            err_msg = data["error"].get("errormessage", "").strip()
+        error = data.get("error")
+        if isinstance(error, dict):
+            err_msg = error.get("errormessage", "").strip()
             if err_msg:
                 logger.error("🌐 TOURVISOR API ERROR [%s]: %s", endpoint, err_msg)
                 raise TourVisorAPIError(err_msg, data)
         
+        # Всё остальное живёт в data: list.php (и прочие ответы без "data") —
+        # на этом проверка заканчивается
+        inner = data.get("data")
+        if not isinstance(inner, dict):
+            return
+        
         # Проверка на errormessage (например, для actualize.php)
-        if "data" in data:
-            inner = data["data"]
-            if isinstance(inner, dict):
-                error_msg = inner.get("errormessage")
-                success = inner.get("success")
-                
-                if error_msg:
-                    logger.warning("🌐 TOURVISOR API ERROR [%s]: %s", endpoint, error_msg)
-                    # Специфичные ошибки
-                    if "TourID" in error_msg or "tourid" in error_msg.lower():
-                        raise TourIdExpiredError(error_msg, data)
-                    raise TourVisorAPIError(error_msg, data)
-                
-                if success == 0:
-                    logger.warning("🌐 TOURVISOR API ERROR [%s]: success=0", endpoint)
-                    raise TourVisorAPIError("Операция не выполнена (success=0)", data)
-        
-        # Проверка на "no search results" (для result.php)
-        if endpoint == "result.php":
-            status = data.get("data", {}).get("status", {})
-            if status.get("state") == "no search results":
+        error_msg = inner.get("errormessage")
+        if error_msg:
+            logger.warning("🌐 TOURVISOR API ERROR [%s]: %s", endpoint, error_msg)
+            # Специфичные ошибки
+            if "TourID" in error_msg or "tourid" in error_msg.lower():
+                raise TourIdExpiredError(error_msg, data)
+            raise TourVisorAPIError(error_msg, data)
+        
+        if inner.get("success") == 0:
+            logger.warning("🌐 TOURVISOR API ERROR [%s]: success=0", endpoint)
+            raise TourVisorAPIError("Операция не выполнена (success=0)", data)
+        
+        # Проверка на "no search results" (для result.php) — тот же inner,
+        # без повторного data.get("data").get("status")
+        if cfg is None:
+            cfg = _ENDPOINT_CFG.get(endpoint, _DEFAULT_ENDPOINT_CFG)
+        if cfg.check_no_results:
+            status = inner.get("status")
+            if isinstance(status, dict) and status.get("state") == "no search results":
                 logger.warning("🌐 TOURVISOR API [%s]: no search results (requestid invalid)", endpoint)
                 raise SearchNotFoundError("Поиск не найден (requestid недействителен)", data)
     
+    async def _request_list(self, endpoint: str, params: Dict, *path: str) -> List:
+        """_request + извлечение списка по пути ключей.
+
+        TourVisor отдаёт одиночный элемент объектом, а не списком из одного —
+        приводим к списку здесь, а не в каждом getter'е. Промежуточный
+        null/пустой узел (например, "flydates": null) — пустой результат.
+        """
+        node = await self._request(endpoint, params)
+        for key in path[:-1]:
+            node = node.get(key) or {}
+        items = node.get(path[-1], [])
+        return items if isinstance(items, list) else [items]
+    
     # ==================== СПРАВОЧНИКИ ====================
     
     async def get_departures(self) -> List[Dict]:
         """Получить список городов вылета"""
-        data = await self._request("list.php", {"type": "departure"})
-        departures = data.get("lists", {}).get("departures", {}).get("departure", [])
-        return departures if isinstance(departures, list) else [departures]
+        return await self._request_list("list.php", {"type": "departure"}, "lists", "departures", "departure")
     
     async def get_countries(self, departure_id: Optional[int] = None) -> List[Dict]:
         """Получить список стран (опционально: с вылетами из города)"""
         params = {"type": "country"}
         if departure_id:
             params["cndep"] = departure_id
-        data = await self._request("list.php", params)
-        countries = data.get("lists", {}).get("countries", {}).get("country", [])
-        return countries if isinstance(countries, list) else [countries]
+        return await self._request_list("list.php", params, "lists", "countries", "country")
     
     async def get_regions(self, country_id: int) -> List[Dict]:
         """Получить курорты страны"""
-        data = await self._request("list.php", {"type": "region", "regcountry": country_id})
-        regions = data.get("lists", {}).get("regions", {}).get("region", [])
-        return regions if isinstance(regions, list) else [regions]
+        return await self._request_list("list.php", {"type": "region", "regcountry": country_id}, "lists", "regions", "region")
     
     async def get_subregions(self, country_id: int) -> List[Dict]:
         """Получить районы курортов страны"""
-        data = await self._request("list.php", {"type": "subregion", "regcountry": country_id})
-        subregions = data.get("lists", {}).get("subregions", {}).get("subregion", [])
-        return subregions if isinstance(subregions, list) else [subregions]
+        return await self._request_list("list.php", {"type": "subregion", "regcountry": country_id}, "lists", "subregions", "subregion")
     
     async def get_meals(self) -> List[Dict]:
         """Получить типы питания"""
-        data = await self._request("list.php", {"type": "meal"})
-        meals = data.get("lists", {}).get("meals", {}).get("meal", [])
-        return meals if isinstance(meals, list) else [meals]
+        return await self._request_list("list.php", {"type": "meal"}, "lists", "meals", "meal")
     
     async def get_stars(self) -> List[Dict]:
         """Получить категории отелей"""
-        data = await self._request("list.php", {"type": "stars"})
-        stars = data.get("lists", {}).get("stars", {}).get("star", [])
-        return stars if isinstance(stars, list) else [stars]
+        return await self._request_list("list.php", {"type": "stars"}, "lists", "stars", "star")
     
     async def get_operators(self, departure_id: Optional[int] = None, country_id: Optional[int] = None) -> List[Dict]:
         """Получить туроператоров"""
@@ -314,15 +579,11 @@ class TourVisorClient:
             params["flydeparture"] = departure_id
         if country_id:
             params["flycountry"] = country_id
-        data = await self._request("list.php", params)
-        operators = data.get("lists", {}).get("operators", {}).get("operator", [])
-        return operators if isinstance(operators, list) else [operators]
+        return await self._request_list("list.php", params, "lists", "operators", "operator")
     
     async def get_services(self) -> List[Dict]:
         """Получить услуги отелей"""
-        data = await self._request("list.php", {"type": "services"})
-        services = data.get("lists", {}).get("services", {}).get("service", [])
-        return services if isinstance(services, list) else [services]
+        return await self._request_list("list.php", {"type": "services"}, "lists", "services", "service")
     
     async def get_hotels(
         self,
@@ -344,26 +605,19 @@ class TourVisorClient:
             for ht in hotel_types:
                 params[f"hot{ht}"] = 1
         
-        data = await self._request("list.php", params)
-        hotels = data.get("lists", {}).get("hotels", {}).get("hotel", [])
-        return hotels if isinstance(hotels, list) else [hotels]
+        return await self._request_list("list.php", params, "lists", "hotels", "hotel")
     
     async def get_flydates(self, departure_id: int, country_id: int) -> List[str]:
         """Получить доступные даты вылета"""
-        data = await self._request("list.php", {
+        return await self._request_list("list.php", {
             "type": "flydate",
             "flydeparture": departure_id,
             "flycountry": country_id
-        })
-        _flydates_obj = data.get("lists", {}).get("flydates") or {}
-        flydates = _flydates_obj.get("flydate", [])
-        return flydates if isinstance(flydates, list) else [flydates]
+        }, "lists", "flydates", "flydate")
     
     async def get_currencies(self) -> List[Dict]:
         """Получить курсы валют у туроператоров (USD/EUR)"""
-        data = await self._request("list.php", {"type": "currency"})
-        currencies = data.get("lists", {}).get("currencies", {}).get("currency", [])
-        return currencies if isinstance(currencies, list) else [currencies]
+        return await self._request_list("list.php", {"type": "currency"}, "lists", "currencies", "currency")
     
     # ==================== ПОИСК ТУРОВ ====================
     
@@ -549,44 +803,69 @@ class TourVisorClient:
         Оптимизация: ранний возврат результатов когда найдено достаточно отелей
         и прогресс поиска >50%. Это ускоряет ответ на 10-15 секунд, т.к. не ждём
         медленных тур-операторов. Остальные туры попадут в continue_search.
+
+        Как только найден хотя бы один отель, опрос идёт сразу через
+        type=result (статус приходит в той же выдаче): готовый ответ
+        возвращается без второго запроса за результатами.
         
         Raises:
             NoResultsError: Поиск завершён, но туры не найдены
             SearchNotFoundError: requestid недействителен
         """
-        start = datetime.now()
+        start = time.monotonic()
         last_status = {}
+        prev_t = prev_progress = None
+        results = None  # выдача последнего опроса type=result (после первого отеля)
         
-        while (datetime.now() - start).total_seconds() < max_wait:
-            try:
-                last_status = await self.get_search_status(request_id)
-            except SearchNotFoundError:
-                raise  # requestid недействителен
-            
-            state = last_status.get("state")
-            hotels_found = last_status.get("hotelsfound", 0)
-            tours_found = last_status.get("toursfound", 0)
-            progress = last_status.get("progress", 0)
-            
-            # Поиск завершён полностью
-            if state == "finished":
-                if hotels_found == 0 or tours_found == 0:
-                    raise NoResultsError(
-                        f"Поиск завершён: найдено {hotels_found} отелей, {tours_found} туров",
-                        filters_hint="Попробуйте расширить даты, увеличить бюджет или убрать фильтры"
-                    )
-                return await self.get_search_results(request_id)
-            
-            # Оптимизация: ранний возврат — достаточно отелей и прогресс >50%
-            if hotels_found >= early_return_hotels and progress >= early_return_progress:
-                elapsed = (datetime.now() - start).total_seconds()
-                logger.info(
-                    "⚡ EARLY RETURN  requestid=%s  hotels=%d  progress=%d%%  elapsed=%.1fs",
-                    request_id, hotels_found, progress, elapsed
-                )
-                return await self.get_search_results(request_id)
-            
-            await asyncio.sleep(poll_interval)
+        # asyncio.timeout ограничивает и запрос, висящий в момент дедлайна,
+        # а не только проверку перед очередным опросом
+        try:
+            async with asyncio.timeout(max_wait):
+                while True:
+                    poll_started = time.monotonic()
+                    try:
+                        if last_status.get("hotelsfound", 0) >= 1:
+                            results = await self.get_search_results(request_id)
+                            last_status = results.get("status", {})
+                        else:
+                            last_status = await self.get_search_status(request_id)
+                    except SearchNotFoundError:
+                        raise  # requestid недействителен
+
+                    state = last_status.get("state")
+                    hotels_found = last_status.get("hotelsfound", 0)
+                    tours_found = last_status.get("toursfound", 0)
+                    progress = last_status.get("progress", 0)
+
+                    # Поиск завершён полностью
+                    if state == "finished":
+                        if hotels_found == 0 or tours_found == 0:
+                            raise NoResultsError(
+                                f"Поиск завершён: найдено {hotels_found} отелей, {tours_found} туров",
+                                filters_hint="Попробуйте расширить даты, увеличить бюджет или убрать фильтры"
+                            )
+                        return results if results is not None else await self.get_search_results(request_id)
+
+                    # Оптимизация: ранний возврат — достаточно отелей и прогресс >50%
+                    if hotels_found >= early_return_hotels and progress >= early_return_progress:
+                        elapsed = time.monotonic() - start
+                        logger.info(
+                            "⚡ EARLY RETURN  requestid=%s  hotels=%d  progress=%d%%  elapsed=%.1fs",
+                            request_id, hotels_found, progress, elapsed
+                        )
+                        return results if results is not None else await self.get_search_results(request_id)
+
+                    now = time.monotonic()
+                    rate = None
+                    if prev_t is not None and now > prev_t:
+                        rate = (progress - prev_progress) / (now - prev_t)
+                    prev_t, prev_progress = now, progress
+                    # Интервал считается от старта опроса: время ответа TourVisor
+                    # входит в паузу, а не добавляется к ней
+                    delay = _adaptive_poll_delay(progress, rate, poll_interval)
+                    await asyncio.sleep(max(0.0, delay - (now - poll_started)))
+        except TimeoutError:
+            pass
         
         # Timeout — возвращаем что есть (может быть частичный результат)
         hotels = last_status.get("hotelsfound", 0)
@@ -596,7 +875,8 @@ class TourVisorClient:
                 filters_hint="Попробуйте позже или измените параметры поиска"
             )
         
-        return await self.get_search_results(request_id)
+        # Опрос уже шёл через type=result — последняя выдача и есть ответ
+        return results if results is not None else await self.get_search_results(request_id)
     
     # ==================== АКТУАЛИЗАЦИЯ ====================
     
@@ -707,6 +987,10 @@ class TourVisorClient:
         """
         Продолжить поиск для получения дополнительных туров.
         Каждое продолжение считается отдельным запросом в лимит!
+        
+        continue лишь запускает догрузку на стороне TourVisor: result.php,
+        запрошенный параллельно (asyncio.gather) или сразу после, отдаст
+        старую выдачу. Новая страница — только после status → finished.
         """
         data = await self._request("search.php", {"continue": request_id})
         page = data.get("result", {}).get("page", "2")
@@ -716,8 +1000,15 @@ class TourVisorClient:
     # ==================== ЗАКРЫТИЕ ====================
     
     async def close(self):
-        """Закрыть клиент (заглушка — httpx.AsyncClient создаётся на каждый запрос)"""
-        pass
+        """Закрыть httpx.AsyncClient текущего event loop (вызывать до закрытия loop)"""
+        with self._clients_lock:
+            client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is None or client.is_closed:
+            return
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.debug("TourVisorClient.close: %s", e)
     
     # ==================== ГОРЯЩИЕ ТУРЫ ====================
     
@@ -818,19 +1109,11 @@ def calculate_total_price(
     - base_price уже включает топливный сбор
     - visa_charge и add_payments указаны ЗА ЧЕЛОВЕКА
     """
-    total = base_price
-    people = adults + children
-    
-    # Виза
-    total += visa_charge * people
-    
-    # Доплаты
+    # Виза и доплаты — за человека: суммируем и умножаем один раз
+    per_person = visa_charge
     if add_payments:
-        for payment in add_payments:
-            amount = int(payment.get("amount", 0))
-            total += amount * people
-    
-    return total
+        per_person += sum(int(payment.get("amount", 0)) for payment in add_payments)
+    return base_price + per_person * (adults + children)
 
 
 def calculate_hot_tour_price(price_per_person: int, people: int = 2) -> int:
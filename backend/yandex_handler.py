@@ -11,8 +11,10 @@ import asyncio
 import time
 import logging
 import re
-from datetime import datetime as _dt, timedelta as _td
+from collections import OrderedDict
+from datetime import date as _date, datetime as _dt, timedelta as _td
 from difflib import SequenceMatcher
+from operator import itemgetter
 from typing import Optional, Dict, Any, List, Callable, AsyncIterator, Tuple
 import requests
 from dotenv import load_dotenv
@@ -24,6 +26,11 @@ from tourvisor_client import (
     NoResultsError
 )
 
+try:
+    import orjson  # опционально: быстрый разбор аргументов tool call
+except ImportError:
+    orjson = None
+
 load_dotenv()
 
 logger = logging.getLogger("mgp_bot")
@@ -31,6 +38,69 @@ logger = logging.getLogger("mgp_bot")
 # Тип для callback функции streaming
 StreamCallback = Callable[[str], None]
 
+# Потолок кэша actdetail (tourid → ответ): пул выдачи листается страницами,
+# и за длинный диалог по одному поиску набираются десятки деталей.
+_TOUR_DETAILS_CACHE_MAX = 128
+
+
+class _BoundedCache(OrderedDict):
+    """dict с LRU-вытеснением: при записи сверх ``maxsize`` удаляется самый
+    давно использованный ключ. Чтение через [] / get() освежает ключ."""
+
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+class _Metrics:
+    """Счётчики качества сессии (Этап 3): атрибуты вместо dict-ключей."""
+
+    # Всегда отдаются в get_metrics() (агрегируются в /api/metrics)
+    _BASE = (
+        "promised_search_detections",     # Детекции "обещанного поиска"
+        "cascade_incomplete_detections",  # Блокировки из-за неполного каскада
+        "dateto_corrections",             # Исправления dateto
+        "total_searches",                 # Всего вызовов search_tours
+        "total_messages",                 # Всего сообщений пользователя
+    )
+    # Редкие события — в get_metrics() только после первого срабатывания
+    _EXTRA = (
+        "resort_without_region_detections",
+        "placeholder_id_rejections",
+        "plaintext_tool_call_recoveries",
+        "rejected_tool_calls_sanitized",
+        "result_leak_filtered",
+    )
+    __slots__ = _BASE + _EXTRA
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def asdict(self) -> Dict[str, int]:
+        out = {name: getattr(self, name) for name in self._BASE}
+        for name in self._EXTRA:
+            value = getattr(self, name)
+            if value:
+                out[name] = value
+        return out
+
 # ── Hotel name search helpers ──────────────────────────────────────────────
 _CYR_TO_LAT = {
     'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd',
@@ -42,6 +112,9 @@ _CYR_TO_LAT = {
     'э': 'e', 'ю': 'yu', 'я': 'ya',
 }
 _CYR_TO_LAT_ALT = {**_CYR_TO_LAT, 'ф': 'ph', 'х': 'kh'}
+# Таблицы для str.translate (многосимвольные замены 'zh'/'sch' поддерживаются)
+_CYR_TO_LAT_TABLE = str.maketrans(_CYR_TO_LAT)
+_CYR_TO_LAT_ALT_TABLE = str.maketrans(_CYR_TO_LAT_ALT)
 
 # ── Feature: "Статус заявки" (get_client_request_status) ──────────────────
 # Tenants where this feature is enabled. Двойной whitelist:
@@ -432,8 +505,13 @@ def _normalize_name_for_compare(name: str) -> str:
 
 def _transliterate(text: str, mapping: dict = None) -> str:
     """Cyrillic → Latin transliteration optimised for hotel name matching."""
-    m = mapping or _CYR_TO_LAT
-    return ''.join(m.get(c, c) for c in text.lower())
+    if not mapping or mapping is _CYR_TO_LAT:
+        table = _CYR_TO_LAT_TABLE
+    elif mapping is _CYR_TO_LAT_ALT:
+        table = _CYR_TO_LAT_ALT_TABLE
+    else:
+        table = str.maketrans(mapping)
+    return text.lower().translate(table)
 
 
 def _is_departure_context(text: str, match_start: int) -> bool:
@@ -450,24 +528,52 @@ def _fuzzy_hotel_match(queries, hotels: list, threshold: float = 0.65) -> list:
     """
     if isinstance(queries, str):
         queries = [queries]
+    # SequenceMatcher кэширует разбор второй строки (set_seq2), а
+    # real_quick_ratio/quick_ratio — дешёвые верхние оценки ratio(): точный
+    # ratio() считаем только когда он может улучшить текущий максимум.
+    # Отсев отелей по маске общих букв не делаем: порог popcount меняет
+    # выдачу, а точная оценка (2m/(len+m) по буквам, встречающимся в имени)
+    # на латинице почти ничего не отсекает — замерено без выигрыша.
+    sm = SequenceMatcher(None)
+
+    def _ratio_above(a: str, best: float, need: float = 0.0) -> float:
+        sm.set_seq1(a)
+        bar = max(best, need)
+        if sm.real_quick_ratio() < bar or sm.quick_ratio() < bar:
+            return best
+        return max(best, sm.ratio())
+
+    # Нормализация запросов — один раз, а не на каждый отель
+    prepared = [(q_lc, q_words) for q_lc in (q.lower() for q in queries)
+                if (q_words := q_lc.split())]
     scored: list = []
     for h in hotels:
         hotel_name = h.get("name", "").lower()
         hotel_words = hotel_name.split()
         if not hotel_words:
             continue
+        hotel_word_set = set(hotel_words)
         best_score = 0.0
-        for query in queries:
-            query_words = query.lower().split()
-            if not query_words:
-                continue
-            best_per_qword = []
-            for qw in query_words:
-                word_scores = [SequenceMatcher(None, qw, hw).ratio() for hw in hotel_words]
-                best_per_qword.append(max(word_scores))
+        for query_lc, query_words in prepared:
+            if query_lc == hotel_name:
+                best_score = 1.0   # d=0: лучше уже не будет
+                break
+            # Слово запроса, совпавшее со словом отеля, — сразу 1.0 без SequenceMatcher
+            best_per_qword = [1.0 if qw in hotel_word_set else 0.0 for qw in query_words]
+            pending = [i for i, score in enumerate(best_per_qword) if score < 1.0]
+            if pending:
+                for hw in hotel_words:
+                    sm.set_seq2(hw)
+                    for i in pending:
+                        best_per_qword[i] = _ratio_above(query_words[i], best_per_qword[i])
             avg_score = sum(best_per_qword) / len(best_per_qword)
-            full_ratio = SequenceMatcher(None, query.lower(), hotel_name).ratio()
-            best_score = max(best_score, avg_score, full_ratio)
+            best_score = max(best_score, avg_score)
+            if best_score >= 1.0:
+                break
+            # Ratio по имени целиком нужен, только если он дотягивает до
+            # threshold: иначе отель либо уже прошёл по словам, либо отсеется.
+            sm.set_seq2(hotel_name)
+            best_score = _ratio_above(query_lc, best_score, threshold)
         if best_score >= threshold:
             scored.append((best_score, h))
     scored.sort(key=lambda x: -x[0])
@@ -490,12 +596,13 @@ def _match_hotels_by_name(name_filter: str, hotels: list) -> list:
     else:
         latin_variants = [name_filter]
 
+    # Транслитерация имён — один раз на оба шага (_transliterate сам делает lower)
+    names_lat = [_transliterate(h.get("name", "")) for h in hotels]
+
     # Step 1: exact substring against original name + transliterated name
     matched = []
-    for h in hotels:
-        h_name = h.get("name", "").lower()
-        h_name_lat = _transliterate(h_name)
-        if name_filter in h_name:
+    for h, h_name_lat in zip(hotels, names_lat):
+        if name_filter in h.get("name", "").lower():
             matched.append(h)
         elif any(v in h_name_lat for v in latin_variants):
             matched.append(h)
@@ -507,22 +614,59 @@ def _match_hotels_by_name(name_filter: str, hotels: list) -> list:
     if len(name_filter) < 3:
         return []
 
-    transliterated = []
-    orig_map = {}
-    for h in hotels:
-        h_lat_name = _transliterate(h.get("name", "")).lower()
-        entry = {**h, "name": h_lat_name}
-        transliterated.append(entry)
-        orig_map[id(entry)] = h
+    # В fuzzy уходит только имя — без копии всего dict отеля
+    transliterated = [{"name": n} for n in names_lat]
+    orig_map = {id(entry): h for entry, h in zip(transliterated, hotels)}
 
     fuzzy_hits = _fuzzy_hotel_match(latin_variants, transliterated, threshold=0.60)
-    matched = [orig_map[id(fh)] for fh in fuzzy_hits if id(fh) in orig_map]
+    matched = [orig_map[id(fh)] for fh in fuzzy_hits]
     if matched:
         logger.info("HOTEL-SEARCH normalize-to-latin fuzzy %s, found=%d", latin_variants, len(matched))
 
     return matched
 
 
+# Фразы самомодерации Yandex GPT (см. _is_self_moderation)
+_MODERATION_PHRASES = (
+    "не могу обсуждать эту тему",
+    "я не могу обсуждать",
+    "не могу помочь с этим",
+    "давайте поговорим о чём-нибудь",
+    "поговорим о чём-нибудь ещё",
+    "я не могу отвечать на этот вопрос",
+)
+
+# Полный список запрещённых фраз-обещаний (синхронизирован с system_prompt.md § 0.0.1).
+# Проверка — `phrase in lower` по кортежу: на ответах в пару сотен символов
+# это быстрее, чем одна regex-альтернация из тех же литералов (re не строит
+# по ним автомат и проверяет альтернативы на каждой позиции).
+_PROMISE_PHRASES = (
+    # Поиск
+    "начну поиск", "начинаю поиск", "запускаю поиск", "приступаю к поиску",
+    "сейчас поищу", "сейчас найду", "сейчас подберу", "сейчас подбираю",
+    # Подбор
+    "начну подбор", "начинаю подбор",
+    "подберу для вас", "поищу для вас", "найду для вас",
+    # Поиск вариантов
+    "ищу подходящие", "ищу для вас", "ищу варианты",
+    # Давайте...
+    "давайте поищу", "давайте найду", "давайте подберу",
+    # Сейчас проверю/узнаю (для actualize_tour, get_hotel_info и т.д.)
+    "сейчас посмотрю", "сейчас проверю", "сейчас узнаю",
+    "сейчас уточню", "сейчас загружу",
+    # Момент/секунду
+    "момент, ищу", "секунду, подбираю", "минуту, проверяю",
+    "одну секунду", "один момент",
+    # Статус поиска (модель описывает запущенный процесс вместо вызова функции)
+    "поиск запущен", "ожидаю результат", "жду результат",
+    "запущен, ожидаю", "результаты скоро будут",
+    # Ложное утверждение о показе результатов (без реального вызова)
+    "показал варианты", "нашёл варианты", "нашел варианты",
+    "вот варианты", "подобрал для вас",
+    "вот что нашлось", "вот что я нашёл", "вот что я нашел",
+)
+
+
 def _is_self_moderation(text: str) -> bool:
     """
     Детектирует ответы самомодерации Yandex GPT.
@@ -531,16 +675,9 @@ def _is_self_moderation(text: str) -> bool:
     """
     if not text:
         return False
-    lower = text.lower().strip().lstrip('#').strip()
-    moderation_phrases = [
-        "не могу обсуждать эту тему",
-        "я не могу обсуждать",
-        "не могу помочь с этим",
-        "давайте поговорим о чём-нибудь",
-        "поговорим о чём-нибудь ещё",
-        "я не могу отвечать на этот вопрос",
-    ]
-    return any(phrase in lower for phrase in moderation_phrases)
+    # strip/lstrip('#') не нужны: фразы ищутся подстрокой
+    lower = text.lower()
+    return any(phrase in lower for phrase in _MODERATION_PHRASES)
 
 
 def _is_promised_search(text: str) -> bool:
@@ -554,35 +691,8 @@ def _is_promised_search(text: str) -> bool:
     """
     if not text:
         return False
-    lower = text.lower().strip()
-    
-    # Полный список запрещённых фраз (синхронизирован с system_prompt.md § 0.0.1)
-    promise_phrases = [
-        # Поиск
-        "начну поиск", "начинаю поиск", "запускаю поиск", "приступаю к поиску",
-        "сейчас поищу", "сейчас найду", "сейчас подберу", "сейчас подбираю",
-        # Подбор
-        "начну подбор", "начинаю подбор",
-        "подберу для вас", "поищу для вас", "найду для вас",
-        # Поиск вариантов
-        "ищу подходящие", "ищу для вас", "ищу варианты",
-        # Давайте...
-        "давайте поищу", "давайте найду", "давайте подберу",
-        # Сейчас проверю/узнаю (для actualize_tour, get_hotel_info и т.д.)
-        "сейчас посмотрю", "сейчас проверю", "сейчас узнаю",
-        "сейчас уточню", "сейчас загружу",
-        # Момент/секунду
-        "момент, ищу", "секунду, подбираю", "минуту, проверяю",
-        "одну секунду", "один момент",
-        # Статус поиска (модель описывает запущенный процесс вместо вызова функции)
-        "поиск запущен", "ожидаю результат", "жду результат",
-        "запущен, ожидаю", "результаты скоро будут",
-        # Ложное утверждение о показе результатов (без реального вызова)
-        "показал варианты", "нашёл варианты", "нашел варианты",
-        "вот варианты", "подобрал для вас",
-        "вот что нашлось", "вот что я нашёл", "вот что я нашел",
-    ]
-    return any(phrase in lower for phrase in promise_phrases)
+    lower = text.lower()
+    return any(phrase in lower for phrase in _PROMISE_PHRASES)
 
 
 # ── FIX B3: Список всех валидных имён функций (из function_schemas.json) ──
@@ -592,16 +702,31 @@ _VALID_FUNCTION_NAMES = frozenset([
     "get_hotel_info", "get_hot_tours", "submit_booking_request", "submit_client_request",
 ])
 
+# Альтернация имён в фиксированном порядке: порядок обхода frozenset зависит
+# от PYTHONHASHSEED, и исходник regex отличался от процесса к процессу
+_FUNC_NAMES_PATTERN = '|'.join(sorted(_VALID_FUNCTION_NAMES))
+# Первые буквы имён функций: lookahead в начале паттерна отсекает стартовые
+# позиции до перебора альтернатив имён (иначе альтернатива пробуется на
+# каждом символе текста)
+_FUNC_NAMES_FIRST = ''.join(sorted({n[0] for n in _VALID_FUNCTION_NAMES}))
+
+# Функции с обязательными аргументами: пустой вызов ({}) — отклоняем (Fix P1+F4)
+_REQUIRES_ARGS = frozenset({
+    "search_tours", "get_hot_tours", "get_hotel_info",
+    "get_search_status", "get_search_results",
+    "get_tour_details", "actualize_tour",
+    "continue_search", "get_dictionaries",
+})
+
 # Regex: function_name(...)  — Python-like вызов
 _RE_PLAINTEXT_CALL = re.compile(
-    r'(?:```[a-z]*\s*\n?)?\b(' + '|'.join(_VALID_FUNCTION_NAMES) + r')\s*\(([^)]*)\)\s*(?:\n?```)?',
+    r'(?=[`' + _FUNC_NAMES_FIRST + r'])(?:```[a-z]*\s*\n?)?\b(' + _FUNC_NAMES_PATTERN + r')\s*\(([^)]*)\)\s*(?:\n?```)?',
     re.IGNORECASE | re.DOTALL
 )
 
 # P7: Regex: function_name\n{json} — модель пишет имя функции, затем JSON на новой строке (сценарий 4)
-_FUNC_NAMES_PATTERN = '|'.join(_VALID_FUNCTION_NAMES)
 _RE_FUNCNAME_NEWLINE_JSON = re.compile(
-    r'\b(' + _FUNC_NAMES_PATTERN + r')\s*\n\s*(\{[^}]+\})',
+    r'(?=[' + _FUNC_NAMES_FIRST + r'])\b(' + _FUNC_NAMES_PATTERN + r')\s*\n\s*(\{[^}]+\})',
     re.IGNORECASE | re.DOTALL
 )
 
@@ -611,6 +736,12 @@ _RE_TOOL_CALL_START = re.compile(
     re.IGNORECASE | re.DOTALL
 )
 
+# Fix C3: {"version": "1.0", "calls": [...]} / {"function": ..., "arguments": {...}}
+_RE_JSON_CALLS = re.compile(
+    r'(\{[^{}]*"(?:calls|function)"[^{}]*(?:\{[^{}]*\}[^{}]*)*\})',
+    re.DOTALL
+)
+
 # P7: Regex: {"role": "assistant", "message": "text"} — JSON-обёртка (сценарий 11)
 _RE_JSON_WRAPPER = re.compile(
     r'\{\s*"role"\s*:\s*"assistant"\s*,\s*"message"\s*:\s*"([^"]+)"\s*\}',
@@ -618,6 +749,10 @@ _RE_JSON_WRAPPER = re.compile(
 )
 
 
+# Фрагмент kwargs между запятыми вне кавычек: "…" / '…' целиком, прочие символы кроме запятой
+_RE_KWARG_PART = re.compile(r"""(?:"[^"]*"?|'[^']*'?|[^,"'])+""")
+
+
 def _parse_python_kwargs(raw: str) -> Dict:
     """
     Парсит Python-like kwargs строку: key1=value1, key2="value2", key3=123
@@ -638,28 +773,9 @@ def _parse_python_kwargs(raw: str) -> Dict:
     if not raw:
         return result
     
-    # Разбиваем по запятым, но уважая кавычки
-    parts = []
-    current = []
-    in_quotes = False
-    quote_char = None
-    for ch in raw:
-        if ch in ('"', "'") and not in_quotes:
-            in_quotes = True
-            quote_char = ch
-            current.append(ch)
-        elif ch == quote_char and in_quotes:
-            in_quotes = False
-            current.append(ch)
-        elif ch == ',' and not in_quotes:
-            parts.append(''.join(current).strip())
-            current = []
-        else:
-            current.append(ch)
-    if current:
-        parts.append(''.join(current).strip())
-    
-    for part in parts:
+    # Разбиваем по запятым, но уважая кавычки (незакрытая кавычка — до конца строки)
+    for m in _RE_KWARG_PART.finditer(raw):
+        part = m.group()
         if '=' not in part:
             continue
         key, _, val = part.partition('=')
@@ -705,15 +821,28 @@ def _extract_plaintext_tool_calls(text: str) -> List[Tuple[str, str]]:
     
     Возвращает список кортежей (function_name, arguments_json_string).
     Пустой список если plaintext tool calls не найдены.
+    
+    arguments_json_string — json.dumps(..., ensure_ascii=False) со стандартными
+    разделителями: строка дословно уходит в историю («Вызываю функции: …»)
+    и служит ключом дедупликации, поэтому формат не зависит от наличия orjson.
     """
     if not text or len(text) > 5000:  # Если текст слишком длинный — вряд ли это plaintext call
         return []
+    # Любой принятый вызов (паттерны 1–4) проходит проверку
+    # `name in _VALID_FUNCTION_NAMES` — имя функции обязано быть в тексте дословно
+    if not any(name in text for name in _VALID_FUNCTION_NAMES):
+        return []
     
     calls = []
     seen = set()  # Дедупликация — избегаем двойного захвата одного вызова
     
+    # Каждый паттерн требует своего литерала — без него regex-проход не нужен
+    # (у обычного текстового ответа обычно нет ни «(», ни «{», ни «[»)
+    has_paren = '(' in text
+    has_brace = '{' in text
+    
     # ── Паттерн 1: function_name(args) — оригинальный формат ──
-    for match in _RE_PLAINTEXT_CALL.finditer(text):
+    for match in (_RE_PLAINTEXT_CALL.finditer(text) if has_paren else ()):
         func_name = match.group(1)
         raw_args = match.group(2)
         
@@ -735,7 +864,7 @@ def _extract_plaintext_tool_calls(text: str) -> List[Tuple[str, str]]:
             logger.error("❌ PLAINTEXT-TOOL-CALL PARSE ERROR [pattern1]: %s — %s", func_name, e)
     
     # ── Паттерн 2: function_name\n{json} (сценарий 4) ──
-    for match in _RE_FUNCNAME_NEWLINE_JSON.finditer(text):
+    for match in (_RE_FUNCNAME_NEWLINE_JSON.finditer(text) if has_brace and '\n' in text else ()):
         func_name = match.group(1)
         json_str = match.group(2)
         
@@ -757,7 +886,7 @@ def _extract_plaintext_tool_calls(text: str) -> List[Tuple[str, str]]:
             logger.error("❌ PLAINTEXT-TOOL-CALL PARSE ERROR [pattern2]: %s — %s", func_name, e)
     
     # ── Паттерн 3: [TOOL_CALL_START]function_name\n{json} (сценарий 7) ──
-    for match in _RE_TOOL_CALL_START.finditer(text):
+    for match in (_RE_TOOL_CALL_START.finditer(text) if '[' in text else ()):
         func_name = match.group(1)
         json_str = match.group(2) if match.group(2) else "{}"
         
@@ -768,10 +897,7 @@ def _extract_plaintext_tool_calls(text: str) -> List[Tuple[str, str]]:
             parsed = json.loads(json_str)
             # Fix P1+F4: Отклоняем пустые вызовы для функций с обязательными параметрами
             # Fix F4: get_dictionaries({}) без type всегда возвращает ошибку — блокируем
-            if not parsed and func_name in ("search_tours", "get_hot_tours", "get_hotel_info",
-                                             "get_search_status", "get_search_results",
-                                             "get_tour_details", "actualize_tour",
-                                             "continue_search", "get_dictionaries"):
+            if not parsed and func_name in _REQUIRES_ARGS:
                 logger.warning("⚠️ PLAINTEXT-TOOL-CALL REJECTED [pattern3]: %s({}) — пустые аргументы", func_name)
                 continue
             args_json = json.dumps(parsed, ensure_ascii=False)
@@ -789,10 +915,10 @@ def _extract_plaintext_tool_calls(text: str) -> List[Tuple[str, str]]:
     # ── Паттерн 4 (Fix C3): JSON-формат {"version": "1.0", "calls": [...]} ──
     # Модель иногда выводит JSON-обёртку вместо вызова через API.
     # Пример из Сценария 13: {"version":"1.0","calls":[{"id":"1","function":"get_current_date","arguments":{}},...]}
-    if not calls and '{' in text:
+    if not calls and has_brace:
         try:
             # Пробуем найти JSON-объект с "calls" или "function" в тексте
-            _json_match = re.search(r'(\{[^{}]*"(?:calls|function)"[^{}]*(?:\{[^{}]*\}[^{}]*)*\})', text, re.DOTALL)
+            _json_match = _RE_JSON_CALLS.search(text)
             if _json_match:
                 _json_obj = json.loads(_json_match.group(1))
                 _json_calls = []
@@ -896,6 +1022,179 @@ _CHILDAGE_TEXT_PATTERNS_LC = _CHILDAGE_TEXT_PATTERNS_BASE + [
 ]
 
 
+# ── Паттерны каскада (_check_cascade_slots) ──
+# Списки — исходник (по паттерну на формулировку, с комментариями); в проверках
+# используются скомпилированные при импорте паттерны. Одна альтернация
+# p1|p2|… оказалась не быстрее: re пробует все ветки на каждой позиции, и на
+# тексте без совпадений (частый случай) выходит медленнее, чем отдельные
+# compiled.search подряд.
+
+class _AnyOf:
+    """Набор скомпилированных паттернов: search() — первое совпадение любого из них."""
+    __slots__ = ("_rxs",)
+
+    def __init__(self, patterns: List[str]):
+        self._rxs = tuple(re.compile(p) for p in patterns)
+
+    def search(self, text: str) -> Optional[re.Match]:
+        for rx in self._rxs:
+            m = rx.search(text)
+            if m:
+                return m
+        return None
+
+
+_MONTH_GENITIVE_RX = r'(?:января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)'
+
+# Слот 3: КОНКРЕТНЫЕ даты (слот полностью заполнен — НЕ спрашиваем)
+_SPECIFIC_DATE_PATTERNS = [
+    r'\d{1,2}\.\d{1,2}(?:\.\d{2,4})?',                           # 21.03 или 21.03.2026
+    r'\d{1,2}\s+' + _MONTH_GENITIVE_RX,                              # "15 марта" — конкретная дата
+    r'(?:в\s+)?(?:начал|середин|конц)\w*\s+' + _MONTH_GENITIVE_RX,   # "в начале марта" — часть месяца
+    r'(?:в\s+)?(?:начал|середин|конц)\w*\s+месяца',               # "в конце месяца"
+    r'(?:на\s+)?(?:майские|новогодние|новый год|8 марта|23 февраля|каникул)',  # праздники
+    r'(?:завтра|послезавтра|через\s+\w+\s+дн|через\s+неделю|через\s+месяц)',  # относительные
+    r'(?:в\s+)?(?:этом|следующем)\s+месяце',
+    r'(?:в\s+)?ближайшее\s+время',
+    r'(?:первой|второй)\s+половин[еы]',                           # "в первой половине"
+    r'ближе\s+к\s+(?:начал|конц|середин)',                        # "ближе к концу"
+    r'(?:под|к)\s+конец',                                          # "под конец мая"
+    r'(?:ближайш\w+\s+(?:вылет|дат|рейс))',                       # "ближайший вылет"
+    r'(?:всё?\s*равно\s*(?:когда|какая?\s+дат))',                  # "все равно когда"
+    r'(?:какой\s+есть|какая\s+есть|что\s+есть)',                   # "какой есть"
+    r'(?:любой\s+(?:период|ближайший|вылет|дат))',                 # "любой период"
+    r'(?:не\s*важно\s+когда|неважно\s+когда)',                     # "неважно когда"
+    r'(?:весь|целый)\s+\w*' + _MONTH_GENITIVE_RX.replace('|', r'\w*|').replace(r'(?:', '(?:'),  # "весь октябрь"
+]
+
+# Голый месяц + уточнение промежутка в другом сообщении ("в марте" … "в начале")
+_MONTH_QUALIFIER_LOOSE_PATTERNS = [
+    r'\b(?:начал[еоу]|начало)\b',          # "в начале", "начале", "начало"
+    r'\b(?:середин[еуы]|середина)\b',       # "в середине"
+    r'\b(?:конц[еуы]|конец)\b',             # "в конце", "конце"
+    r'(?:перв\w+|втор\w+)\s+половин',       # "первой половине", "второй половине"
+    r'(?:последн\w+|первая|первую|первой)\s+(?:недел\w+)',  # "последняя неделя", "первая неделя"
+    r'\bс\s+\d{1,2}\b.*?\bпо\s+\d{1,2}\b',                 # "с 24 по 7" — числовой диапазон
+]
+
+# Слот 3: длительность (ночи/дни)
+_NIGHTS_PATTERNS = [
+    r'\d+\s*(?:ноч|дн|день|дней|ночей)',
+    r'(?:на\s+)?(?:неделю|недельку|две недели|2 недели)',
+    r'\bнедел[яюи]\b',  # "неделя", "неделю", "недели" без "на"
+    r'(?:на\s+)?(?:выходные|уикенд)',
+    r'(?:с\s+)?\d{1,2}(?:\.\d{1,2})?(?:\s+)?(?:по|-)(?:\s+)?\d{1,2}',  # с 10 по 17, 10-17
+]
+
+# Слот 4: состав путешественников
+_TRAVELERS_PATTERNS = [
+    r'(?:взрослы[хй]|взр\.?|вз\.?|adults)',
+    r'(?:дет(?:ей|и|ьми|ям)?|ребен(?:ок|ка)|child)',
+    r'(?:я\s+)?(?:один|одна|сам|одиночк)',
+    r'(?:двое|два|две)\s+(?:взрослы[хй]|человек|чел\.?)',
+    r'(?:трое|три|четыре|пять|шесть)\s+(?:взрослы[хй]|человек|чел\.?)',
+    r'\d+\s*(?:взрослы[хй]|человек|чел\.?|взр|вз)',
+    r'\d+\s*(?:в|вз)\s*\+',
+    r'(?:с\s+)?(?:мужем|женой|парнем|девушкой|подругой|другом)',
+    r'(?:вдво[её]м|втро[её]м|вчетвером|впятером)',
+    r'\d+[-–]\d+\(\d+',  # "2-1(4)" = 2 взрослых, 1 ребёнок (4 года)
+    r'(?:мы\s+с\s+)',
+]
+
+# Слот 5 (QC): звёздность / питание / явный skip / бренд
+_STARS_PATTERNS = [
+    r'\d[\s\-\+]*(?:зв[её]зд|\*|⭐)',                      # "5 звёзд", "4*", "5⭐", "3+ звёзд", "5-звёздочный"
+    r'(?:пяти|четыр[её]х|тр[её]х)зв[её]зд',               # "пятизвёздочный", "четырёхзвёздочный"
+    r'\b(?:пять|четыре|три|два)\s+зв[её]зд',             # "пять звезд", "четыре звезды"
+    r'\b(?:пят[её]рк|четв[её]рк|тройк)',                    # разг. "пятёрка"/"пятерка", "четвёрка"/"четверка"
+]
+
+_MEAL_PATTERNS = [
+    r'вс[её]\s*включен',                                  # "все включено" (е) И "всё включено" (ё)
+    r'ультра\s*вс[её]\s*включ',                           # "ультра все включено"
+    r'all\s*incl',                                         # "all inclusive"
+    r'ол+\s*инклюзив',                                    # "олл инклюзив", "ол инклюзив"
+    r'\b(?:аи|уаи)\b',                                    # "АИ", "УАИ" (word boundary — не матчит "Каир")
+    r'\b(?:ai|uai)\b',                                    # Latin AI, UAI
+    r'(?:полупансион|half\s*board|\bhb\b)',                # полупансион
+    r'(?:полный\s*пансион|full\s*board|\bfb\b)',           # полный пансион
+    r'(?:только\s*)?завтрак\w*',                            # "завтрак", "завтраки", "завтраками", "только завтрак"
+    r'\b(?:bb|ro|ob)\b',                                   # bed&breakfast, room only, only bed
+    r'(?:без\s*питани)',                                   # "без питания"
+]
+
+_SKIP_QUALITY_PATTERNS = [
+    # Контекстные паттерны: "любой" только в связке со звёздностью/отелем/питанием
+    r'(?:любой|любую|любое|любые)\s+(?:отель|категори|звёзд|звезд|питани)',
+    r'(?:любой|любая|любое)\b',  # одиночный ответ "любой" на вопрос QC (последнее сообщение)
+    r'(?:без\s*разницы|(?:всё|все)\s*равно(?!\s*когда))',
+    r'(?:не\s*важно|неважно|не\s*принципиально)',
+    r'(?:на\s+(?:ваше?|твоё?|твое?)\s+усмотрени)',
+    r'(?:рассмотрим\s+вариант|покажите?\s+что\s+есть|какие\s+есть)',
+    r'(?:покажите?\s+что-нибудь|что\s+посоветуете)',
+]
+
+# Бренды/конкретные отели — тоже skip quality check
+_HOTEL_BRAND_PATTERNS = [
+    r'\b(?:rixos|hilton|delphin|swissotel|kempinski|calista|titanic|gloria|regnum|maxx\s*royal)\b',
+    r'\b(?:iberostar|marriott|sheraton|radisson|accor|hyatt|intercontinental)\b',
+    # "отель [Название с заглавной]" — но НЕ "отель красивый"
+    # Этот паттерн ловит только конкретные упоминания с "хочу в отель ..."
+    r'(?:в\s+)?отел[ьеи]\s+[а-яА-Яa-zA-Z]{3,}',
+]
+
+_RE_DATE_DMY = re.compile(r'\d{2}\.\d{2}\.\d{4}')
+
+# Голое упоминание месяца ("в марте", "март", "апреле") — нужен промежуток (Fix P5)
+_BARE_MONTH_RX = re.compile(
+    r'(?:январ[еья]|феврал[еья]|март[еа]?|апрел[еья]|ма[еяй]|июн[еья]|июл[еья]|'
+    r'август[еа]?|сентябр[еья]|октябр[еья]|ноябр[еья]|декабр[еья])'
+)
+
+_DEPARTURE_RX = _AnyOf(_DEPARTURE_PATTERNS)
+_CHILDAGE_TEXT_BASE_RX = _AnyOf(_CHILDAGE_TEXT_PATTERNS_BASE)
+_CHILDAGE_TEXT_LC_RX = _AnyOf(_CHILDAGE_TEXT_PATTERNS_LC)
+_SPECIFIC_DATE_RX = _AnyOf(_SPECIFIC_DATE_PATTERNS)
+_MONTH_QUALIFIER_LOOSE_RX = _AnyOf(_MONTH_QUALIFIER_LOOSE_PATTERNS)
+_NIGHTS_RX = _AnyOf(_NIGHTS_PATTERNS)
+_TRAVELERS_RX = _AnyOf(_TRAVELERS_PATTERNS)
+_STARS_RX = _AnyOf(_STARS_PATTERNS)
+_MEAL_RX = _AnyOf(_MEAL_PATTERNS)
+_SKIP_QUALITY_RX = _AnyOf(_SKIP_QUALITY_PATTERNS)
+_HOTEL_BRAND_RX = _AnyOf(_HOTEL_BRAND_PATTERNS)
+
+# Сводки результатов функций хранятся в истории как role="user" —
+# str.startswith(tuple) отсекает их одним вызовом.
+_FUNC_RESULT_PREFIXES = ("Результаты вызванных функций", "Результаты запросов:")
+# Служебные role="user" сообщения (результаты, ошибки, подталкивания модели),
+# которые не считаются репликами клиента.
+_SERVICE_USER_PREFIXES = (
+    "Результаты", "СИСТЕМНАЯ ОШИБКА", "Пожалуйста, продолжи",
+    "Продолжи обработку", "Ответь клиенту",
+)
+
+# СПЕЦИФИЧНЫЕ фразы вопросов ассистента о QC (звёздность/питание) — короткие
+# подстроки вроде "звёзд" матчили бы "звёздами" из _hint в сводках функций.
+# Набор короткий: `in` по кортежу быстрее regex-альтернативы.
+_QC_PHRASES = (
+    "категорию отеля",              # "Уточните категорию отеля"
+    "тип питания",                  # "Какой тип питания?"
+    "питание предпочитаете",        # "Какое питание предпочитаете?"
+    "какой отель предпочитаете",    # "Какой отель предпочитаете?"
+    "какую звёздность",             # "Какую звёздность?"
+    "какую звездность",             # е-вариант
+    "сколько звёзд",                # "Сколько звёзд?"
+    "сколько звезд",                # е-вариант
+    "звёздность отел",              # "Звёздность отеля?"
+    "звездность отел",              # е-вариант
+)
+
+
+def _pos_int(val) -> int:
+    """val, если это положительный int (как его прислала модель), иначе 0 — без приведения строк."""
+    return val if isinstance(val, int) and val > 0 else 0
+
+
 def _check_cascade_slots(full_history: List[Dict], args: Dict, is_follow_up: bool = False,
                          lead_catcher: bool = False) -> Tuple[bool, List[str]]:
     """
@@ -921,22 +1220,29 @@ def _check_cascade_slots(full_history: List[Dict], args: Dict, is_follow_up: boo
     missing = []
     
     # ── Early pass: если args уже содержат ВСЕ критичные параметры — доверяем модели.
-    _dep = args.get("departure")
-    _df = args.get("datefrom", "")
-    _nf = args.get("nightsfrom")
-    _ad = args.get("adults")
-    _st = args.get("stars")
-    _ml = args.get("meal")
-
-    _args_have_all_slots = (
-        _dep and isinstance(_dep, int) and _dep > 0
-        and _df and re.match(r'\d{2}\.\d{2}\.\d{4}', str(_df))
-        and _nf and isinstance(_nf, int) and _nf >= 3
-        and _ad and isinstance(_ad, int) and _ad > 0
-        and ((_st and isinstance(_st, int) and _st > 0)
-             or (_ml and isinstance(_ml, int) and _ml > 0))
+    # (нужен и без is_follow_up — см. CASCADE-TRUST ниже)
+    _args_have_all_slots = bool(
+        _pos_int(args.get("departure"))
+        and _RE_DATE_DMY.match(str(args.get("datefrom") or ""))
+        and _pos_int(args.get("nightsfrom")) >= 3
+        and _pos_int(args.get("adults"))
+        and (_pos_int(args.get("stars")) or _pos_int(args.get("meal")))
     )
 
+    # Один проход по истории: дальше все выборки идут по сообщениям клиента
+    # (role="user" — это и реплики, и результаты функций, см. Fix C1 ниже)
+    # Заодно запоминаем индексы непустых реплик ассистента — по ним ниже идут
+    # обратный поиск get_dictionaries (бренд), окно последних 10 сообщений и
+    # поиск последнего QC-вопроса, без повторных обходов full_history.
+    user_contents = []
+    assistant_idx = []
+    for i, m in enumerate(full_history):
+        role = m.get("role")
+        if role == "user":
+            user_contents.append(m.get("content", ""))
+        elif role == "assistant" and m.get("content"):
+            assistant_idx.append(i)
+
     # Lead-catcher (#1): возраст ребёнка нельзя «протащить» подставленным childageN.
     # Если есть дети, но возраст НЕ назван клиентом в тексте — не доверяем ранним
     # trust-проходам ниже (иначе search_tours уйдёт с выдуманным возрастом, и P9
@@ -949,11 +1255,10 @@ def _check_cascade_slots(full_history: List[Dict], args: Dict, is_follow_up: boo
             _cc_early = 0
         if _cc_early > 0:
             _early_user_text = " ".join(
-                m.get("content", "") for m in full_history
-                if m.get("role") == "user" and m.get("content")
-                and not m.get("content", "").startswith("Результаты")
+                c for c in user_contents
+                if c and not c.startswith("Результаты")
             ).lower()
-            if not any(re.search(p, _early_user_text) for p in _CHILDAGE_TEXT_PATTERNS_LC):
+            if not _CHILDAGE_TEXT_LC_RX.search(_early_user_text):
                 _lc_child_age_block = True
 
     if _args_have_all_slots and is_follow_up and not _lc_child_age_block:
@@ -962,30 +1267,25 @@ def _check_cascade_slots(full_history: List[Dict], args: Dict, is_follow_up: boo
     # Trust model args when cascade has had enough dialogue turns (>=10 user+assistant msgs).
     # This prevents false blocks when user confirms parameters implicitly
     # (e.g. "да давай это число" confirming an example date).
-    _user_msg_count = sum(1 for m in full_history if m.get("role") == "user"
-                         and not m.get("content", "").startswith("Результаты")
-                         and not m.get("content", "").startswith("СИСТЕМНАЯ ОШИБКА")
-                         and not m.get("content", "").startswith("Пожалуйста, продолжи")
-                         and not m.get("content", "").startswith("Продолжи обработку")
-                         and not m.get("content", "").startswith("Ответь клиенту"))
-    if _args_have_all_slots and _user_msg_count >= 5 and not _lc_child_age_block:
-        logger.info("✅ CASCADE-TRUST: args have all slots + %d user messages — trusting model", _user_msg_count)
-        return (True, [])
+    if _args_have_all_slots and not _lc_child_age_block:
+        _user_msg_count = sum(1 for c in user_contents
+                              if not c.startswith(_SERVICE_USER_PREFIXES))
+        if _user_msg_count >= 5:
+            logger.info("✅ CASCADE-TRUST: args have all slots + %d user messages — trusting model", _user_msg_count)
+            return (True, [])
     
     # Собираем ВСЕ сообщения пользователя из истории (не только [-20:]),
     # чтобы оригинальный запрос не выпадал из окна после многих function-call циклов.
     # Fix C1: Исключаем результаты функций (хранятся как role="user"),
     # чтобы даты из get_current_date не обманывали валидатор дат каскада
     user_messages = [
-        msg.get("content", "") for msg in full_history
-        if msg.get("role") == "user" and msg.get("content")
-        and not msg.get("content", "").startswith("Результаты вызванных функций")
-        and not msg.get("content", "").startswith("Результаты запросов:")
+        c.lower() for c in user_contents
+        if c and not c.startswith(_FUNC_RESULT_PREFIXES)
     ]
-    user_text = " ".join(user_messages).lower()
+    user_text = " ".join(user_messages)
     
     # ─── Слот 2: Город вылета ───
-    has_departure_mention = any(re.search(p, user_text) for p in _DEPARTURE_PATTERNS)
+    has_departure_mention = _DEPARTURE_RX.search(user_text) is not None
     
     if not has_departure_mention:
         missing.append("город вылета")
@@ -995,33 +1295,11 @@ def _check_cascade_slots(full_history: List[Dict], args: Dict, is_follow_up: boo
     # Конкретные даты / части месяца / праздники = слот заполнен
     # Голый месяц (без начале/середине/конце) = нужно уточнить промежуток
     
-    _MONTH_NAMES_RX = r'(?:января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)'
-    
-    # Паттерны для КОНКРЕТНЫХ дат (слот полностью заполнен — НЕ спрашиваем)
-    specific_date_patterns = [
-        r'\d{1,2}\.\d{1,2}(?:\.\d{2,4})?',                           # 21.03 или 21.03.2026
-        r'\d{1,2}\s+' + _MONTH_NAMES_RX,                              # "15 марта" — конкретная дата
-        r'(?:в\s+)?(?:начал|середин|конц)\w*\s+' + _MONTH_NAMES_RX,   # "в начале марта" — часть месяца
-        r'(?:в\s+)?(?:начал|середин|конц)\w*\s+месяца',               # "в конце месяца"
-        r'(?:на\s+)?(?:майские|новогодние|новый год|8 марта|23 февраля|каникул)',  # праздники
-        r'(?:завтра|послезавтра|через\s+\w+\s+дн|через\s+неделю|через\s+месяц)',  # относительные
-        r'(?:в\s+)?(?:этом|следующем)\s+месяце',
-        r'(?:в\s+)?ближайшее\s+время',
-        r'(?:первой|второй)\s+половин[еы]',                           # "в первой половине"
-        r'ближе\s+к\s+(?:начал|конц|середин)',                        # "ближе к концу"
-        r'(?:под|к)\s+конец',                                          # "под конец мая"
-        r'(?:ближайш\w+\s+(?:вылет|дат|рейс))',                       # "ближайший вылет"
-        r'(?:всё?\s*равно\s*(?:когда|какая?\s+дат))',                  # "все равно когда"
-        r'(?:какой\s+есть|какая\s+есть|что\s+есть)',                   # "какой есть"
-        r'(?:любой\s+(?:период|ближайший|вылет|дат))',                 # "любой период"
-        r'(?:не\s*важно\s+когда|неважно\s+когда)',                     # "неважно когда"
-        r'(?:весь|целый)\s+\w*' + _MONTH_NAMES_RX.replace('|', r'\w*|').replace(r'(?:', '(?:'),  # "весь октябрь"
-    ]
-    has_specific_date = any(re.search(p, user_text) for p in specific_date_patterns)
+    # КОНКРЕТНЫЕ даты (слот полностью заполнен — НЕ спрашиваем)
+    has_specific_date = _SPECIFIC_DATE_RX.search(user_text) is not None
     
-    # Паттерн для голого упоминания месяца ("в марте", "март", "апреле")
-    bare_month_rx = r'(?:январ[еья]|феврал[еья]|март[еа]?|апрел[еья]|ма[еяй]|июн[еья]|июл[еья]|август[еа]?|сентябр[еья]|октябр[еья]|ноябр[еья]|декабр[еья])'
-    has_bare_month = re.search(bare_month_rx, user_text) is not None
+    # Голое упоминание месяца ("в марте", "март", "апреле")
+    has_bare_month = _BARE_MONTH_RX.search(user_text) is not None
     
     has_date_mention = has_specific_date or has_bare_month
     
@@ -1029,27 +1307,12 @@ def _check_cascade_slots(full_history: List[Dict], args: Dict, is_follow_up: boo
     if has_bare_month and not has_specific_date:
         # Проверяем: может клиент в другом сообщении ответил "в начале"/"в середине"/"в конце"
         # (например, первое сообщение "в марте", второе "в начале")
-        month_qualifier_loose = [
-            r'\b(?:начал[еоу]|начало)\b',          # "в начале", "начале", "начало"
-            r'\b(?:середин[еуы]|середина)\b',       # "в середине"
-            r'\b(?:конц[еуы]|конец)\b',             # "в конце", "конце"
-            r'(?:перв\w+|втор\w+)\s+половин',       # "первой половине", "второй половине"
-            r'(?:последн\w+|первая|первую|первой)\s+(?:недел\w+)',  # "последняя неделя", "первая неделя"
-            r'\bс\s+\d{1,2}\b.*?\bпо\s+\d{1,2}\b',                 # "с 24 по 7" — числовой диапазон
-        ]
-        has_qualifier_loose = any(re.search(p, user_text) for p in month_qualifier_loose)
+        has_qualifier_loose = _MONTH_QUALIFIER_LOOSE_RX.search(user_text) is not None
         if not has_qualifier_loose:
             missing.append("промежуток в месяце (начало/середина/конец)")
     
     # ─── Слот 3: Длительность (ночи/дни) ───
-    nights_patterns = [
-        r'\d+\s*(?:ноч|дн|день|дней|ночей)',
-        r'(?:на\s+)?(?:неделю|недельку|две недели|2 недели)',
-        r'\bнедел[яюи]\b',  # "неделя", "неделю", "недели" без "на"
-        r'(?:на\s+)?(?:выходные|уикенд)',
-        r'(?:с\s+)?\d{1,2}(?:\.\d{1,2})?(?:\s+)?(?:по|-)(?:\s+)?\d{1,2}',  # с 10 по 17, 10-17
-    ]
-    has_nights_mention = any(re.search(p, user_text) for p in nights_patterns)
+    has_nights_mention = _NIGHTS_RX.search(user_text) is not None
     
     # Если нет ни дат, ни длительности — слот 3 пропущен
     if not has_date_mention and not has_nights_mention:
@@ -1060,20 +1323,7 @@ def _check_cascade_slots(full_history: List[Dict], args: Dict, is_follow_up: boo
     # (например, "с 10 по 17 марта" уже содержит длительность)
     
     # ─── Слот 4: Состав путешественников ───
-    travelers_patterns = [
-        r'(?:взрослы[хй]|взр\.?|вз\.?|adults)',
-        r'(?:дет(?:ей|и|ьми|ям)?|ребен(?:ок|ка)|child)',
-        r'(?:я\s+)?(?:один|одна|сам|одиночк)',
-        r'(?:двое|два|две)\s+(?:взрослы[хй]|человек|чел\.?)',
-        r'(?:трое|три|четыре|пять|шесть)\s+(?:взрослы[хй]|человек|чел\.?)',
-        r'\d+\s*(?:взрослы[хй]|человек|чел\.?|взр|вз)',
-        r'\d+\s*(?:в|вз)\s*\+',
-        r'(?:с\s+)?(?:мужем|женой|парнем|девушкой|подругой|другом)',
-        r'(?:вдво[её]м|втро[её]м|вчетвером|впятером)',
-        r'\d+[-–]\d+\(\d+',  # "2-1(4)" = 2 взрослых, 1 ребёнок (4 года)
-        r'(?:мы\s+с\s+)',
-    ]
-    has_travelers_mention = any(re.search(p, user_text) for p in travelers_patterns)
+    has_travelers_mention = _TRAVELERS_RX.search(user_text) is not None
     
     if not has_travelers_mention:
         missing.append("состав путешественников")
@@ -1090,11 +1340,9 @@ def _check_cascade_slots(full_history: List[Dict], args: Dict, is_follow_up: boo
         # паттерны). На остальных тенантах поведение ПРЕЖНЕЕ: args ИЛИ текст по
         # базовым паттернам.
         if lead_catcher:
-            age_known = any(re.search(p, user_text) for p in _CHILDAGE_TEXT_PATTERNS_LC)
+            age_known = _CHILDAGE_TEXT_LC_RX.search(user_text) is not None
         else:
-            age_known = has_age_in_args or any(
-                re.search(p, user_text) for p in _CHILDAGE_TEXT_PATTERNS_BASE
-            )
+            age_known = has_age_in_args or _CHILDAGE_TEXT_BASE_RX.search(user_text) is not None
         if not age_known:
             missing.append("возраст ребёнка")
     
@@ -1102,48 +1350,10 @@ def _check_cascade_slots(full_history: List[Dict], args: Dict, is_follow_up: boo
     # Проверяем: клиент ЯВНО указал stars/meal ИЛИ явно "скипнул" (любой/не важно/и т.д.)
     # Также skip если клиент назвал конкретный отель/бренд (stars берётся из базы)
     
-    stars_patterns = [
-        r'\d[\s\-\+]*(?:зв[её]зд|\*|⭐)',                      # "5 звёзд", "4*", "5⭐", "3+ звёзд", "5-звёздочный"
-        r'(?:пяти|четыр[её]х|тр[её]х)зв[её]зд',               # "пятизвёздочный", "четырёхзвёздочный"
-        r'\b(?:пять|четыре|три|два)\s+зв[её]зд',             # "пять звезд", "четыре звезды"
-        r'\b(?:пят[её]рк|четв[её]рк|тройк)',                    # разг. "пятёрка"/"пятерка", "четвёрка"/"четверка"
-    ]
-    meal_patterns = [
-        r'вс[её]\s*включен',                                  # "все включено" (е) И "всё включено" (ё)
-        r'ультра\s*вс[её]\s*включ',                           # "ультра все включено"
-        r'all\s*incl',                                         # "all inclusive"
-        r'ол+\s*инклюзив',                                    # "олл инклюзив", "ол инклюзив"
-        r'\b(?:аи|уаи)\b',                                    # "АИ", "УАИ" (word boundary — не матчит "Каир")
-        r'\b(?:ai|uai)\b',                                    # Latin AI, UAI
-        r'(?:полупансион|half\s*board|\bhb\b)',                # полупансион
-        r'(?:полный\s*пансион|full\s*board|\bfb\b)',           # полный пансион
-        r'(?:только\s*)?завтрак\w*',                            # "завтрак", "завтраки", "завтраками", "только завтрак"
-        r'\b(?:bb|ro|ob)\b',                                   # bed&breakfast, room only, only bed
-        r'(?:без\s*питани)',                                   # "без питания"
-    ]
-    skip_quality_patterns = [
-        # Контекстные паттерны: "любой" только в связке со звёздностью/отелем/питанием
-        r'(?:любой|любую|любое|любые)\s+(?:отель|категори|звёзд|звезд|питани)',
-        r'(?:любой|любая|любое)\b',  # одиночный ответ "любой" на вопрос QC (последнее сообщение)
-        r'(?:без\s*разницы|(?:всё|все)\s*равно(?!\s*когда))',
-        r'(?:не\s*важно|неважно|не\s*принципиально)',
-        r'(?:на\s+(?:ваше?|твоё?|твое?)\s+усмотрени)',
-        r'(?:рассмотрим\s+вариант|покажите?\s+что\s+есть|какие\s+есть)',
-        r'(?:покажите?\s+что-нибудь|что\s+посоветуете)',
-    ]
-    # Бренды/конкретные отели — тоже skip quality check
-    hotel_brand_patterns = [
-        r'\b(?:rixos|hilton|delphin|swissotel|kempinski|calista|titanic|gloria|regnum|maxx\s*royal)\b',
-        r'\b(?:iberostar|marriott|sheraton|radisson|accor|hyatt|intercontinental)\b',
-        # "отель [Название с заглавной]" — но НЕ "отель красивый"
-        # Этот паттерн ловит только конкретные упоминания с "хочу в отель ..."
-        r'(?:в\s+)?отел[ьеи]\s+[а-яА-Яa-zA-Z]{3,}',
-    ]
-    
     # stars/meal/brand ищем по ВСЕМ сообщениям (user_text)
-    has_stars = any(re.search(p, user_text) for p in stars_patterns)
-    has_meal = any(re.search(p, user_text) for p in meal_patterns)
-    has_brand = any(re.search(p, user_text) for p in hotel_brand_patterns)
+    has_stars = _STARS_RX.search(user_text) is not None
+    has_meal = _MEAL_RX.search(user_text) is not None
+    has_brand = _HOTEL_BRAND_RX.search(user_text) is not None
 
     # Fix A (BUG-1): засчитываем звёздность/питание из АРГУМЕНТОВ вызова, если модель
     # уже их извлекла из реплик клиента ("4 и выше" → stars:4), даже когда текстовая
@@ -1152,12 +1362,12 @@ def _check_cascade_slots(full_history: List[Dict], args: Dict, is_follow_up: boo
     # Без этого короткий тур (nights<3, escape-hatch выключен) + терсный ввод → петля
     # повторных search_tours (см. аудит 2026-06: ОАЭ/Стамбул/короткие выезды).
     try:
-        if int(_st) > 0:
+        if int(args.get("stars")) > 0:
             has_stars = True
     except (TypeError, ValueError):
         pass
     try:
-        if int(_ml) > 0:
+        if int(args.get("meal")) > 0:
             has_meal = True
     except (TypeError, ValueError):
         pass
@@ -1167,11 +1377,10 @@ def _check_cascade_slots(full_history: List[Dict], args: Dict, is_follow_up: boo
     # Если отель НЕ найден в каталоге TourVisor — QC НЕ должен быть автоматически пройден,
     # т.к. мы больше не ищем конкретный отель и нужно уточнить звёздность/питание.
     if has_brand:
-        for i in range(len(full_history) - 1, -1, -1):
-            msg = full_history[i]
-            content = msg.get("content") or ""
+        for i in reversed(assistant_idx):
+            content = full_history[i]["content"]
             # Ищем сообщение ассистента с вызовом get_dictionaries для отелей
-            if msg.get("role") == "assistant" and "get_dictionaries" in content and ("hotel" in content or "name" in content):
+            if "get_dictionaries" in content and ("hotel" in content or "name" in content):
                 # Проверяем следующее сообщение (результат функции)
                 if i + 1 < len(full_history):
                     result_msg = full_history[i + 1]
@@ -1184,8 +1393,8 @@ def _check_cascade_slots(full_history: List[Dict], args: Dict, is_follow_up: boo
     
     # skip_quality ищем ТОЛЬКО по последнему сообщению пользователя
     # (чтобы "любой курорт" из раннего сообщения не пометил QC как пройденный)
-    last_user_msg = user_messages[-1].lower() if user_messages else ""
-    has_skip = any(re.search(p, last_user_msg) for p in skip_quality_patterns)
+    last_user_msg = user_messages[-1] if user_messages else ""
+    has_skip = _SKIP_QUALITY_RX.search(last_user_msg) is not None
     
     # Quality Check пройден если:
     # - клиент указал И звёздность И тип питания
@@ -1203,51 +1412,56 @@ def _check_cascade_slots(full_history: List[Dict], args: Dict, is_follow_up: boo
         # Ищем в истории ассистента вопрос про звёздность/питание
         # ВАЖНО: фильтруем function-result summaries — они содержат _hint текст
         # с "звёздами", "питанием" и т.д., вызывая ложное срабатывание
-        assistant_messages = [
-            msg.get("content", "") for msg in full_history[-10:] 
-            if msg.get("role") == "assistant" and msg.get("content")
-            and not msg.get("content", "").startswith("Результаты запросов:")
-        ]
-        assistant_text = " ".join(assistant_messages).lower()
-        # Используем СПЕЦИФИЧНЫЕ фразы, уникальные для вопросов ассистента о QC,
-        # а не короткие подстроки вроде "звёзд" которые матчат "звёздами" из _hint
-        qc_asked = any(phrase in assistant_text for phrase in [
-            "категорию отеля",              # "Уточните категорию отеля"
-            "тип питания",                  # "Какой тип питания?"
-            "питание предпочитаете",        # "Какое питание предпочитаете?"
-            "какой отель предпочитаете",    # "Какой отель предпочитаете?"
-            "какую звёздность",             # "Какую звёздность?"
-            "какую звездность",             # е-вариант
-            "сколько звёзд",               # "Сколько звёзд?"
-            "сколько звезд",               # е-вариант
-            "звёздность отел",             # "Звёздность отеля?"
-            "звездность отел",             # е-вариант
-        ])
+        # Каждая реплика окна приводится к нижнему регистру один раз: те же
+        # строки ниже переиспользует поиск последнего QC-вопроса (_window_lc).
+        _window_start = len(full_history) - 10
+        _window_lc = {}
+        assistant_messages = []
+        for i in reversed(assistant_idx):
+            if i < _window_start:
+                break
+            content = full_history[i]["content"]
+            _window_lc[i] = content_lc = content.lower()
+            if not content.startswith("Результаты запросов:"):
+                assistant_messages.append(content_lc)
+        assistant_messages.reverse()
+        assistant_text = " ".join(assistant_messages)
+        # Только СПЕЦИФИЧНЫЕ фразы вопросов о QC — см. _QC_PHRASES
+        qc_asked = any(phrase in assistant_text for phrase in _QC_PHRASES)
         # Если ассистент спрашивал QC — проверяем, что клиент ОТВЕТИЛ после вопроса.
         # Модель может задать QC-вопрос в тексте одновременно с tool call и сразу
         # запустить search_tours, не дождавшись ответа. В таком случае qc_asked=True,
         # но пользователь ещё не ответил — блокируем.
         if qc_asked:
-            _qc_phrases = [
-                "категорию отеля", "тип питания", "питание предпочитаете",
-                "какой отель предпочитаете", "какую звёздность", "какую звездность",
-                "сколько звёзд", "сколько звезд", "звёздность отел", "звездность отел",
-            ]
+            # Индекс последнего QC-вопроса выводится здесь, а не хранится на
+            # хендлере: full_history правят в обход _append_history (вставки,
+            # обрезки, чистка, восстановление сессии), и такой счётчик разъехался
+            # бы с историей. qc_asked=True значит, что фраза есть в окне, —
+            # _window_lc (от новых к старым) почти всегда отвечает сразу; старые
+            # реплики смотрим, только если фраза собралась на стыке двух реплик.
             _last_qc_idx = -1
-            for _qi in range(len(full_history) - 1, -1, -1):
-                _qmsg = full_history[_qi]
-                if _qmsg.get("role") == "assistant" and _qmsg.get("content"):
-                    _qcontent = _qmsg.get("content", "").lower()
-                    if any(_qp in _qcontent for _qp in _qc_phrases):
+            for _qi, _qcontent in _window_lc.items():
+                if any(_qp in _qcontent for _qp in _QC_PHRASES):
+                    _last_qc_idx = _qi
+                    break
+            else:
+                for _qi in reversed(assistant_idx):
+                    if _qi >= _window_start:
+                        continue
+                    if any(_qp in full_history[_qi]["content"].lower() for _qp in _QC_PHRASES):
                         _last_qc_idx = _qi
                         break
-            _user_after_qc = any(
-                full_history[_uj].get("role") == "user"
-                and full_history[_uj].get("content")
-                and not full_history[_uj].get("content", "").startswith("Результаты")
-                and not full_history[_uj].get("content", "").startswith("СИСТЕМНАЯ")
-                for _uj in range(_last_qc_idx + 1, len(full_history))
-            ) if _last_qc_idx >= 0 else False
+            # Ответ клиента после вопроса: реплика user, не результат функций
+            # и не системная вставка
+            _user_after_qc = False
+            if _last_qc_idx >= 0:
+                for _um in full_history[_last_qc_idx + 1:]:
+                    if _um.get("role") != "user":
+                        continue
+                    _uc = _um.get("content")
+                    if _uc and not _uc.startswith(("Результаты", "СИСТЕМНАЯ")):
+                        _user_after_qc = True
+                        break
             if not _user_after_qc:
                 qc_asked = False
         if not qc_asked:
@@ -1273,6 +1487,8 @@ def _safe_int(val, default: int = 0) -> int:
     TourVisor API возвращает числа как строки, float или int в разных контекстах.
     Обрабатывает: "45000", 45000, "45000.50", 45000.5, None, "", "N/A"
     """
+    if type(val) is int:    # уже int (не bool) — без круга через float
+        return val
     if val is None or val == "":
         return default
     try:
@@ -1315,7 +1531,11 @@ _DEPARTURE_CITIES = {
 # ─── Валидация departure: паттерн в контексте "из [город]" → правильный departure ID ───
 # Используется для коррекции, если модель передала неверный ID города вылета
 # Паттерны привязаны к контексту вылета ("из ...", "вылетаем из ...", "летим из ...")
-_DEPARTURE_VALIDATION = [
+# Компилируются один раз при импорте; текст на входе уже в нижнем регистре.
+# Порядок списка — приоритет (первый совпавший паттерн, а не самый левый матч),
+# поэтому в одну альтернативу с именованными группами не склеиваем: к тому же
+# на `re` такая альтернатива в 6–8 раз медленнее цикла по отдельным паттернам.
+_DEPARTURE_VALIDATION = [(re.compile(p), dep_id) for p, dep_id in [
     (r'(?:из|с)\s+москв\w*', 1),
     (r'москв\w*\s*[-—,]?\s*(?:вылет|аэропорт)', 1),
     (r'(?:из|с)\s+(?:санкт[\s-]*)?петербург\w*', 5),
@@ -1398,11 +1618,11 @@ _DEPARTURE_VALIDATION = [
     (r'(?:из|с)\s+элист\w*', 131),
     # «Без перелёта» — всегда последним, чтобы не перебивать города
     (r'без\s*перел[её]т\w*|(?:на\s+)?поезд\w*|автобус\w*|ж[\./]?д\w*', 99),
-]
+]]
 
 # Паттерны для верификации смены города вылета (без обязательного "из/с").
 # Используются ТОЛЬКО когда модель явно сменила departure по сравнению с кэшем.
-_DEPARTURE_VERIFY = {
+_DEPARTURE_VERIFY = {dep_id: re.compile(p) for dep_id, p in {
     1: r'москв', 2: r'перм[иья]', 3: r'екатеринбург|еката|екб',
     4: r'уф[аыуе]', 5: r'петербург|питер|спб',
     6: r'челябинск', 7: r'самар', 8: r'нижн.*новгород|ннов',
@@ -1426,11 +1646,184 @@ _DEPARTURE_VERIFY = {
     101: r'саранск', 102: r'черепов', 103: r'иванов', 104: r'киров',
     115: r'липецк', 116: r'геленджик', 117: r'петрозаводск', 118: r'псков',
     119: r'курган', 123: r'ноябрьск', 124: r'горно[\s-]*алтайск', 131: r'элист',
-}
+}.items()}
+
+
+# ─── Safety-net аргументов search_tours ───
+# Компилируются один раз при импорте. Текст клиента на входе уже в нижнем
+# регистре, поэтому IGNORECASE не нужен.
+# Галлюцинация: вызов функции внутри datefrom/dateto
+_HALLUCINATED_FUNC_RE = re.compile(r'get_\w+\(|search_\w+\(|"get_|function')
+# Дата без года: DD.MM
+_DATE_NOYEAR_RE = re.compile(r'\d{1,2}\.\d{1,2}')
+# "в начале/середине/конце + месяц"
+_MONTH_PART_RE = re.compile(
+    r'(?:в\s+)?(?P<part>начал\w*|середин\w*|конц\w*|перв\w+\s+половин\w*|втор\w+\s+половин\w*)'
+    r'\s+(?P<month>январ\w*|феврал\w*|март\w*|апрел\w*|ма[еяй]\w*|июн\w*|июл\w*|август\w*|сентябр\w*|октябр\w*|ноябр\w*|декабр\w*)'
+)
+# Явный диапазон дней ("с 5 по 15 июня") — отменяет коррекцию по части месяца
+_EXPLICIT_DAY_RANGE_RE = re.compile(
+    r'(?:с\s+)?\d{1,2}\s*(?:по|-)\s*\d{1,2}\s*'
+    r'(?:числ|январ|феврал|март|апрел|ма[еяй]|июн|июл|август|сентябр|октябр|ноябр|декабр)'
+)
+# Префикс месяца → (номер, последний день); порядок важен: 'ма' после 'март'
+_MONTH_PREFIX_DAYS = (
+    ('январ', (1, 31)), ('феврал', (2, 28)), ('март', (3, 31)), ('апрел', (4, 30)),
+    ('ма', (5, 31)), ('июн', (6, 30)), ('июл', (7, 31)), ('август', (8, 31)),
+    ('сентябр', (9, 30)), ('октябр', (10, 31)), ('ноябр', (11, 30)), ('декабр', (12, 31)),
+)
+# Клиент сузил звёздность ("только 5", "не выше")
+_STARS_EXACT_ONLY_RE = re.compile(r'(?:только\s+\d|именно\s+\d|строго\s+\d|не\s+выше|не\s+больше)')
+# Голое "N-M" в datefrom — это ночи, а не даты
+_BARE_NIGHTS_RANGE_RE = re.compile(r'^\d{1,2}[-–]\d{1,2}$')
+# Диапазонные слова: dateto==datefrom расширяем
+_DATE_RANGE_WORDS_RE = re.compile(
+    r'(?:январ\w*[\s\-–]+феврал|феврал\w*[\s\-–]+март|'
+    r'март\w*[\s\-–]+апрел|апрел\w*[\s\-–]+ма[йя]|'
+    r'ма[йя]\w*[\s\-–]+июн|июн\w*[\s\-–]+июл|'
+    r'июл\w*[\s\-–]+август|август\w*[\s\-–]+сентябр|'
+    r'сентябр\w*[\s\-–]+октябр|октябр\w*[\s\-–]+ноябр|'
+    r'ноябр\w*[\s\-–]+декабр|'
+    r'ближайш|любую?\s+дат|всё?\s*равно.*когда|'
+    r'диапазон|с\s+\d{1,2}\s*(?:по|-)\s*\d{1,2})'
+)
+# «Ближайший вылет» → прогрессивный dateto
+_NEAREST_DATE_RE = re.compile(
+    r'(?:ближайш|всё?\s*равно.*когда|неважно\s*когда|какой\s+есть|любую?\s+дат)'
+)
+# «с X по Y [месяц]» / «X-Y месяц» → число ночей
+_DAY_RANGE_NIGHTS_RE = re.compile(
+    r'(?:с\s+)?(\d{1,2})\s*(?:по|до|-|–)\s*(\d{1,2})\s*'
+    r'(?:январ|феврал|март|апрел|ма[йя]|июн|июл|август|сентябр|октябр|ноябр|декабр)'
+)
+
+# ─── Курорты по странам (авто-разрешение regions в search_tours) ───
+# Формат: (паттерн, страна_отображение, region_id | None, country_code, parent_region | None)
+#   region_id — если ID региона ИЗВЕСТЕН (популярные регионы)
+#   parent_region — если город является подрайоном известного региона (нужен API lookup)
+# Паттерны компилируются один раз при импорте (текст клиента уже в нижнем регистре).
+_RESORT_PATTERNS = [(re.compile(p), *meta) for p, *meta in [
+    # ═══ Россия (country=47) — ALL TourVisor regions ═══
+    # КМВ (424) — города региона
+    (r'\b(?:кисловодск\w*|пятигорск\w*|ессентуки\w*|железноводск\w*|минеральн\w*\s*вод\w*|кмв)\b', "России", "424", 47, None),
+    # Сочи (426) + Адлер
+    (r'\b(?:сочи)\b', "России", "426", 47, None),
+    (r'\b(?:адлер\w*)\b', "России", "426", 47, None),
+    # Красная Поляна (495)
+    (r'\b(?:красн\w*\s*полян\w*)\b', "России", "495", 47, None),
+    # Черноморское побережье
+    (r'\b(?:анап[аыуе]\w*)\b', "России", "427", 47, None),
+    (r'\b(?:геленджик\w*|новоросс\w*)\b', "России", "428", 47, None),
+    (r'\b(?:туапсе\w*)\b', "России", "429", 47, None),
+    (r'\b(?:азовск\w*)\b', "России", "564", 47, None),
+    # Крым (423)
+    (r'\b(?:крым\w*)\b', "России", "423", 47, None),
+    (r'\b(?:ялт[аыуе]\w*|алушт[аыуе]\w*|севастопол\w*|феодоси\w*|судак\w*|евпатори\w*)\b', "России", "423", 47, None),
+    # Калининград (425)
+    (r'\b(?:калининград\w*)\b', "России", "425", 47, None),
+    (r'\b(?:светлогорск\w*|зеленоградск\w*)\b', "России", "425", 47, None),
+    # Горнолыжные курорты
+    (r'\b(?:домбай\w*)\b', "России", "523", 47, None),
+    (r'\b(?:приэльбрусь\w*|эльбрус\w*)\b', "России", "524", 47, None),
+    (r'\b(?:архыз\w*)\b', "России", "525", 47, None),
+    (r'\b(?:шерегеш\w*)\b', "России", "498", 47, None),
+    (r'\b(?:абзаков\w*|банно\w*)\b', "России", "518", 47, None),
+    # Города-направления (одновременно departure и destination)
+    (r'\b(?:казан[ьи]\w*)\b', "России", "517", 47, None),
+    (r'\b(?:подмосковь\w*)\b', "России", "469", 47, None),
+    (r'\b(?:золот\w*\s*кольц\w*)\b', "России", "527", 47, None),
+    (r'\b(?:велик\w*\s*устюг\w*)\b', "России", "471", 47, None),
+    # Кавказ
+    (r'\b(?:дагестан\w*|махачкал\w*|дербент\w*)\b', "России", "662", 47, None),
+    (r'\b(?:адыге[яи]\w*)\b', "России", "697", 47, None),
+    (r'\b(?:ингушети\w*)\b', "России", "689", 47, None),
+    (r'\b(?:кабардин\w*|нальчик\w*)\b', "России", "692", 47, None),
+    (r'\b(?:осети\w*|владикавказ\w*)\b', "России", "680", 47, None),
+    (r'\b(?:чечн\w*|грозн\w*)\b', "России", "679", 47, None),
+    # Природные регионы
+    (r'\b(?:карели\w*|петрозаводск\w*)\b', "России", "526", 47, None),
+    (r'\b(?:байкал\w*)\b', "России", "565", 47, None),
+    (r'\b(?:алтай\w*)\b', "России", "496", 47, None),
+    (r'\b(?:урал\w*)\b', "России", "563", 47, None),
+    (r'\b(?:мурманск\w*)\b', "России", "668", 47, None),
+    # Экскурсионные
+    (r'\b(?:псков\w*)\b', "России", "617", 47, None),
+    (r'\b(?:воронеж\w*)\b', "России", "661", 47, None),
+    (r'\b(?:татарстан\w*)\b', "России", "618", 47, None),
+    # ═══ Турция (country=4) — hardcoded IDs ═══
+    (r'\b(?:алан[ьи]я|аланья)\b', "Турции", "19", 4, None),
+    (r'\b(?:анталь?я|анталия)\b', "Турции", "20", 4, None),
+    (r'\b(?:белек)\b', "Турции", "21", 4, None),
+    (r'\b(?:кемер)\b', "Турции", "22", 4, None),
+    (r'\b(?:сиде)\b', "Турции", "23", 4, None),
+    (r'\b(?:бодрум)\b', "Турции", "24", 4, None),
+    (r'\b(?:даламан)\b', "Турции", "25", 4, None),
+    (r'\b(?:мармарис)\b', "Турции", "26", 4, None),
+    (r'\b(?:фетхие|фетие)\b', "Турции", "27", 4, None),
+    (r'\b(?:кушадас\w*)\b', "Турции", "154", 4, None),
+    (r'\b(?:стамбул)\b', "Турции", "277", 4, None),
+    (r'\b(?:дидим)\b', "Турции", "155", 4, None),
+    # ═══ Египет (country=1) — hardcoded IDs из системного промпта ═══
+    (r'\b(?:шарм[\s-]*(?:эль[\s-]*)?шейх|шарм)\b', "Египта", "6", 1, None),
+    (r'\b(?:хургад[аыуе]\w*)\b', "Египта", "5", 1, None),
+    (r'\b(?:марса[\s-]*алам)\b', "Египта", "11", 1, None),
+    (r'\b(?:дахаб)\b', "Египта", None, 1, None),
+    # ═══ ОАЭ (country=9) — hardcoded IDs ═══
+    (r'\b(?:дубай|дубаи)\b', "ОАЭ", "45", 9, None),
+    (r'\b(?:абу[\s-]*даби)\b', "ОАЭ", "43", 9, None),
+    (r'\b(?:шардж[аеу]\w*)\b', "ОАЭ", "48", 9, None),
+    (r'\b(?:рас[\s-]*аль[\s-]*хайм\w*)\b', "ОАЭ", "46", 9, None),
+    # ═══ Таиланд (country=2) — hardcoded IDs ═══
+    (r'\b(?:пхукет|пукет)\b', "Таиланда", "8", 2, None),
+    (r'\b(?:паттай[яеу]\w*|паттая)\b', "Таиланда", "7", 2, None),
+    (r'\b(?:самуи)\b', "Таиланда", "9", 2, None),
+    (r'\b(?:краби)\b', "Таиланда", "60", 2, None),
+    (r'\b(?:хуа[\s-]*хин)\b', "Таиланда", None, 2, None),
+    # ═══ Вьетнам (country=16) ═══
+    (r'\b(?:фукуок|фу[\s-]*куок)\b', "Вьетнама", None, 16, None),
+    (r'\b(?:нячанг|ня[\s-]*чанг)\b', "Вьетнама", None, 16, None),
+    (r'\b(?:фантьет|фан[\s-]*тьет|муйне|муй[\s-]*не)\b', "Вьетнама", None, 16, None),
+    # ═══ Шри-Ланка (country=12) ═══
+    (r'\b(?:коломбо|бентот[аы]|хиккадув[аы]|унаватун[аы])\b', "Шри-Ланки", None, 12, None),
+    # ═══ Мальдивы (country=8) ═══
+    (r'\b(?:мале|маафуш\w*)\b', "Мальдив", None, 8, None),
+    # ═══ Куба (country=10) ═══
+    (r'\b(?:варадеро|гаван[аы])\b', "Кубы", None, 10, None),
+    # ═══ Доминикана (country=11) ═══
+    (r'\b(?:пунта[\s-]*кан[аы]|бока[\s-]*чик[аы])\b', "Доминиканы", None, 11, None),
+    # ═══ Испания (country=14) — острова ═══
+    (r'\b(?:тенериф\w*|канар\w*)\b', "Испании", "101", 14, None),
+    (r'\b(?:майорк\w*|мальорк\w*)\b', "Испании", None, 14, None),
+    # ═══ Греция (country=6) ═══
+    (r'\b(?:крит\w*)\b', "Греции", None, 6, None),
+    (r'\b(?:родос\w*)\b', "Греции", None, 6, None),
+    # ═══ Кипр (country=15) ═══
+    (r'\b(?:пафос\w*|лимассол\w*|ларнак\w*|айя[\s-]*нап\w*|протарас\w*)\b', "Кипра", None, 15, None),
+]]
+
+
+def _find_mentioned_resort(text: str) -> Optional[Tuple[str, str, Optional[str], int, Optional[str]]]:
+    """
+    Первый курорт из _RESORT_PATTERNS, упомянутый в text (нижний регистр) НЕ
+    в контексте вылета: (название, страна, region_id, country_code, parent_region).
+
+    Приоритет — порядок списка, а не самый левый матч в тексте, и вхождение
+    «из Сочи» пропускается в пользу следующего. Поэтому паттерны не склеены
+    в одну альтернативу с именованными группами: она вернула бы самый левый
+    курорт, а на `re` к тому же медленнее цикла (~2.4× на типичной реплике).
+    """
+    for pattern, country_name, region_id, country_code, parent_region in _RESORT_PATTERNS:
+        for m in pattern.finditer(text):
+            if _is_departure_context(text, m.start()):
+                continue
+            return (m.group(), country_name, region_id, country_code, parent_region)
+    return None
 
 
 def _safe_float(val, default=None):
     """Безопасное преобразование в float (для hotelrating и т.п.)."""
+    if type(val) is float:
+        return val
     if val is None or val == "":
         return default
     try:
@@ -1449,14 +1842,35 @@ def _parse_tv_date(date_str: str):
     return None
 
 
+def _fast_parse_dmy(date_str) -> Optional[_date]:
+    """
+    TourVisor 'DD.MM.YYYY' → date без strptime (его разбор формата заметно
+    медленнее split). Принимает то же, что strptime(..., "%d.%m.%Y"); иначе None.
+    """
+    if not isinstance(date_str, str):
+        return None
+    parts = date_str.split(".")
+    if (
+        len(parts) != 3
+        or not (0 < len(parts[0]) <= 2 and 0 < len(parts[1]) <= 2 and len(parts[2]) == 4)
+        or not (parts[0].isdigit() and parts[1].isdigit() and parts[2].isdigit())
+    ):
+        return None
+    try:
+        return _date(int(parts[2]), int(parts[1]), int(parts[0]))
+    except ValueError:
+        return None
+
+
 def _calc_end_date(date_str: str, nights):
     """Рассчитать дату окончания: TourVisor 'DD.MM.YYYY' + nights → ISO 'YYYY-MM-DD'."""
     if not date_str or not nights:
         return None
+    d = _fast_parse_dmy(date_str)
+    if d is None:
+        return None
     try:
-        d = _dt.strptime(date_str, "%d.%m.%Y")
-        d_end = d + _td(days=int(nights))
-        return d_end.strftime("%Y-%m-%d")
+        return (d + _td(days=int(nights))).isoformat()
     except (ValueError, TypeError):
         return None
 
@@ -1501,24 +1915,23 @@ def _pick_best_tour(tours: list, ideal_datefrom: str = None,
     if not ideal_datefrom and nightsfrom is None and nightsto is None and requested_meal is None:
         return tours[0]
 
-    ideal_dt = None
-    if ideal_datefrom:
-        try:
-            ideal_dt = _dt.strptime(ideal_datefrom, "%d.%m.%Y")
-        except (ValueError, TypeError):
-            pass
+    ideal_dt = _fast_parse_dmy(ideal_datefrom) if ideal_datefrom else None
 
     _meal_kw = _MEAL_ID_TO_KEYWORDS.get(requested_meal, [])
 
+    # У туров одного отеля даты вылета повторяются (разные ночи/операторы) —
+    # каждую flydate разбираем один раз
+    date_diffs = {}
     scored = []
     for t in tours:
         date_diff = 0
         if ideal_dt:
-            try:
-                fly_dt = _dt.strptime(t.get("flydate", ""), "%d.%m.%Y")
-                date_diff = abs((fly_dt - ideal_dt).days)
-            except (ValueError, TypeError):
-                date_diff = 99
+            flydate = t.get("flydate", "")
+            date_diff = date_diffs.get(flydate)
+            if date_diff is None:
+                fly_dt = _fast_parse_dmy(flydate)
+                date_diff = abs((fly_dt - ideal_dt).days) if fly_dt else 99
+                date_diffs[flydate] = date_diff
 
         nights = _safe_int(t.get("nights"), 0)
         if nightsfrom and nightsto and nightsfrom <= nights <= nightsto:
@@ -1536,8 +1949,10 @@ def _pick_best_tour(tours: list, ideal_datefrom: str = None,
         price = _safe_int(t.get("price"), 999999999)
         scored.append((nights_tier, meal_match, date_diff, price, t))
 
-    scored.sort(key=lambda x: (x[0], x[1], x[2], x[3]))
-    return scored[0][4]
+    # Нужен только лучший тур: min() за один проход вместо полной сортировки
+    # (при равных ключах, как и стабильная sort, берёт первый). Ключ — первые
+    # четыре поля: dict тура несравним.
+    return min(scored, key=itemgetter(0, 1, 2, 3))[4]
 
 
 _DEFAULT_BOOKING_BASE_URL = "https://mgp.ru/tours/"
@@ -1550,6 +1965,18 @@ _DEFAULT_BOOKING_BASE_URL = "https://mgp.ru/tours/"
 # mismatch (observed in production 2026-05-14, mgp-krasnogorsk feedback).
 _MAX_CHANNEL_CARDS_LIMIT = 3
 
+# Порядковые слова плейсхолдера tourid → позиция в _tourid_map
+# (_resolve_tourid_from_text). Порядок = приоритет: первое найденное слово
+# с известной позицией выигрывает, поэтому это не regex-альтернация
+# (та вернула бы самое левое совпадение в тексте).
+_TOURID_ORDINALS = (
+    ("перв", 1), ("1", 1),
+    ("втор", 2), ("2", 2),
+    ("трет", 3), ("третьего", 3), ("3", 3),
+    ("четверт", 4), ("четвёрт", 4), ("4", 4),
+    ("пят", 5), ("5", 5),
+)
+
 
 def _build_hotel_link(
     tourid,
@@ -1667,6 +2094,7 @@ def _map_hotel_to_card(hotel: dict, departure_city: str = "Москва", adults
     """
     tour = hotel.get("tour") or {}
     flydate_raw = tour.get("flydate", "")
+    date_from = _parse_tv_date(flydate_raw)
     nights = _safe_int(tour.get("nights"), 7)
     tour_price = _safe_int(tour.get("price") or hotel.get("price"))
 
@@ -1688,7 +2116,7 @@ def _map_hotel_to_card(hotel: dict, departure_city: str = "Москва", adults
             "country_id": hotel.get("countrycode"),
             "region_id": hotel.get("regioncode"),
             "departure_id": departure_id,
-            "date_from": _parse_tv_date(flydate_raw),
+            "date_from": date_from,
             "nights": nights,
             "adults": adults,
         }
@@ -1707,7 +2135,7 @@ def _map_hotel_to_card(hotel: dict, departure_city: str = "Москва", adults
         "country": hotel.get("countryname") or "",
         "resort": hotel.get("regionname") or "",
         "region": hotel.get("regionname") or "",
-        "date_from": _parse_tv_date(flydate_raw),
+        "date_from": date_from,
         "date_to": _calc_end_date(flydate_raw, nights),
         "nights": nights,
         "price": tour_price,
@@ -1766,7 +2194,8 @@ def _map_hot_tour_to_card(tour_data: dict, booking_base_url: str = None,
     nights = _safe_int(tour_data.get("nights"), 7)
     price_pp = _safe_int(tour_data.get("price_per_person"))
     meal_code = tour_data.get("meal") or ""
-    meal_ru = _MEAL_CODE_TO_RU.get(meal_code.strip(), meal_code)
+    # Код обычно приходит без пробелов — strip() только при промахе
+    meal_ru = _MEAL_CODE_TO_RU.get(meal_code) or _MEAL_CODE_TO_RU.get(meal_code.strip(), meal_code)
 
     tourid = tour_data.get("tourid")
     _tour_meta: Optional[Dict[str, Any]] = None
@@ -1828,12 +2257,16 @@ def _map_hot_tour_to_card(tour_data: dict, booking_base_url: str = None,
     return card
 
 
+_RE_SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+')
+_DEDUP_MIN_LEN = 100
+
+
 def _dedup_response(text: str) -> str:
     """
     Удаляет дублированный контент из ответа модели.
     Handles: 1) corrupted-char restarts, 2) consecutive identical sentences/paragraphs.
     """
-    if not text or len(text) < 100:
+    if not text or len(text) < _DEDUP_MIN_LEN:
         return text
     
     # Pass 1: corrupted-char restart dedup (original logic)
@@ -1849,24 +2282,31 @@ def _dedup_response(text: str) -> str:
                 text = clean
 
     # Pass 2: consecutive identical sentences within same paragraph
-    sentences = re.split(r'(?<=[.!?])\s+', text)
+    # (каждое предложение strip'ается один раз; prev — strip последнего оставленного)
+    sentences = _RE_SENTENCE_SPLIT.split(text)
     if len(sentences) > 2:
         deduped = [sentences[0]]
+        prev = sentences[0].strip()
         for s in sentences[1:]:
-            if s.strip() and s.strip() != deduped[-1].strip():
+            cur = s.strip()
+            if cur and cur != prev:
                 deduped.append(s)
+                prev = cur
         if len(deduped) < len(sentences):
             text = " ".join(deduped)
             logger.debug("🧹 DEDUP-SENTENCES: removed %d duplicate sentences",
                          len(sentences) - len(deduped))
 
     # Pass 3: consecutive identical paragraphs (split by double newline)
-    paragraphs = text.split('\n\n')
+    paragraphs = text.split('\n\n') if '\n\n' in text else ()
     if len(paragraphs) > 1:
         deduped_p = [paragraphs[0]]
+        prev = paragraphs[0].strip()
         for p in paragraphs[1:]:
-            if p.strip() and p.strip() != deduped_p[-1].strip():
+            cur = p.strip()
+            if cur and cur != prev:
                 deduped_p.append(p)
+                prev = cur
         if len(deduped_p) < len(paragraphs):
             text = "\n\n".join(deduped_p)
             logger.debug("🧹 DEDUP-PARAGRAPHS: removed %d duplicate paragraphs",
@@ -1914,6 +2354,23 @@ _RE_REASONING_MARKERS = re.compile(
     re.IGNORECASE
 )
 
+# Каждый маркер содержит хотя бы одну ASCII-букву, JSON-маркер — '"role"':
+# чисто кириллический ответ (обычный случай) отсекается одним проходом
+# без запуска IGNORECASE-альтернации на каждой позиции.
+# Hyperscan здесь не нужен: он не входит в зависимости сервиса, а оба
+# паттерна и так запускаются только на редких ответах, прошедших эти проверки.
+_RE_HAS_LATIN = re.compile(r'[A-Za-z]')
+
+# Литерал, без которого не сработает ни одна ветка _RE_REASONING_MARKERS (в
+# нижнем регистре). Ответ с латиницей (названия отелей, «All Inclusive») без
+# них в regex не идёт. Меняешь маркеры — обнови и этот кортеж.
+_REASONING_MARKER_LITERALS = (
+    "we ", "now i", "i should", "i need to", "i must", "let me ",
+    "the",              # The user/…, Кажется the, based on the, per the
+    "chatgpt", "gpt-", "as an ai", "мы have",
+    "system", "final", "will", "going", "internal", "according",
+)
+
 _MIN_VALID_PREFIX = 30
 _MIN_CLEANED_LEN = 20
 
@@ -1936,8 +2393,13 @@ def _strip_reasoning_leak(text: str) -> str:
 
     original = text
 
+    # Оба поиска идут с начала текста, не search(text, _MIN_VALID_PREFIX):
+    # решает ПЕРВОЕ вхождение. Маркер в пределах _MIN_VALID_PREFIX — часть
+    # обычного ответа, и проход целиком пропускается; поиск с pos нашёл бы
+    # следующее вхождение и обрезал бы такой ответ.
+
     # Pass 1: mid-text JSON {"role":"assistant"...}
-    m = _RE_REASONING_JSON.search(text)
+    m = _RE_REASONING_JSON.search(text) if '"role"' in text else None
     if m and m.start() > _MIN_VALID_PREFIX:
         candidate = text[:m.start()].rstrip()
         if len(candidate) >= _MIN_CLEANED_LEN:
@@ -1948,7 +2410,11 @@ def _strip_reasoning_leak(text: str) -> str:
             text = candidate
 
     # Pass 2: English reasoning markers
-    m = _RE_REASONING_MARKERS.search(text)
+    m = None
+    if _RE_HAS_LATIN.search(text):
+        low = text.lower()
+        if any(lit in low for lit in _REASONING_MARKER_LITERALS):
+            m = _RE_REASONING_MARKERS.search(text)
     if m and m.start() > _MIN_VALID_PREFIX:
         candidate = text[:m.start()].rstrip()
         if len(candidate) >= _MIN_CLEANED_LEN:
@@ -2019,6 +2485,9 @@ def _apply_grammar_and_compliance(text: str, manager_phone: str = "") -> str:
 
 
 # ── Sentence-level deduplication ──────────────────────────────────────────
+_RE_QUESTION = re.compile(r'[^.!?\n]*\?')
+
+
 def _dedup_sentences(text: str) -> str:
     """
     Remove duplicated question sentences within a single response.
@@ -2027,21 +2496,38 @@ def _dedup_sentences(text: str) -> str:
     if not text or len(text) < 60:
         return text
 
-    questions = re.findall(r'[^.!?\n]*\?', text)
-    for q in questions:
-        q_stripped = q.strip()
+    # Один проход по вопросам. Вхождение вопроса q в текст всегда оканчивается
+    # на «?» какого-то вопроса-сегмента, т.е. это сегмент, который кончается на q
+    # («Уточните: Какой бюджет…?» содержит «Какой бюджет…?»). Поэтому
+    # text.find() по всему тексту не нужен — хватает endswith по прошлым
+    # сегментам. Обрезка — как раньше: после первого вхождения первого (по
+    # порядку) повторённого вопроса, если остаётся достаточно текста.
+    seen: List[Tuple[str, int]] = []          # (вопрос, конец сегмента)
+    first_end: List[int] = []                 # конец первого вхождения seen[i]
+    cuts: Dict[int, Tuple[int, int]] = {}     # индекс вопроса → (обрезка, позиция повтора)
+    for m in _RE_QUESTION.finditer(text):
+        q_stripped = m.group().strip()
         if len(q_stripped) < 20:
             continue
-        first_pos = text.find(q_stripped)
-        second_pos = text.find(q_stripped, first_pos + len(q_stripped))
-        if second_pos > 0:
-            cleaned = text[:first_pos + len(q_stripped)].rstrip()
-            if len(cleaned) >= _MIN_CLEANED_LEN:
-                logger.warning(
-                    "🧹 DEDUP-SENTENCE: removed duplicate question at pos %d: '%s'",
-                    second_pos, q_stripped[:60],
-                )
-                return cleaned
+        end = m.end()
+        for j, (prev_q, _) in enumerate(seen):
+            if j not in cuts and q_stripped.endswith(prev_q):
+                cuts[j] = (first_end[j], end - len(prev_q))
+        k = len(seen)
+        first = next((e for prev_q, e in seen if prev_q.endswith(q_stripped)), end)
+        seen.append((q_stripped, end))
+        first_end.append(first)
+        if first != end:
+            cuts[k] = (first, end - len(q_stripped))
+    for j in sorted(cuts):
+        cut, second_pos = cuts[j]
+        cleaned = text[:cut].rstrip()
+        if len(cleaned) >= _MIN_CLEANED_LEN:
+            logger.warning(
+                "🧹 DEDUP-SENTENCE: removed duplicate question at pos %d: '%s'",
+                second_pos, seen[j][0][:60],
+            )
+            return cleaned
     return text
 
 
@@ -2051,6 +2537,13 @@ _RE_ORPHAN_START = re.compile(
     r'Жду|Конечно|Понятно|Спасибо|Итого|Итак)\b',
     re.IGNORECASE,
 )
+# Те же слова в нижнем регистре: tuple-startswith отсекает обычный хвост без
+# regex; на совпадении _RE_ORPHAN_START.match проверяет ещё и границу слова
+# («Итоговая» — не фрагмент)
+_ORPHAN_STARTS_LC = (
+    "отлично", "хорошо", "давайте", "ладно", "замечательно", "прекрасно",
+    "жду", "конечно", "понятно", "спасибо", "итого", "итак",
+)
 
 
 def _strip_trailing_fragment(text: str) -> str:
@@ -2067,24 +2560,60 @@ def _strip_trailing_fragment(text: str) -> str:
         return text
 
     trailing = text[last_q + 1:]
-    if not trailing.strip():
-        return text
-
     trailing_stripped = trailing.strip()
-    if len(trailing_stripped) >= 60 or trailing_stripped[-1] in '.?!':
+    if (
+        not trailing_stripped
+        or len(trailing_stripped) >= 60
+        or trailing_stripped[-1] in '.?!'
+    ):
         return text
 
-    if _RE_ORPHAN_START.match(trailing):
+    if (
+        trailing_stripped.lower().startswith(_ORPHAN_STARTS_LC)
+        and _RE_ORPHAN_START.match(trailing)
+    ):
         cleaned = text[:last_q + 1].rstrip()
         if len(cleaned) >= _MIN_CLEANED_LEN:
             logger.warning(
-                "🧹 TRAILING-FRAGMENT stripped: '%s'",
-                trailing_stripped[:60],
+                "🧹 TRAILING-FRAGMENT stripped: '%s'", trailing_stripped,
             )
             return cleaned
     return text
 
 
+# Триггеры проходов _clean_response: вопросы, JSON-утечка ('{'), латиница
+# (маркеры рассуждений, технические ID). Без них короткий ответ не меняется.
+_RE_NEEDS_CLEAN = re.compile(r'[?{A-Za-z]')
+
+
+def _clean_response(text: str) -> str:
+    """
+    Post-processing pipeline for the final model answer, in one call:
+    dedup → reasoning-leak → technical IDs → question dedup → merged
+    questions → trailing fragment.
+
+    Passes that cannot fire are skipped by cheap checks on the current text
+    (length, presence of '?'), so a typical short answer allocates no
+    intermediate strings.
+    """
+    if not text:
+        return text
+    if len(text) < _DEDUP_MIN_LEN and not _RE_NEEDS_CLEAN.search(text):
+        # Короткий ответ без '?', латиницы и '{' — ни один проход не сработает
+        return text
+    if len(text) >= _DEDUP_MIN_LEN:
+        text = _dedup_response(text)
+    if len(text) >= _MIN_VALID_PREFIX + 10:
+        text = _strip_reasoning_leak(text)
+    text = _strip_technical_ids(text)
+    # Оставшиеся проходы работают только с вопросами
+    if '?' in text:
+        text = _dedup_sentences(text)
+        text = _fix_merged_questions(text)
+        text = _strip_trailing_fragment(text)
+    return text
+
+
 # ════════════════════════════════════════════════════════════════════
 # SMART-ALTERNATIVES (Умный подбор альтернатив при 0 результатов)
 # ════════════════════════════════════════════════════════════════════
@@ -2201,6 +2730,12 @@ _MANAGER_HANDOFF_POLICY_GRACEFUL = (
 )
 
 
+
+def _function_call_output(call_id: str, output: str) -> Dict:
+    """Элемент input_list с результатом вызова функции (Responses API)."""
+    return {"type": "function_call_output", "call_id": call_id, "output": output}
+
+
 class YandexGPTHandler:
     """Обработчик запросов к Yandex GPT с Function Calling (Responses API)"""
 
@@ -2291,13 +2826,18 @@ class YandexGPTHandler:
         self._last_requestid: Optional[str] = None  # Последний реальный requestid из search_tours
         self._search_awaiting_results: bool = False   # True после search_tours, False после get_search_results
         self._tourid_map: Dict[int, Dict] = {}       # Позиция(1-based) → {tourid, hotelcode, hotelname}
-        self._tour_details_cache: Dict[str, Dict] = {}  # tourid → actdetail result (prefetched)
+        # tourid → actdetail result (prefetched), LRU на _TOUR_DETAILS_CACHE_MAX
+        self._tour_details_cache: Dict[str, Dict] = _BoundedCache(_TOUR_DETAILS_CACHE_MAX)
         
         # ── Fix C2: Кэш параметров последнего поиска ──
         # При смене страны/направления ("а если Египет?") модель часто теряет
         # параметры из предыдущего поиска. Кэш заполняется после успешного search_tours
         # и используется как fallback для пропущенных параметров.
         self._last_search_params: Dict = {}
+        # (ключ истории+args, результат) последней проверки каскада — см. search_tours
+        self._cascade_check_memo: Optional[Tuple] = None
+        # (n, exclude) → (список истории, длина, последний элемент, текст) — см. _recent_user_text
+        self._user_text_memo: Dict[Tuple, Tuple] = {}
         self._user_stated_budget: Optional[int] = None
         # Пиковый (максимальный) названный бюджет за диалог. Клиент мог открыть на
         # 200к и торговаться вниз — для гейта подписки он всё равно премиум-лид.
@@ -2369,13 +2909,7 @@ class YandexGPTHandler:
         self._last_message_usage: Optional[Dict[str, int]] = None
         
         # ── Метрики для мониторинга качества (Этап 3) ──
-        self._metrics = {
-            "promised_search_detections": 0,      # Детекции "обещанного поиска"
-            "cascade_incomplete_detections": 0,   # Блокировки из-за неполного каскада
-            "dateto_corrections": 0,              # Исправления dateto
-            "total_searches": 0,                  # Всего вызовов search_tours
-            "total_messages": 0,                  # Всего сообщений пользователя
-        }
+        self._metrics = _Metrics()
         
         logger.info(
             "🤖 YandexGPTHandler INIT  model=%s  folder=%s  tools=%d  assistant=%s  source=%s",
@@ -2408,10 +2942,7 @@ class YandexGPTHandler:
         if not args.get("priceto") or args.get("pricefrom"):
             return
 
-        _price_user_text = " ".join([
-            msg.get("content", "") for msg in self.full_history[-20:]
-            if msg.get("role") == "user" and msg.get("content")
-        ]).lower()
+        _price_user_text = self._recent_user_text(20)
 
         _orig_priceto = int(args["priceto"])
 
@@ -2624,12 +3155,7 @@ class YandexGPTHandler:
         child_n = _safe_int(args.get("child"), 0) or 0
 
         if child_n >= 1:
-            user_text = " ".join(
-                msg.get("content", "")
-                for msg in self.full_history[-30:]
-                if msg.get("role") == "user" and msg.get("content")
-            )
-            if not _CHILD_MENTION_RE.search(user_text):
+            if not _CHILD_MENTION_RE.search(self._recent_user_text(30)):
                 logger.warning(
                     "🛡️ CHILD-GUARDRAIL: LLM set child=%s, но клиент НЕ упоминал детей "
                     "→ форсирую child=0 (фантомный ребёнок)",
@@ -2699,7 +3225,7 @@ class YandexGPTHandler:
 
     def get_metrics(self) -> Dict[str, int]:
         """Возвращает метрики сессии для мониторинга"""
-        return self._metrics.copy()
+        return self._metrics.asdict()
     
     def _resolve_tourid_from_text(self, placeholder: str) -> Optional[str]:
         """
@@ -2711,16 +3237,7 @@ class YandexGPTHandler:
         
         placeholder_lower = placeholder.lower()
         
-        # Маппинг порядковых слов → позиция
-        ordinal_map = {
-            "перв": 1, "1": 1,
-            "втор": 2, "2": 2,
-            "трет": 3, "третьего": 3, "3": 3,
-            "четверт": 4, "четвёрт": 4, "4": 4,
-            "пят": 5, "5": 5,
-        }
-        
-        for keyword, pos in ordinal_map.items():
+        for keyword, pos in _TOURID_ORDINALS:
             if keyword in placeholder_lower:
                 entry = self._tourid_map.get(pos)
                 if entry:
@@ -2916,6 +3433,11 @@ class YandexGPTHandler:
         except Exception as e:
             logger.warning("PREFETCH thread error: %s", str(e)[:120])
         finally:
+            # httpx-клиент этого loop — закрыть, пока loop жив
+            try:
+                loop.run_until_complete(self.tourvisor.close())
+            except Exception as e:
+                logger.debug("PREFETCH tourvisor close failed: %s", e)
             loop.close()
 
     async def _fetch_one(self, tid: str, hotel: str):
@@ -2971,17 +3493,42 @@ class YandexGPTHandler:
             logger.debug("🔄 ROLE-FIX: inserted %s placeholder before %s message", placeholder_role, role)
         self.full_history.append({"role": role, "content": content})
     
+    def _recent_user_text(self, n: int, exclude: Tuple[str, ...] = ()) -> str:
+        """
+        Реплики role="user" из последних n сообщений full_history одной строкой
+        в нижнем регистре; сообщения с префиксами из exclude пропускаются.
+
+        Валидация search_tours читает этот текст в нескольких местах подряд —
+        результат кэшируется, пока история не изменилась (тот же список, та же
+        длина, тот же последний элемент; ссылка на него держится в кэше, так что
+        его id не переиспользуется). Реплики клиента на месте не правятся.
+        """
+        history = self.full_history
+        last = history[-1] if history else None
+        key = (n, exclude)
+        memo = self._user_text_memo.get(key)
+        if memo is not None and memo[0] is history and memo[1] == len(history) and memo[2] is last:
+            return memo[3]
+        text = " ".join(
+            c for c in (m.get("content") for m in history[-n:] if m.get("role") == "user")
+            if c and not (exclude and c.startswith(exclude))
+        ).lower()
+        self._user_text_memo[key] = (history, len(history), last, text)
+        return text
+
     def _trim_history(self):
         """
         Обрезает full_history если она превышает _max_history_len.
         Сохраняет первое сообщение (часто содержит контекст) + последние N.
+        Середина удаляется на месте (del среза) — без двух срезов и новой
+        склейки списка.
         """
-        if len(self.full_history) > self._max_history_len:
-            old_len = len(self.full_history)
+        old_len = len(self.full_history)
+        if old_len > self._max_history_len:
             # Оставляем первые 2 + последние (_max_history_len - 2)
             keep_start = 2
             keep_end = self._max_history_len - keep_start
-            self.full_history = self.full_history[:keep_start] + self.full_history[-keep_end:]
+            del self.full_history[keep_start:old_len - keep_end]
             logger.info("✂️ TRIM full_history: %d → %d messages", old_len, len(self.full_history))
     
     def _dialogue_log(self, direction: str, content: str):
@@ -3826,21 +4373,22 @@ class YandexGPTHandler:
     async def _execute_function(self, name: str, arguments: str, call_id: str) -> Dict:
         """Выполнить функцию и вернуть результат в новом формате"""
         try:
-            args = json.loads(arguments) if arguments else {}
+            if not arguments:
+                args = {}
+            elif orjson is not None:
+                args = orjson.loads(arguments)   # orjson.JSONDecodeError — подкласс json.JSONDecodeError
+            else:
+                args = json.loads(arguments)
         except json.JSONDecodeError as e:
             logger.error(
                 "⚠️ JSON PARSE ERROR for %s: %s (arg_len=%d)",
                 name, e, len(arguments or "")
             )
             self._dialogue_log("ERROR", f"{name} -> malformed JSON: {str(e)[:200]}")
-            return {
-                "type": "function_call_output",
-                "call_id": call_id,
-                "output": json.dumps({
-                    "error": f"Ошибка: аргументы функции {name} содержат невалидный JSON. "
-                             f"Попробуй вызвать функцию заново с корректными аргументами."
-                }, ensure_ascii=False)
-            }
+            return _function_call_output(call_id, json.dumps({
+                "error": f"Ошибка: аргументы функции {name} содержат невалидный JSON. "
+                         f"Попробуй вызвать функцию заново с корректными аргументами."
+            }, ensure_ascii=False))
         args_pretty = json.dumps(args, ensure_ascii=False)
         logger.info("🔧 FUNC CALL >> %s(%s)  call_id=%s", name, args_pretty[:300], call_id)
         t0 = time.perf_counter()
@@ -3850,6 +4398,9 @@ class YandexGPTHandler:
         
         try:
             result = await self._dispatch_function(name, args)
+            # Сериализуем stdlib json, не orjson: модель, история и проверки вида
+            # '"hotels": []' рассчитаны на разделители ", " / ": ", а default=str
+            # даёт для datetime str(), а не isoformat, как у orjson
             result_str = json.dumps(result, ensure_ascii=False, default=str)
             elapsed_ms = int((time.perf_counter() - t0) * 1000)
             logger.info("🔧 FUNC CALL << %s  OK  %dms  result_size=%d chars", name, elapsed_ms, len(result_str))
@@ -3862,11 +4413,7 @@ class YandexGPTHandler:
             # Пишем в диалоговый лог результат функции (первые 2000 символов)
             self._dialogue_log("FUNC_RESULT", f"{name} -> {result_str[:2000]}{'…' if len(result_str) > 2000 else ''}")
             
-            return {
-                "type": "function_call_output",
-                "call_id": call_id,
-                "output": result_str
-            }
+            return _function_call_output(call_id, result_str)
         except (TourVisorAPIError, TourIdExpiredError, SearchNotFoundError, NoResultsError) as e:
             elapsed_ms = int((time.perf_counter() - t0) * 1000)
             error_msg = f"Ошибка: {str(e)}"
@@ -3875,21 +4422,13 @@ class YandexGPTHandler:
             if isinstance(e, NoResultsError) and name == "get_search_status":
                 self._search_awaiting_results = False
                 logger.info("🔄 _search_awaiting_results=False (0 results — no point calling get_search_results)")
-            return {
-                "type": "function_call_output",
-                "call_id": call_id,
-                "output": json.dumps({"error": error_msg}, ensure_ascii=False)
-            }
+            return _function_call_output(call_id, json.dumps({"error": error_msg}, ensure_ascii=False))
         except Exception as e:
             elapsed_ms = int((time.perf_counter() - t0) * 1000)
             error_msg = f"Неожиданная ошибка: {str(e)}"
             logger.error("🔧 FUNC CALL << %s  EXCEPTION  %dms  %s", name, elapsed_ms, error_msg, exc_info=True)
             self._dialogue_log("ERROR", f"{name} -> {error_msg}")
-            return {
-                "type": "function_call_output",
-                "call_id": call_id,
-                "output": json.dumps({"error": error_msg}, ensure_ascii=False)
-            }
+            return _function_call_output(call_id, json.dumps({"error": error_msg}, ensure_ascii=False))
     
     async def _dispatch_function(self, name: str, args: Dict) -> Any:
         """Маршрутизация вызовов функций к TourVisor клиенту"""
@@ -3959,14 +4498,9 @@ class YandexGPTHandler:
                 _skip_validation = False
 
                 if _model_changed:
-                    _recent_user = " ".join([
-                        msg.get("content", "").lower()
-                        for msg in self.full_history[-6:]
-                        if msg.get("role") == "user" and msg.get("content")
-                        and not msg.get("content", "").startswith("Результаты")
-                    ])
+                    _recent_user = self._recent_user_text(6, ("Результаты",))
                     _verify = _DEPARTURE_VERIFY.get(dep_code)
-                    if _verify and re.search(_verify, _recent_user):
+                    if _verify and _verify.search(_recent_user):
                         logger.info(
                             "📋 DEPARTURE-CHANGE: %s(%d) → %s(%d), подтверждено текстом",
                             _DEPARTURE_CITIES.get(_prev_dep, "?"), _prev_dep,
@@ -3982,14 +4516,9 @@ class YandexGPTHandler:
                     )
 
                 if not _skip_validation:
-                    user_text_for_dep = " ".join([
-                        msg.get("content", "") for msg in self.full_history[-20:]
-                        if msg.get("role") == "user" and msg.get("content")
-                        and not msg.get("content", "").startswith("Результаты вызванных функций")
-                        and not msg.get("content", "").startswith("Результаты запросов:")
-                    ]).lower()
-                    for dep_pattern, correct_dep_id in _DEPARTURE_VALIDATION:
-                        if re.search(dep_pattern, user_text_for_dep):
+                    user_text_for_dep = self._recent_user_text(20, _FUNC_RESULT_PREFIXES)
+                    for dep_rx, correct_dep_id in _DEPARTURE_VALIDATION:
+                        if dep_rx.search(user_text_for_dep):
                             if dep_code != correct_dep_id:
                                 logger.warning(
                                     "⚠️ DEPARTURE-MISMATCH: departure=%s → %s (%s)",
@@ -4015,7 +4544,7 @@ class YandexGPTHandler:
             # datefrom: "\"get_current_date(\"" (из Сценария 8)
             for _sanitize_key in ("datefrom", "dateto"):
                 _sv = args.get(_sanitize_key, "")
-                if isinstance(_sv, str) and re.search(r'get_\w+\(|search_\w+\(|"get_|function', _sv):
+                if isinstance(_sv, str) and _HALLUCINATED_FUNC_RE.search(_sv):
                     logger.warning(
                         "⚠️ HALLUCINATED-FUNC-IN-PARAM: %s='%s' — удаляем галлюцинацию",
                         _sanitize_key, _sv[:100]
@@ -4025,7 +4554,7 @@ class YandexGPTHandler:
             # ── Fix P2: Авто-дополнение года в датах DD.MM → DD.MM.YYYY ──
             for _dk in ("datefrom", "dateto"):
                 _dv = args.get(_dk)
-                if _dv and re.fullmatch(r'\d{1,2}\.\d{1,2}', str(_dv)):
+                if _dv and _DATE_NOYEAR_RE.fullmatch(str(_dv)):
                     _now = _dt.now()
                     _dv_with_year = f"{_dv}.{_now.year}"
                     try:
@@ -4092,30 +4621,12 @@ class YandexGPTHandler:
             # Проверяем: если в user_text есть "начале/середине/конце + месяц",
             # а datefrom-dateto ≤ 5 дней — это ошибка, корректируем.
             if args.get("datefrom") and args.get("dateto"):
-                user_msgs_for_dates = [
-                    msg.get("content", "") for msg in self.full_history[-20:]
-                    if msg.get("role") == "user" and msg.get("content")
-                ]
-                user_text_for_dates = " ".join(user_msgs_for_dates).lower()
-                
-                _MONTHS_MAP = {
-                    'январ': (1, 31), 'феврал': (2, 28), 'март': (3, 31), 'апрел': (4, 30),
-                    'ма': (5, 31), 'июн': (6, 30), 'июл': (7, 31), 'август': (8, 31),
-                    'сентябр': (9, 30), 'октябр': (10, 31), 'ноябр': (11, 30), 'декабр': (12, 31),
-                }
+                user_text_for_dates = self._recent_user_text(20)
                 
                 # Паттерн: "в начале/середине/конце + месяц"
-                month_part_match = re.search(
-                    r'(?:в\s+)?(?P<part>начал\w*|середин\w*|конц\w*|перв\w+\s+половин\w*|втор\w+\s+половин\w*)'
-                    r'\s+(?P<month>январ\w*|феврал\w*|март\w*|апрел\w*|ма[еяй]\w*|июн\w*|июл\w*|август\w*|сентябр\w*|октябр\w*|ноябр\w*|декабр\w*)',
-                    user_text_for_dates
-                )
+                month_part_match = _MONTH_PART_RE.search(user_text_for_dates)
                 
-                _has_explicit_day_range = re.search(
-                    r'(?:с\s+)?\d{1,2}\s*(?:по|-)\s*\d{1,2}\s*'
-                    r'(?:числ|январ|феврал|март|апрел|ма[еяй]|июн|июл|август|сентябр|октябр|ноябр|декабр)',
-                    user_text_for_dates
-                )
+                _has_explicit_day_range = _EXPLICIT_DAY_RANGE_RE.search(user_text_for_dates)
                 if _has_explicit_day_range:
                     logger.info("🛡️ P4-GUARD: explicit day range detected (%s) — skipping month-part correction",
                                 _has_explicit_day_range.group())
@@ -4128,7 +4639,7 @@ class YandexGPTHandler:
                     # Определяем месяц
                     detected_month = None
                     detected_last_day = 31
-                    for prefix, (m_num, m_last) in _MONTHS_MAP.items():
+                    for prefix, (m_num, m_last) in _MONTH_PREFIX_DAYS:
                         if month_word.startswith(prefix):
                             detected_month = m_num
                             detected_last_day = m_last
@@ -4188,134 +4699,16 @@ class YandexGPTHandler:
             # и только если не получилось — возвращаем ошибку
             _resort_auto_resolved = False
             if not args.get("regions") and not args.get("subregions") and not args.get("hotels"):
-                user_messages_for_region = [
-                    msg.get("content", "") for msg in self.full_history[-20:] 
-                    if msg.get("role") == "user" 
-                    and msg.get("content")
-                    and not msg.get("content", "").startswith("Результаты вызванных функций")
-                ]
-                user_text_for_region = " ".join(user_messages_for_region).lower()
-                
-                # Универсальный список курортов по странам
-                # Формат: (паттерн, страна_отображение, region_id | None, country_code, parent_region | None)
-                #   region_id — если ID региона ИЗВЕСТЕН (популярные регионы)
-                #   parent_region — если город является подрайоном известного региона (нужен API lookup)
-                resort_patterns = [
-                    # ═══ Россия (country=47) — ALL TourVisor regions ═══
-                    # КМВ (424) — города региона
-                    (r'\b(?:кисловодск\w*|пятигорск\w*|ессентуки\w*|железноводск\w*|минеральн\w*\s*вод\w*|кмв)\b', "России", "424", 47, None),
-                    # Сочи (426) + Адлер
-                    (r'\b(?:сочи)\b', "России", "426", 47, None),
-                    (r'\b(?:адлер\w*)\b', "России", "426", 47, None),
-                    # Красная Поляна (495)
-                    (r'\b(?:красн\w*\s*полян\w*)\b', "России", "495", 47, None),
-                    # Черноморское побережье
-                    (r'\b(?:анап[аыуе]\w*)\b', "России", "427", 47, None),
-                    (r'\b(?:геленджик\w*|новоросс\w*)\b', "России", "428", 47, None),
-                    (r'\b(?:туапсе\w*)\b', "России", "429", 47, None),
-                    (r'\b(?:азовск\w*)\b', "России", "564", 47, None),
-                    # Крым (423)
-                    (r'\b(?:крым\w*)\b', "России", "423", 47, None),
-                    (r'\b(?:ялт[аыуе]\w*|алушт[аыуе]\w*|севастопол\w*|феодоси\w*|судак\w*|евпатори\w*)\b', "России", "423", 47, None),
-                    # Калининград (425)
-                    (r'\b(?:калининград\w*)\b', "России", "425", 47, None),
-                    (r'\b(?:светлогорск\w*|зеленоградск\w*)\b', "России", "425", 47, None),
-                    # Горнолыжные курорты
-                    (r'\b(?:домбай\w*)\b', "России", "523", 47, None),
-                    (r'\b(?:приэльбрусь\w*|эльбрус\w*)\b', "России", "524", 47, None),
-                    (r'\b(?:архыз\w*)\b', "России", "525", 47, None),
-                    (r'\b(?:шерегеш\w*)\b', "России", "498", 47, None),
-                    (r'\b(?:абзаков\w*|банно\w*)\b', "России", "518", 47, None),
-                    # Города-направления (одновременно departure и destination)
-                    (r'\b(?:казан[ьи]\w*)\b', "России", "517", 47, None),
-                    (r'\b(?:подмосковь\w*)\b', "России", "469", 47, None),
-                    (r'\b(?:золот\w*\s*кольц\w*)\b', "России", "527", 47, None),
-                    (r'\b(?:велик\w*\s*устюг\w*)\b', "России", "471", 47, None),
-                    # Кавказ
-                    (r'\b(?:дагестан\w*|махачкал\w*|дербент\w*)\b', "России", "662", 47, None),
-                    (r'\b(?:адыге[яи]\w*)\b', "России", "697", 47, None),
-                    (r'\b(?:ингушети\w*)\b', "России", "689", 47, None),
-                    (r'\b(?:кабардин\w*|нальчик\w*)\b', "России", "692", 47, None),
-                    (r'\b(?:осети\w*|владикавказ\w*)\b', "России", "680", 47, None),
-                    (r'\b(?:чечн\w*|грозн\w*)\b', "России", "679", 47, None),
-                    # Природные регионы
-                    (r'\b(?:карели\w*|петрозаводск\w*)\b', "России", "526", 47, None),
-                    (r'\b(?:байкал\w*)\b', "России", "565", 47, None),
-                    (r'\b(?:алтай\w*)\b', "России", "496", 47, None),
-                    (r'\b(?:урал\w*)\b', "России", "563", 47, None),
-                    (r'\b(?:мурманск\w*)\b', "России", "668", 47, None),
-                    # Экскурсионные
-                    (r'\b(?:псков\w*)\b', "России", "617", 47, None),
-                    (r'\b(?:воронеж\w*)\b', "России", "661", 47, None),
-                    (r'\b(?:татарстан\w*)\b', "России", "618", 47, None),
-                    # ═══ Турция (country=4) — hardcoded IDs ═══
-                    (r'\b(?:алан[ьи]я|аланья)\b', "Турции", "19", 4, None),
-                    (r'\b(?:анталь?я|анталия)\b', "Турции", "20", 4, None),
-                    (r'\b(?:белек)\b', "Турции", "21", 4, None),
-                    (r'\b(?:кемер)\b', "Турции", "22", 4, None),
-                    (r'\b(?:сиде)\b', "Турции", "23", 4, None),
-                    (r'\b(?:бодрум)\b', "Турции", "24", 4, None),
-                    (r'\b(?:даламан)\b', "Турции", "25", 4, None),
-                    (r'\b(?:мармарис)\b', "Турции", "26", 4, None),
-                    (r'\b(?:фетхие|фетие)\b', "Турции", "27", 4, None),
-                    (r'\b(?:кушадас\w*)\b', "Турции", "154", 4, None),
-                    (r'\b(?:стамбул)\b', "Турции", "277", 4, None),
-                    (r'\b(?:дидим)\b', "Турции", "155", 4, None),
-                    # ═══ Египет (country=1) — hardcoded IDs из системного промпта ═══
-                    (r'\b(?:шарм[\s-]*(?:эль[\s-]*)?шейх|шарм)\b', "Египта", "6", 1, None),
-                    (r'\b(?:хургад[аыуе]\w*)\b', "Египта", "5", 1, None),
-                    (r'\b(?:марса[\s-]*алам)\b', "Египта", "11", 1, None),
-                    (r'\b(?:дахаб)\b', "Египта", None, 1, None),
-                    # ═══ ОАЭ (country=9) — hardcoded IDs ═══
-                    (r'\b(?:дубай|дубаи)\b', "ОАЭ", "45", 9, None),
-                    (r'\b(?:абу[\s-]*даби)\b', "ОАЭ", "43", 9, None),
-                    (r'\b(?:шардж[аеу]\w*)\b', "ОАЭ", "48", 9, None),
-                    (r'\b(?:рас[\s-]*аль[\s-]*хайм\w*)\b', "ОАЭ", "46", 9, None),
-                    # ═══ Таиланд (country=2) — hardcoded IDs ═══
-                    (r'\b(?:пхукет|пукет)\b', "Таиланда", "8", 2, None),
-                    (r'\b(?:паттай[яеу]\w*|паттая)\b', "Таиланда", "7", 2, None),
-                    (r'\b(?:самуи)\b', "Таиланда", "9", 2, None),
-                    (r'\b(?:краби)\b', "Таиланда", "60", 2, None),
-                    (r'\b(?:хуа[\s-]*хин)\b', "Таиланда", None, 2, None),
-                    # ═══ Вьетнам (country=16) ═══
-                    (r'\b(?:фукуок|фу[\s-]*куок)\b', "Вьетнама", None, 16, None),
-                    (r'\b(?:нячанг|ня[\s-]*чанг)\b', "Вьетнама", None, 16, None),
-                    (r'\b(?:фантьет|фан[\s-]*тьет|муйне|муй[\s-]*не)\b', "Вьетнама", None, 16, None),
-                    # ═══ Шри-Ланка (country=12) ═══
-                    (r'\b(?:коломбо|бентот[аы]|хиккадув[аы]|унаватун[аы])\b', "Шри-Ланки", None, 12, None),
-                    # ═══ Мальдивы (country=8) ═══
-                    (r'\b(?:мале|маафуш\w*)\b', "Мальдив", None, 8, None),
-                    # ═══ Куба (country=10) ═══
-                    (r'\b(?:варадеро|гаван[аы])\b', "Кубы", None, 10, None),
-                    # ═══ Доминикана (country=11) ═══
-                    (r'\b(?:пунта[\s-]*кан[аы]|бока[\s-]*чик[аы])\b', "Доминиканы", None, 11, None),
-                    # ═══ Испания (country=14) — острова ═══
-                    (r'\b(?:тенериф\w*|канар\w*)\b', "Испании", "101", 14, None),
-                    (r'\b(?:майорк\w*|мальорк\w*)\b', "Испании", None, 14, None),
-                    # ═══ Греция (country=6) ═══
-                    (r'\b(?:крит\w*)\b', "Греции", None, 6, None),
-                    (r'\b(?:родос\w*)\b', "Греции", None, 6, None),
-                    # ═══ Кипр (country=15) ═══
-                    (r'\b(?:пафос\w*|лимассол\w*|ларнак\w*|айя[\s-]*нап\w*|протарас\w*)\b', "Кипра", None, 15, None),
-                ]
+                user_text_for_region = self._recent_user_text(20, ("Результаты вызванных функций",))
                 
-                mentioned_resort = None
-                for pattern, country_name, region_id, country_code, parent_region in resort_patterns:
-                    for _m in re.finditer(pattern, user_text_for_region):
-                        if _is_departure_context(user_text_for_region, _m.start()):
-                            continue
-                        mentioned_resort = (_m.group(), country_name, region_id, country_code, parent_region)
-                        break
-                    if mentioned_resort:
-                        break
+                mentioned_resort = _find_mentioned_resort(user_text_for_region)
                 
                 if mentioned_resort:
                     resort_name, country_name, region_id, country_code, parent_region = mentioned_resort
-                    self._metrics.setdefault("resort_without_region_detections", 0)
-                    self._metrics["resort_without_region_detections"] += 1
+                    self._metrics.resort_without_region_detections += 1
                     
                     # ── Fix P2: Корректируем country если модель передала не ту страну ──
-                    # Курорт может принадлежать ТОЛЬКО одной стране — country_code из resort_patterns
+                    # Курорт может принадлежать ТОЛЬКО одной стране — country_code из _RESORT_PATTERNS
                     # является единственным правильным значением.
                     # Пример: "Сочи" = Россия (47), даже если модель передала country=4 (Турция)
                     if country_code and int(args.get("country", 0)) != int(country_code):
@@ -4339,7 +4732,7 @@ class YandexGPTHandler:
                     # Tier 2: Знаем parent_region — ищем его ID через API
                     elif parent_region:
                         try:
-                            api_country = country_code  # Fix P2: всегда используем country из resort_patterns
+                            api_country = country_code  # Fix P2: всегда используем country из _RESORT_PATTERNS
                             regions_list = await self.tourvisor.get_regions(int(api_country))
                             parent_lower = parent_region.lower().strip()
                             for r in regions_list:
@@ -4364,7 +4757,7 @@ class YandexGPTHandler:
                     # Tier 3: ID неизвестен и нет parent — пробуем найти совпадение по имени через API
                     if not resolved and not region_id and not parent_region:
                         try:
-                            api_country = country_code  # Fix P2: всегда используем country из resort_patterns
+                            api_country = country_code  # Fix P2: всегда используем country из _RESORT_PATTERNS
                             regions_list = await self.tourvisor.get_regions(int(api_country))
                             # Ищем регион, чьё имя содержит resort_name (или наоборот)
                             for r in regions_list:
@@ -4470,14 +4863,28 @@ class YandexGPTHandler:
 
             # ── Проверка полноты каскада (Fix 3B — блокирующая проверка) ──
             # Анализируем историю диалога, чтобы убедиться, что клиент ЯВНО указал критичные слоты
-            is_cascade_complete, missing_slots = _check_cascade_slots(
-                self.full_history, args,
-                is_follow_up=bool(self._last_search_params),
-                lead_catcher=_lead_catcher,
+            # Проверка — чистая функция от (role, content) истории и args: повторный
+            # search_tours в том же состоянии диалога (дубль вызова в одном ответе)
+            # берёт прошлый результат вместо нового прогона всех regex каскада
+            _is_follow_up = bool(self._last_search_params)
+            _cascade_key = (
+                tuple((m.get("role"), m.get("content")) for m in self.full_history),
+                json.dumps(args, sort_keys=True, ensure_ascii=False, default=str),
+                _is_follow_up, _lead_catcher,
             )
+            _memo = self._cascade_check_memo
+            if _memo is not None and _memo[0] == _cascade_key:
+                is_cascade_complete, missing_slots = _memo[1], list(_memo[2])
+            else:
+                is_cascade_complete, missing_slots = _check_cascade_slots(
+                    self.full_history, args,
+                    is_follow_up=_is_follow_up,
+                    lead_catcher=_lead_catcher,
+                )
+                self._cascade_check_memo = (_cascade_key, is_cascade_complete, list(missing_slots))
             
             if not is_cascade_complete:
-                self._metrics["cascade_incomplete_detections"] += 1
+                self._metrics.cascade_incomplete_detections += 1
                 logger.warning(
                     "⚠️ CASCADE-INCOMPLETE: клиент НЕ указал %s — блокируем search_tours и nudge модель",
                     ", ".join(missing_slots)
@@ -4575,14 +4982,8 @@ class YandexGPTHandler:
                     )
                 elif args.get("starsbetter") == 1:
                     if _starsbetter_from_cache:
-                        _recent_user = " ".join([
-                            msg.get("content", "") for msg in self.full_history[-6:]
-                            if msg.get("role") == "user" and msg.get("content")
-                        ]).lower()
-                        _exact_only = re.search(
-                            r'(?:только\s+\d|именно\s+\d|строго\s+\d|не\s+выше|не\s+больше)',
-                            _recent_user
-                        )
+                        _recent_user = self._recent_user_text(6)
+                        _exact_only = _STARS_EXACT_ONLY_RE.search(_recent_user)
                         if _exact_only:
                             args["starsbetter"] = 0
                             logger.info(
@@ -4643,7 +5044,7 @@ class YandexGPTHandler:
             
             # ── Safety-net: bare "N-M" misinterpreted as dates when it's nights ──
             _df_raw = args.get("datefrom", "")
-            if _df_raw and re.match(r'^\d{1,2}[-–]\d{1,2}$', str(_df_raw)):
+            if _df_raw and _BARE_NIGHTS_RANGE_RE.match(str(_df_raw)):
                 _last_asst_msgs = [
                     msg.get("content", "") for msg in self.full_history[-4:]
                     if msg.get("role") == "assistant" and msg.get("content")
@@ -4670,21 +5071,8 @@ class YandexGPTHandler:
             # ── Safety-net: dateto==datefrom при диапазонных словах → расширяем ──
             if (args.get("dateto") and args.get("datefrom")
                     and args["dateto"] == args["datefrom"]):
-                _user_date_text = " ".join([
-                    msg.get("content", "") for msg in self.full_history[-30:]
-                    if msg.get("role") == "user" and msg.get("content")
-                ]).lower()
-                _has_range = re.search(
-                    r'(?:январ\w*[\s\-–]+феврал|феврал\w*[\s\-–]+март|'
-                    r'март\w*[\s\-–]+апрел|апрел\w*[\s\-–]+ма[йя]|'
-                    r'ма[йя]\w*[\s\-–]+июн|июн\w*[\s\-–]+июл|'
-                    r'июл\w*[\s\-–]+август|август\w*[\s\-–]+сентябр|'
-                    r'сентябр\w*[\s\-–]+октябр|октябр\w*[\s\-–]+ноябр|'
-                    r'ноябр\w*[\s\-–]+декабр|'
-                    r'ближайш|любую?\s+дат|всё?\s*равно.*когда|'
-                    r'диапазон|с\s+\d{1,2}\s*(?:по|-)\s*\d{1,2})',
-                    _user_date_text
-                )
+                _user_date_text = self._recent_user_text(30)
+                _has_range = _DATE_RANGE_WORDS_RE.search(_user_date_text)
                 if _has_range:
                     from datetime import datetime as _dt_cls, timedelta as _td_cls
                     try:
@@ -4700,14 +5088,8 @@ class YandexGPTHandler:
 
             # ── Safety-net: прогрессивный dateto для «ближайший вылет» ──
             if args.get("datefrom"):
-                _nearest_text = " ".join([
-                    msg.get("content", "") for msg in self.full_history[-6:]
-                    if msg.get("role") == "user" and msg.get("content")
-                ]).lower()
-                _is_nearest = re.search(
-                    r'(?:ближайш|всё?\s*равно.*когда|неважно\s*когда|какой\s+есть|любую?\s+дат)',
-                    _nearest_text
-                )
+                _nearest_text = self._recent_user_text(6)
+                _is_nearest = _NEAREST_DATE_RE.search(_nearest_text)
                 if _is_nearest:
                     _current_country = _safe_int(args.get("country"))
                     if _current_country and _current_country != self._last_nearest_country:
@@ -4733,15 +5115,8 @@ class YandexGPTHandler:
 
             # ── Safety-net: вычисление ночей из «с X по Y [месяц]» или «X-Y месяц» ──
             if args.get("datefrom") and not args.get("nightsfrom"):
-                _user_nights_text = " ".join([
-                    msg.get("content", "") for msg in self.full_history[-6:]
-                    if msg.get("role") == "user" and msg.get("content")
-                ]).lower()
-                _date_range_match = re.search(
-                    r'(?:с\s+)?(\d{1,2})\s*(?:по|до|-|–)\s*(\d{1,2})\s*'
-                    r'(?:январ|феврал|март|апрел|ма[йя]|июн|июл|август|сентябр|октябр|ноябр|декабр)',
-                    _user_nights_text
-                )
+                _user_nights_text = self._recent_user_text(6)
+                _date_range_match = _DAY_RANGE_NIGHTS_RE.search(_user_nights_text)
                 if _date_range_match:
                     try:
                         _day_from = int(_date_range_match.group(1))
@@ -4845,7 +5220,7 @@ class YandexGPTHandler:
                 args["rating"] = 3
                 logger.info("🛡️ RATING DEFAULT: injected rating=3 (API floor >=3.5)")
 
-            self._metrics["total_searches"] += 1
+            self._metrics.total_searches += 1
             self._apply_tenant_search_filters(args)
 
             # CHILD-GUARDRAIL: занулить фантомного ребёнка + обрезать лишние возрасты.
@@ -4905,7 +5280,7 @@ class YandexGPTHandler:
             self._requestid_poll_count = 0
             # Инвалидируем tourid_map, prefetch cache и пул результатов
             self._tourid_map = {}
-            self._tour_details_cache = {}
+            self._tour_details_cache = _BoundedCache(_TOUR_DETAILS_CACHE_MAX)
             self._tour_actualized_id = None
             self._results_pool = []
             self._results_pool_offset = 0
@@ -4969,8 +5344,7 @@ class YandexGPTHandler:
             # ── P1: Валидация requestid — отклоняем плейсхолдеры ──
             request_id = str(args.get("requestid", ""))
             if not request_id.replace(" ", "").isdigit():
-                self._metrics.setdefault("placeholder_id_rejections", 0)
-                self._metrics["placeholder_id_rejections"] += 1
+                self._metrics.placeholder_id_rejections += 1
                 if self._last_requestid:
                     logger.warning(
                         "⚠️ PLACEHOLDER-REJECT: requestid='%s' содержит буквы → подставляем кэшированный %s",
@@ -5552,8 +5926,7 @@ class YandexGPTHandler:
             # ── P1: Валидация requestid ──
             _rid = str(args.get("requestid", ""))
             if not _rid.replace(" ", "").isdigit():
-                self._metrics.setdefault("placeholder_id_rejections", 0)
-                self._metrics["placeholder_id_rejections"] += 1
+                self._metrics.placeholder_id_rejections += 1
                 if self._last_requestid:
                     logger.warning("⚠️ PLACEHOLDER-REJECT get_search_results: '%s' → кэш %s", _rid, self._last_requestid)
                     args["requestid"] = self._last_requestid
@@ -5660,15 +6033,20 @@ class YandexGPTHandler:
             
             # ── Уровень 1: для каждого отеля выбираем ЛУЧШИЙ тур по релевантности ──
             _scored_hotels = []
+            # Общие для всех отелей параметры — разбираем один раз до цикла
+            _req_meal = _safe_int((self._last_search_params or {}).get("meal"), None)
+            _ideal_dt = _fast_parse_dmy(self._ideal_datefrom) if self._ideal_datefrom else None
+            _debug = logger.isEnabledFor(logging.DEBUG)
             for h in hotels:
                 tours = h.get("tours", {}).get("tour", [])
-                logger.debug(
-                    "🏨 %s  tours_in_hotel=%d  nights_available=%s",
-                    (h.get("hotelname") or "?")[:30],
-                    len(tours),
-                    sorted(set(int(t.get("nights", 0)) for t in tours if t.get("nights")))
-                )
-                _req_meal = _safe_int(self._last_search_params.get("meal"), None)
+                if _debug:
+                    # Набор ночей строится обходом всех туров отеля — только для DEBUG
+                    logger.debug(
+                        "🏨 %s  tours_in_hotel=%d  nights_available=%s",
+                        (h.get("hotelname") or "?")[:30],
+                        len(tours),
+                        sorted(set(int(t.get("nights", 0)) for t in tours if t.get("nights")))
+                    )
                 best_tour = _pick_best_tour(
                     tours, self._ideal_datefrom,
                     self._ideal_nightsfrom, self._ideal_nightsto,
@@ -5725,12 +6103,8 @@ class YandexGPTHandler:
                         self._ideal_nightsfrom, self._ideal_nightsto
                     ) * 15
                 if self._ideal_datefrom and best_tour:
-                    try:
-                        _fly = _dt.strptime(best_tour.get("flydate", ""), "%d.%m.%Y")
-                        _ideal = _dt.strptime(self._ideal_datefrom, "%d.%m.%Y")
-                        _rel_score += abs((_fly - _ideal).days)
-                    except (ValueError, TypeError):
-                        _rel_score += 99
+                    _fly = _fast_parse_dmy(best_tour.get("flydate", ""))
+                    _rel_score += abs((_fly - _ideal_dt).days) if _fly and _ideal_dt else 99
                 
                 _scored_hotels.append((_rel_score, _safe_int(best_tour.get("price"), 999999999), entry))
                 if best_tour:
@@ -5743,7 +6117,7 @@ class YandexGPTHandler:
             
             # ── Уровень 2: сортировка отелей ──
             if not self._has_budget and self._ideal_datefrom:
-                _scored_hotels.sort(key=lambda x: (x[0], x[1]))
+                _scored_hotels.sort(key=itemgetter(0, 1))
                 _top5 = _scored_hotels[:5]
                 logger.info(
                     "🎯 RELEVANCE SORT: %d hotels re-ranked. Top5 nights: %s",
@@ -5751,7 +6125,7 @@ class YandexGPTHandler:
                     [item[2].get("tour", {}).get("nights") for item in _top5]
                 )
             else:
-                _scored_hotels.sort(key=lambda x: x[1])
+                _scored_hotels.sort(key=itemgetter(1))
                 logger.info("💰 PRICE SORT: %d hotels sorted by price (budget specified)", len(_scored_hotels))
             
             # ── Subscription reveal: ответ на тизер мониторинга ──
@@ -6200,8 +6574,7 @@ class YandexGPTHandler:
             # ── P1: Валидация tourid — отклоняем плейсхолдеры, пробуем resolve из кэша ──
             _tid = str(args.get("tourid", ""))
             if not _tid.replace(" ", "").isdigit():
-                self._metrics.setdefault("placeholder_id_rejections", 0)
-                self._metrics["placeholder_id_rejections"] += 1
+                self._metrics.placeholder_id_rejections += 1
                 resolved = self._resolve_tourid_from_text(_tid)
                 if resolved:
                     logger.warning("⚠️ PLACEHOLDER-REJECT actualize_tour: '%s' → resolved tourid=%s", _tid, resolved)
@@ -6249,8 +6622,7 @@ class YandexGPTHandler:
             # ── P1: Валидация tourid ──
             _tid = str(args.get("tourid", ""))
             if not _tid.replace(" ", "").isdigit():
-                self._metrics.setdefault("placeholder_id_rejections", 0)
-                self._metrics["placeholder_id_rejections"] += 1
+                self._metrics.placeholder_id_rejections += 1
                 resolved = self._resolve_tourid_from_text(_tid)
                 if resolved:
                     logger.warning("⚠️ PLACEHOLDER-REJECT get_tour_details: '%s' → resolved tourid=%s", _tid, resolved)
@@ -6632,7 +7004,7 @@ class YandexGPTHandler:
                     if msg.get("role") == "user" and msg.get("content")
                     and not msg.get("content", "").startswith("Результаты")
                 ]).lower()
-                _has_departure = any(re.search(p, _hot_departure_text) for p in _DEPARTURE_PATTERNS)
+                _has_departure = _DEPARTURE_RX.search(_hot_departure_text) is not None
                 if not _has_departure:
                     logger.warning("🛡️ HOT-TOURS-SAFETY: нет city code и нет города в тексте — блокируем")
                     return {
@@ -6804,10 +7176,7 @@ class YandexGPTHandler:
                 })
 
             # ── P12: Динамическая формулировка цены с учётом группы ──
-            _user_msgs = " ".join([
-                msg.get("content", "") for msg in self.full_history[-20:]
-                if msg.get("role") == "user" and msg.get("content")
-            ]).lower()
+            _user_msgs = self._recent_user_text(20)
             # Считаем путешественников из текста
             _total_travelers = 0
             _adults_match = re.search(r'(\d+)\s*(?:взр|в\b)', _user_msgs)
@@ -8519,7 +8888,7 @@ class YandexGPTHandler:
         self._smart_alt_awaiting_pick = False
         
         # Инкрементируем счётчик сообщений
-        self._metrics["total_messages"] += 1
+        self._metrics.total_messages += 1
         
         user_item = {"role": "user", "content": user_message}
         
@@ -8620,9 +8989,8 @@ class YandexGPTHandler:
                         len(self.full_history)
                     )
                     if len(self.full_history) > 8:
-                        trimmed_start = self.full_history[:2]  # первое сообщение пользователя + первый ответ
-                        trimmed_end = self.full_history[-4:]    # последние 4 сообщения (актуальный контекст)
-                        self.full_history = trimmed_start + trimmed_end
+                        # первое сообщение пользователя + первый ответ + последние 4 (актуальный контекст)
+                        del self.full_history[2:-4]
                         logger.info(
                             "✅ History trimmed to %d messages (2 start + 4 end)",
                             len(self.full_history)
@@ -8746,7 +9114,7 @@ class YandexGPTHandler:
                 # Skip if tour cards already found this turn
                 if final_text and not self._pending_tour_cards and _is_promised_search(final_text):
                     empty_retries += 1
-                    self._metrics["promised_search_detections"] += 1
+                    self._metrics.promised_search_detections += 1
                     logger.warning("⚠️ PROMISED-SEARCH detected (#%d): \"%s\" — nudging model to call function",
                                    empty_retries, final_text[:150])
                     if empty_retries >= 2:
@@ -8755,15 +9123,11 @@ class YandexGPTHandler:
                     else:
                         # Nudge: говорим модели ВЫПОЛНИТЬ поиск, а не описывать намерение
                         self.input_list = [
-                            {
-                                "type": "function_call_output",
-                                "call_id": "_nudge_search",
-                                "output": json.dumps({
-                                    "error": "СИСТЕМНАЯ ОШИБКА: Ты ОПИСАЛ намерение поиска текстом, но НЕ вызвал функцию. "
-                                             "НЕМЕДЛЕННО вызови get_current_date(), затем search_tours() с собранными параметрами. "
-                                             "НИКОГДА не пиши 'сейчас поищу' — ВЫЗЫВАЙ функцию!"
-                                }, ensure_ascii=False)
-                            }
+                            _function_call_output("_nudge_search", json.dumps({
+                                "error": "СИСТЕМНАЯ ОШИБКА: Ты ОПИСАЛ намерение поиска текстом, но НЕ вызвал функцию. "
+                                         "НЕМЕДЛЕННО вызови get_current_date(), затем search_tours() с собранными параметрами. "
+                                         "НИКОГДА не пиши 'сейчас поищу' — ВЫЗЫВАЙ функцию!"
+                            }, ensure_ascii=False))
                         ]
                         continue
                 
@@ -8778,8 +9142,7 @@ class YandexGPTHandler:
                 plaintext_calls = _extract_plaintext_tool_calls(final_text) if final_text else []
                 if plaintext_calls:
                     logger.warning("⚠️ PLAINTEXT-TOOL-CALL: found %d call(s) in text, executing as safety-net", len(plaintext_calls))
-                    self._metrics.setdefault("plaintext_tool_call_recoveries", 0)
-                    self._metrics["plaintext_tool_call_recoveries"] += 1
+                    self._metrics.plaintext_tool_call_recoveries += 1
                     
                     pt_results = []
                     pt_summary_parts = []
@@ -8820,8 +9183,7 @@ class YandexGPTHandler:
                             "⚠️ REJECTED-TOOL-CALL in text: model tried unknown function — nudging. Text: %s",
                             final_text[:200]
                         )
-                        self._metrics.setdefault("rejected_tool_calls_sanitized", 0)
-                        self._metrics["rejected_tool_calls_sanitized"] += 1
+                        self._metrics.rejected_tool_calls_sanitized += 1
                         # Добавляем подсказку модели использовать только доступные функции
                         self.full_history.append({"role": "assistant", "content": final_text})
                         self.input_list = [{
@@ -8844,8 +9206,7 @@ class YandexGPTHandler:
                 # Модель иногда эхо-повторяет записи из full_history
                 if final_text and final_text.lstrip().startswith("Результаты запросов"):
                     logger.warning("⚠️ RESULT-LEAK detected: model echoed raw results → nudging")
-                    self._metrics.setdefault("result_leak_filtered", 0)
-                    self._metrics["result_leak_filtered"] += 1
+                    self._metrics.result_leak_filtered += 1
                     if self._pending_tour_cards:
                         final_text = "Вот что нашёл по вашему запросу! Посмотрите варианты и скажите, какой заинтересовал — расскажу подробнее."
                     else:
@@ -9063,7 +9424,7 @@ class YandexGPTHandler:
                         len(self.full_history)
                     )
                     if len(self.full_history) > 8:
-                        self.full_history = self.full_history[:2] + self.full_history[-4:]
+                        del self.full_history[2:-4]
                         logger.info("✅ History trimmed to %d messages", len(self.full_history))
                     self.previous_response_id = None
                     self.input_list = list(self.full_history)
@@ -9203,22 +9564,18 @@ class YandexGPTHandler:
                 # ⚡ Детект «обещанного, но не выполненного поиска» (stream)
                 if not self._pending_tour_cards and _is_promised_search(full_text):
                     self._empty_iterations += 1
-                    self._metrics["promised_search_detections"] += 1
+                    self._metrics.promised_search_detections += 1
                     logger.warning("⚠️ STREAM PROMISED-SEARCH detected (#%d): \"%s\" — nudging model",
                                    self._empty_iterations, full_text[:150])
                     if self._empty_iterations >= 2:
                         logger.warning("⚠️ STREAM PROMISED-SEARCH: giving up after %d retries", self._empty_iterations)
                     else:
                         self.input_list = [
-                            {
-                                "type": "function_call_output",
-                                "call_id": "_nudge_search",
-                                "output": json.dumps({
-                                    "error": "СИСТЕМНАЯ ОШИБКА: Ты ОПИСАЛ намерение поиска текстом, но НЕ вызвал функцию. "
-                                             "НЕМЕДЛЕННО вызови get_current_date(), затем search_tours() с собранными параметрами. "
-                                             "НИКОГДА не пиши 'сейчас поищу' — ВЫЗЫВАЙ функцию!"
-                                }, ensure_ascii=False)
-                            }
+                            _function_call_output("_nudge_search", json.dumps({
+                                "error": "СИСТЕМНАЯ ОШИБКА: Ты ОПИСАЛ намерение поиска текстом, но НЕ вызвал функцию. "
+                                         "НЕМЕДЛЕННО вызови get_current_date(), затем search_tours() с собранными параметрами. "
+                                         "НИКОГДА не пиши 'сейчас поищу' — ВЫЗЫВАЙ функцию!"
+                            }, ensure_ascii=False))
                         ]
                         continue
                 
@@ -9226,8 +9583,7 @@ class YandexGPTHandler:
                 plaintext_calls = _extract_plaintext_tool_calls(full_text)
                 if plaintext_calls:
                     logger.warning("⚠️ STREAM PLAINTEXT-TOOL-CALL: found %d call(s), executing", len(plaintext_calls))
-                    self._metrics.setdefault("plaintext_tool_call_recoveries", 0)
-                    self._metrics["plaintext_tool_call_recoveries"] += 1
+                    self._metrics.plaintext_tool_call_recoveries += 1
                     self._empty_iterations = 0
                     
                     pt_results = []
@@ -9427,9 +9783,8 @@ class YandexGPTHandler:
         except Exception:
             pass
     
-    def reset(self):
-        """Сбросить историю диалога"""
-        old_len = len(self.full_history)
+    def _reset_dialogue_state(self):
+        """Состояние одного диалога — общее для reset() всех хендлеров."""
         self.input_list = []
         self.full_history = []
         self.previous_response_id = None
@@ -9439,7 +9794,7 @@ class YandexGPTHandler:
         self._last_message_usage = None
         self._last_departure_city = "Москва"
         self._last_departure_id = 1
-        self._tour_details_cache = {}
+        self._tour_details_cache = _BoundedCache(_TOUR_DETAILS_CACHE_MAX)
         self._tour_actualized_id = None
         self._crm_submitted = None
         self._shown_flight_signatures = {}
@@ -9447,6 +9802,11 @@ class YandexGPTHandler:
         self._status_lookup_calls = 0
         self._status_lookup_attempts = 0
         self._status_lookup_verified_uid = None
+
+    def reset(self):
+        """Сбросить историю диалога"""
+        old_len = len(self.full_history)
+        self._reset_dialogue_state()
         logger.info("🔄 HANDLER RESET  cleared %d messages from full_history", old_len)
 
 